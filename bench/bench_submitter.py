@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+# Measures the submitter's own overhead against a local mock ComfyUI server that renders
+# instantly, so every number here is time spent in the client, not on a GPU.
+#
+#   python bench/bench_submitter.py --sizes 10 100 1000 10000 100000
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "core"))
+
+import wedge_submitter
+from mock_comfy_server import MockComfyServer
+
+WORKFLOW_PATH = os.path.join(REPO_ROOT, "templates", "examples", "example_workflow_api.json")
+CONFIG_PATH = os.path.join(REPO_ROOT, "templates", "examples", "example_wedge_config.json")
+
+
+def serve_mock(address_queue, job_latency, progress_steps):
+    # The mock runs in its own process so its CPU time isn't counted as client time.
+    server = MockComfyServer(job_latency=job_latency, progress_steps=progress_steps).start()
+    address_queue.put(server.address)
+    while True:
+        time.sleep(3600)
+
+
+def start_mock_servers(count, job_latency, progress_steps):
+    address_queue = multiprocessing.Queue()
+    processes = []
+    for _ in range(count):
+        process = multiprocessing.Process(target=serve_mock, args=(address_queue, job_latency, progress_steps), daemon=True)
+        process.start()
+        processes.append(process)
+    return [address_queue.get(timeout=30) for _ in processes], processes
+
+
+def build_wedge(size):
+    # One seed axis with size values. Seeds don't change the graph shape, so the
+    # encoded prompt is the same size for every combination.
+    loaded_workflow = wedge_submitter.load_json(WORKFLOW_PATH)
+    wedge_config = wedge_submitter.load_json(CONFIG_PATH)
+    wedge_config["param_wedges"] = {"seed": ["KSampler", [0, size - 1, 1], "minmax"]}
+    wedge_submitter.add_wedge_config_string_node(loaded_workflow, wedge_config)
+    return loaded_workflow, wedge_config["param_wedges"]
+
+
+def run_wedge(size, server_addresses, max_in_flight):
+    loaded_workflow, params = build_wedge(size)
+    all_combinations = wedge_submitter.generate_combinations(params)
+    scheduler = wedge_submitter.WedgeScheduler(
+        loaded_workflow, params, "bench/images", "bench", all_combinations.enumerate(), size, size
+    )
+    asyncio.run(scheduler.run(server_addresses, max_in_flight=max_in_flight, stall_timeout=0))
+    return scheduler
+
+
+def measure_throughput(size, server_addresses, max_in_flight):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    scheduler = run_wedge(size, server_addresses, max_in_flight)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    completed = sum(worker.completed for worker in scheduler.workers)
+    return {
+        "size": size,
+        "completed": completed,
+        "wall_s": round(wall, 3),
+        "prompts_per_s": round(completed / wall, 1) if wall else 0,
+        "client_cpu_ms_per_image": round(cpu * 1000 / max(1, completed), 3),
+    }
+
+
+def measure_memory(size, server_addresses, max_in_flight):
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run_wedge(size, server_addresses, max_in_flight)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"peak_kb": round((peak - baseline) / 1024, 1), "retained_kb": round((current - baseline) / 1024, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark wedge submission throughput against mock ComfyUI servers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--servers", type=int, default=1, help="Number of mock servers")
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each mock render takes")
+    parser.add_argument("--progress-steps", type=int, default=0, help="Progress messages per sampler (default: the sampler's steps)")
+    parser.add_argument("--skip-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--json", action="store_true", help="Print one JSON result per line")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    server_addresses, processes = start_mock_servers(args.servers, args.latency, args.progress_steps)
+
+    if not args.json:
+        print(f"{'size':>8} {'prompts/s':>10} {'cpu ms/img':>11} {'wall s':>9} {'peak KB':>10} {'retained KB':>12}")
+    for size in args.sizes:
+        result = measure_throughput(size, server_addresses, args.max_in_flight)
+        if not args.skip_memory:
+            result.update(measure_memory(size, server_addresses, args.max_in_flight))
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(f"{result['size']:>8} {result['prompts_per_s']:>10} {result['client_cpu_ms_per_image']:>11} "
+                  f"{result['wall_s']:>9} {result.get('peak_kb', '-'):>10} {result.get('retained_kb', '-'):>12}", flush=True)
+
+    for process in processes:
+        process.terminate()
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+
+import aiohttp
+
+
+class ComfyClient:
+    # Async client for a single ComfyUI server. HTTP requests share one pooled keep-alive
+    # session, finished prompt histories are cached so each one is fetched only once, and
+    # the websocket is read through receive().
+    #
+    #   async with ComfyClient("127.0.0.1:8188") as client:
+    #       prompt_id = (await client.queue_prompt(workflow))["prompt_id"]
+    #       message = await client.receive(timeout=1)
+
+    def __init__(self, server_address, client_id=None, max_connections=8):
+        self.server_address = server_address
+        self.client_id = client_id or str(uuid.uuid4())
+        self.max_connections = max_connections
+        self.session = None
+        self.ws = None
+        self.history_cache = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def url(self, path):
+        return "http://{}{}".format(self.server_address, path)
+
+    async def open(self, connect_websocket=True):
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        self.session = aiohttp.ClientSession(connector=connector)
+        if connect_websocket:
+            self.ws = await self.session.ws_connect(
+                "ws://{}/ws?clientId={}".format(self.server_address, self.client_id),
+                max_msg_size=0,
+            )
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+            self.ws = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # ------------------ HTTP ------------------
+
+    async def get_json(self, path):
+        async with self.session.get(self.url(path)) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def post_json(self, path, data):
+        # data can be pre-encoded bytes, otherwise it is serialized here.
+        if not isinstance(data, (bytes, bytearray)):
+            data = json.dumps(data).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        async with self.session.post(self.url(path), data=data, headers=headers) as response:
+            body = await response.read()
+            if response.status >= 400:
+                raise PromptRejectedError(response.status, body.decode("utf-8", "replace"))
+            return json.loads(body) if body else {}
+
+    def encode_prompt(self, prompt):
+        return json.dumps({"prompt": prompt, "client_id": self.client_id}).encode("utf-8")
+
+    async def queue_prompt(self, prompt):
+        # prompt can be the workflow dict or an already encoded /prompt request body.
+        data = prompt if isinstance(prompt, (bytes, bytearray)) else self.encode_prompt(prompt)
+        return await self.post_json("/prompt", data)
+
+    async def get_history(self, prompt_id, refresh=False):
+        if not refresh and prompt_id in self.history_cache:
+            return self.history_cache[prompt_id]
+        history = (await self.get_json("/history/{}".format(prompt_id))).get(prompt_id)
+        if history is not None and history.get("status", {}).get("completed") is not None:
+            self.history_cache[prompt_id] = history
+        return history
+
+    def forget(self, prompt_id):
+        self.history_cache.pop(prompt_id, None)
+
+    async def delete_queued(self, prompt_ids):
+        await self.post_json("/queue", {"delete": list(prompt_ids)})
+
+    async def interrupt(self):
+        await self.post_json("/interrupt", {})
+
+    async def get_queue(self):
+        return await self.get_json("/queue")
+
+    def view_params(self, image):
+        return {"filename": image["filename"], "subfolder": image.get("subfolder", ""), "type": image.get("type", "output")}
+
+    async def get_image_size(self, image):
+        # Size in bytes of an output image, without downloading it. None if the server doesn't say.
+        async with self.session.head(self.url("/view"), params=self.view_params(image)) as response:
+            response.raise_for_status()
+            return response.content_length
+
+    async def download_image(self, image, path, chunk_size=2**16):
+        # Streams an output image from /view to path in chunks, through a .part file that is only
+        # renamed once the whole image arrived. Returns (size, sha256 hex digest).
+        part_path = path + ".part"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with self.session.get(self.url("/view"), params=self.view_params(image)) as response:
+                response.raise_for_status()
+                expected_size = response.content_length
+                with open(part_path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            if expected_size is not None and size != expected_size:
+                raise ValueError("{}: received {} of {} bytes".format(image["filename"], size, expected_size))
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        return size, digest.hexdigest()
+
+    # ------------------ WEBSOCKET ------------------
+
+    async def receive(self, timeout=None):
+        # Returns the next JSON message from the websocket, or None if nothing arrived within
+        # timeout. Binary preview frames are skipped. Raises ConnectionError once closed.
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - loop.time()
+            # aiohttp reads a timeout of 0 as no timeout at all.
+            if remaining is not None and remaining <= 0:
+                return None
+            try:
+                msg = await self.ws.receive(timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                return json.loads(msg.data)
+            if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING,
+                            aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                raise ConnectionError("websocket closed: {}".format(msg.data or msg.type.name))
+
+    async def messages(self):
+        while True:
+            yield await self.receive()
+
+
+class PromptRejectedError(Exception):
+    def __init__(self, status, body):
+        super().__init__("HTTP {}: {}".format(status, body))
+        self.status = status
+        self.body = body
+
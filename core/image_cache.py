@@ -0,0 +1,134 @@
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QRunnable, QSize, Qt, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader
+
+
+class ImageCache:
+    # LRU of decoded images already scaled to the size they are displayed at, bounded by the
+    # total bytes of image data held rather than by a number of images.
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        image = self.images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self.images.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def __contains__(self, key):
+        return key in self.images
+
+    def put(self, key, image):
+        if key in self.images:
+            self.total_bytes -= self.images.pop(key).sizeInBytes()
+        self.images[key] = image
+        self.total_bytes += image.sizeInBytes()
+        self.trim(keep=1)
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.trim()
+
+    def trim(self, keep=0):
+        while self.total_bytes > self.max_bytes and len(self.images) > keep:
+            _, evicted = self.images.popitem(last=False)
+            self.total_bytes -= evicted.sizeInBytes()
+
+    def clear(self):
+        self.images.clear()
+        self.total_bytes = 0
+
+    def stats_text(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        return (f"Cache: {len(self.images)} images, {self.total_bytes / 2**20:.0f}/{self.max_bytes / 2**20:.0f} MB, "
+                f"hits {self.hits}, misses {self.misses} ({hit_rate:.0%})")
+
+
+def load_scaled_image(path, size):
+    # Decodes path and scales it to fit size. QImage (unlike QPixmap) is safe off the GUI thread.
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    image = reader.read()
+    if image.isNull():
+        return image
+    if size.isValid() and not size.isEmpty():
+        image = image.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image
+
+
+class ImageLoadSignals(QObject):
+    loaded = pyqtSignal(object, QImage)
+
+
+class ImageLoadTask(QRunnable):
+
+    def __init__(self, key, signals):
+        super().__init__()
+        self.key = key
+        self.signals = signals
+        # Kept by the loader until it has loaded, so a queued task can be taken back and restarted.
+        self.setAutoDelete(False)
+
+    def run(self):
+        path, width, height = self.key
+        self.signals.loaded.emit(self.key, load_scaled_image(path, QSize(width, height)))
+
+
+class ImageLoader(QObject):
+    # Loads images into an ImageCache on a background thread pool. request() is for the image
+    # the user is looking at and jumps the queue, prefetch() is for images they might look at next.
+
+    image_ready = pyqtSignal(object)
+
+    def __init__(self, cache, max_threads=None, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.pool = QThreadPool(self)
+        if max_threads:
+            self.pool.setMaxThreadCount(max_threads)
+        # key -> (task, priority) of loads that haven't finished.
+        self.pending = {}
+        self.signals = ImageLoadSignals()
+        self.signals.loaded.connect(self.on_loaded)
+
+    def request(self, key):
+        self.submit(key, priority=1)
+
+    def prefetch(self, keys):
+        for key in keys:
+            if key not in self.cache:
+                self.submit(key, priority=0)
+
+    def submit(self, key, priority):
+        if key in self.pending:
+            task, pending_priority = self.pending[key]
+            # A queued prefetch of the image the user now looks at moves ahead of the others.
+            # tryTake fails once it has started, then it's nearly done anyway.
+            if priority > pending_priority and self.pool.tryTake(task):
+                self.pending[key] = (task, priority)
+                self.pool.start(task, priority)
+            return
+        task = ImageLoadTask(key, self.signals)
+        self.pending[key] = (task, priority)
+        self.pool.start(task, priority)
+
+    def cancel_prefetch(self):
+        # Drops queued prefetches that haven't started, e.g. after the user jumps far away.
+        self.pool.clear()
+        self.pending.clear()
+
+    def on_loaded(self, key, image):
+        self.pending.pop(key, None)
+        if not image.isNull():
+            self.cache.put(key, image)
+        self.image_ready.emit(key)
@@ -0,0 +1,377 @@
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for a ComfyUI server, for testing and benchmarking the wedge tools without a
+# GPU. It accepts prompts on /prompt, "renders" them one at a time with a configurable delay
+# and reports progress over /ws with the same message shapes ComfyUI uses.
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# 1x1 PNG returned by /view for images the server didn't render.
+PLACEHOLDER_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+
+class MockComfyServer:
+
+    def __init__(self, host="127.0.0.1", port=0, job_latency=0.0, latency_jitter=0.0, progress_steps=0, image_size=64):
+        self.job_latency = job_latency
+        self.latency_jitter = latency_jitter
+        self.progress_steps = progress_steps
+        self.image_size = image_size
+        # (subfolder, filename) -> prompt id, so /view can rebuild every image it rendered.
+        self.outputs = {}
+        self.jobs = queue.Queue()
+        self.queued_ids = []
+        self.deleted_ids = set()
+        self.history = {}
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.image_counter = 0
+        # Signature of every node of the last prompt, to report cached nodes like ComfyUI does.
+        self.node_signatures = {}
+        self.interrupted = threading.Event()
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.address = "{}:{}".format(*self.httpd.server_address)
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        threading.Thread(target=self.worker, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # ------------------ HTTP ------------------
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def send_body(self, body, content_type, status=200, head_only=False):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if not head_only:
+                    self.wfile.write(body)
+
+            def send_json(self, obj, status=200):
+                self.send_body(json.dumps(obj).encode("utf-8"), "application/json", status)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self.send_json({"error": "invalid json"}, 400)
+                    return
+                path = urlparse(self.path).path
+                if path == "/prompt":
+                    if not isinstance(payload.get("prompt"), dict):
+                        self.send_json({"error": {"type": "invalid_prompt", "message": "No prompt"}, "node_errors": {}}, 400)
+                        return
+                    self.send_json(server.queue_prompt(payload))
+                elif path == "/queue":
+                    server.delete(payload.get("delete", []))
+                    self.send_json({})
+                elif path == "/interrupt":
+                    server.interrupted.set()
+                    self.send_json({})
+                else:
+                    self.send_json({}, 404)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/ws":
+                    client_id = parse_qs(url.query).get("clientId", [str(uuid.uuid4())])[0]
+                    server.serve_websocket(self, client_id)
+                    self.close_connection = True
+                elif url.path.startswith("/history/"):
+                    prompt_id = url.path.rsplit("/", 1)[1]
+                    with server.lock:
+                        entry = server.history.get(prompt_id)
+                    self.send_json({prompt_id: entry} if entry else {})
+                elif url.path == "/queue":
+                    with server.lock:
+                        pending = [[0, prompt_id, {}, {}, []] for prompt_id in server.queued_ids]
+                    self.send_json({"queue_running": pending[:1], "queue_pending": pending[1:]})
+                elif url.path == "/view":
+                    self.send_body(server.view(parse_qs(url.query)), "image/png")
+                else:
+                    self.send_json({}, 404)
+
+            def do_HEAD(self):
+                url = urlparse(self.path)
+                if url.path == "/view":
+                    self.send_body(server.view(parse_qs(url.query)), "image/png", head_only=True)
+                else:
+                    self.send_body(b"", "application/json", 404, head_only=True)
+
+        return Handler
+
+    def queue_prompt(self, payload):
+        prompt_id = str(uuid.uuid4())
+        with self.lock:
+            number = len(self.queued_ids)
+            self.queued_ids.append(prompt_id)
+        self.jobs.put((prompt_id, payload))
+        self.broadcast_status()
+        return {"prompt_id": prompt_id, "number": number, "node_errors": {}}
+
+    def view(self, query):
+        # A PNG with the prompt embedded like ComfyUI does, and noise so it has a realistic size.
+        key = (query.get("subfolder", [""])[0], query.get("filename", [""])[0])
+        with self.lock:
+            prompt_id = self.outputs.get(key)
+            entry = self.history.get(prompt_id)
+        if entry is None:
+            return PLACEHOLDER_PNG
+        seed = int(hashlib.sha1((prompt_id + key[1]).encode()).hexdigest()[:8], 16)
+        return make_png(self.image_size, self.image_size, {"prompt": json.dumps(entry["prompt"][2])}, seed)
+
+    def delete(self, prompt_ids):
+        with self.lock:
+            self.deleted_ids.update(prompt_ids)
+            self.queued_ids = [p for p in self.queued_ids if p not in self.deleted_ids]
+        self.broadcast_status()
+
+    # ------------------ WEBSOCKET ------------------
+
+    def serve_websocket(self, handler, client_id):
+        key = handler.headers["Sec-WebSocket-Key"]
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        handler.send_response(101)
+        handler.send_header("Upgrade", "websocket")
+        handler.send_header("Connection", "Upgrade")
+        handler.send_header("Sec-WebSocket-Accept", accept)
+        handler.end_headers()
+        handler.wfile.flush()
+
+        outbox = queue.Queue()
+        with self.lock:
+            self.clients[client_id] = outbox
+        threading.Thread(target=self.read_websocket, args=(handler, outbox), daemon=True).start()
+        outbox.put({"type": "status", "data": {"status": self.status(), "sid": client_id}})
+        try:
+            while True:
+                message = outbox.get()
+                if message is None:
+                    handler.wfile.write(bytes([0x88, 0]))
+                    handler.wfile.flush()
+                    break
+                handler.wfile.write(encode_frame(json.dumps(message).encode("utf-8")))
+                handler.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                if self.clients.get(client_id) is outbox:
+                    del self.clients[client_id]
+
+    def read_websocket(self, handler, outbox):
+        # Only close frames matter here, anything else from the client is ignored.
+        try:
+            while True:
+                head = handler.rfile.read(2)
+                if len(head) < 2:
+                    break
+                opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", handler.rfile.read(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", handler.rfile.read(8))[0]
+                handler.rfile.read(4 + length)
+                if opcode == 0x8:
+                    break
+        except OSError:
+            pass
+        outbox.put(None)
+
+    def send(self, client_id, message_type, data):
+        with self.lock:
+            outbox = self.clients.get(client_id)
+        if outbox is not None:
+            outbox.put({"type": message_type, "data": data})
+
+    def status(self):
+        with self.lock:
+            return {"exec_info": {"queue_remaining": len(self.queued_ids)}}
+
+    def broadcast_status(self):
+        status = self.status()
+        with self.lock:
+            client_ids = list(self.clients)
+        for client_id in client_ids:
+            self.send(client_id, "status", {"status": status})
+
+    # ------------------ EXECUTION ------------------
+
+    def worker(self):
+        while True:
+            prompt_id, payload = self.jobs.get()
+            with self.lock:
+                if prompt_id in self.deleted_ids:
+                    continue
+            self.interrupted.clear()
+            self.execute(prompt_id, payload.get("prompt", {}), payload.get("client_id"))
+            with self.lock:
+                if prompt_id in self.queued_ids:
+                    self.queued_ids.remove(prompt_id)
+            self.broadcast_status()
+
+    def execute(self, prompt_id, prompt, client_id):
+        messages = []
+
+        def emit(message_type, data):
+            data = dict(data, prompt_id=prompt_id)
+            if message_type in ("execution_start", "execution_cached", "execution_success",
+                                "execution_interrupted", "execution_error"):
+                data["timestamp"] = int(time.time() * 1000)
+                messages.append([message_type, data])
+            self.send(client_id, message_type, data)
+
+        emit("execution_start", {})
+        signatures = node_signatures(prompt)
+        cached = [n for n, signature in signatures.items() if self.node_signatures.get(n) == signature]
+        self.node_signatures = signatures
+        emit("execution_cached", {"nodes": cached})
+
+        latency = max(0.0, self.job_latency + random.uniform(-self.latency_jitter, self.latency_jitter))
+        samplers = [n for n, node in prompt.items() if "Sampler" in node.get("class_type", "")]
+        per_node = latency / max(1, len(samplers))
+        batch_sizes = [node["inputs"]["batch_size"] for node in prompt.values() if isinstance(node.get("inputs", {}).get("batch_size"), int)]
+        batch_size = max(batch_sizes + [1])
+        outputs = {}
+        for node_id, node in prompt.items():
+            if node_id in cached:
+                continue
+            emit("executing", {"node": node_id, "display_node": node_id})
+            if node_id in samplers:
+                steps = self.progress_steps or node["inputs"].get("steps", 1)
+                steps = steps if isinstance(steps, int) and steps > 0 else 1
+                for step in range(1, steps + 1):
+                    if self.interrupted.is_set():
+                        emit("execution_interrupted", {"node_id": node_id, "node_type": node["class_type"], "executed": []})
+                        self.add_history(prompt_id, prompt, outputs, messages, "error")
+                        return
+                    time.sleep(per_node / steps)
+                    emit("progress", {"value": step, "max": steps, "node": node_id})
+            if node.get("class_type") == "SaveImage":
+                prefix = str(node["inputs"].get("filename_prefix", "ComfyUI"))
+                subfolder, _, name = prefix.replace("\\", "/").rpartition("/")
+                images = []
+                with self.lock:
+                    for batch_number in range(batch_size):
+                        self.image_counter += 1
+                        filename = f"{name.replace('%batch_num%', str(batch_number))}_{self.image_counter:05d}_.png"
+                        images.append({"filename": filename, "subfolder": subfolder, "type": "output"})
+                        self.outputs[(subfolder, filename)] = prompt_id
+                outputs[node_id] = {"images": images}
+                emit("executed", {"node": node_id, "display_node": node_id, "output": outputs[node_id]})
+        if not samplers:
+            time.sleep(latency)
+
+        emit("execution_success", {})
+        self.add_history(prompt_id, prompt, outputs, messages, "success")
+        emit("executing", {"node": None})
+
+    def add_history(self, prompt_id, prompt, outputs, messages, status_str):
+        entry = {
+            "prompt": [0, prompt_id, prompt, {}, list(outputs)],
+            "outputs": outputs,
+            "status": {"status_str": status_str, "completed": status_str == "success", "messages": messages},
+            "meta": {},
+        }
+        with self.lock:
+            self.history[prompt_id] = entry
+
+
+def node_signatures(prompt):
+    # A node is unchanged if its inputs and everything upstream of it are.
+    signatures = {}
+
+    def signature(node_id):
+        if node_id not in signatures:
+            node = prompt[node_id]
+            inputs = {}
+            for name, value in node.get("inputs", {}).items():
+                if isinstance(value, list) and len(value) == 2 and str(value[0]) in prompt:
+                    value = [signature(str(value[0])), value[1]]
+                inputs[name] = value
+            data = json.dumps([node.get("class_type"), inputs], sort_keys=True)
+            signatures[node_id] = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        return signatures[node_id]
+
+    for node_id in prompt:
+        signature(node_id)
+    return signatures
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def make_png(width, height, texts, seed):
+    rng = random.Random(seed)
+    raw = b"".join(b"\0" + rng.randbytes(width * 3) for _ in range(height))
+    chunks = [png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))]
+    chunks += [png_chunk(b"tEXt", key.encode("latin-1") + b"\0" + text.encode("latin-1", "replace")) for key, text in texts.items()]
+    chunks += [png_chunk(b"IDAT", zlib.compress(raw, 1)), png_chunk(b"IEND", b"")]
+    return b"\x89PNG\r\n\x1a\n" + b"".join(chunks)
+
+
+def encode_frame(data):
+    # Unmasked server-to-client text frame.
+    header = bytes([0x81])
+    if len(data) < 126:
+        header += bytes([len(data)])
+    elif len(data) < 65536:
+        header += bytes([126]) + struct.pack(">H", len(data))
+    else:
+        header += bytes([127]) + struct.pack(">Q", len(data))
+    return header + data
+
+
+# ------------------ MAIN ENTRY ------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stand-in ComfyUI server for testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds each prompt takes to 'render'")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to each render")
+    parser.add_argument("--image-size", type=int, default=64, help="Width and height of the images served by /view")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s ==== %(message)s')
+    server = MockComfyServer(args.host, args.port, args.latency, args.jitter, image_size=args.image_size).start()
+    logging.info(f"Mock ComfyUI server running on {server.address}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
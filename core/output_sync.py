@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+# Copies finished renders from ComfyUI's /view into a local folder while the wedge is still
+# running, so they can be viewed on a machine other than the server. Images are streamed to
+# disk in chunks and at most max_downloads are in progress at once, across all servers.
+
+PNG_END = b"\0\0\0\0IEND\xaeB`\x82"
+
+
+def get_out_images(history):
+    # Every saved image in a prompt's outputs. Previews (type "temp") are skipped.
+    return [image for node_output in history.get("outputs", {}).values()
+            for image in node_output.get("images", []) if image.get("type", "output") == "output"]
+
+
+def is_complete_png(path):
+    try:
+        with open(path, "rb") as f:
+            f.seek(-len(PNG_END), os.SEEK_END)
+            return f.read() == PNG_END
+    except OSError:
+        return False
+
+
+class OutputSync:
+
+    def __init__(self, folder, max_downloads=4, chunk_size=2**16):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.semaphore = asyncio.Semaphore(max(1, int(max_downloads)))
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def local_path(self, image):
+        return os.path.join(self.folder, image.get("subfolder", ""), image["filename"])
+
+    async def sync_image(self, client, image):
+        path = self.local_path(image)
+        async with self.semaphore:
+            if os.path.exists(path):
+                remote_size = await client.get_image_size(image)
+                if remote_size == os.path.getsize(path):
+                    self.skipped += 1
+                    return {"path": path, "size": remote_size}
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            size, sha256 = await client.download_image(image, path, self.chunk_size)
+        if path.lower().endswith(".png") and not is_complete_png(path):
+            os.remove(path)
+            raise ValueError(f"{image['filename']}: downloaded file is not a complete PNG")
+        self.downloaded += 1
+        self.bytes += size
+        return {"path": path, "size": size, "sha256": sha256}
+
+    async def sync_outputs(self, client, history):
+        # Local copies of every output image of a finished prompt.
+        try:
+            return await asyncio.gather(*(self.sync_image(client, image) for image in get_out_images(history)))
+        except Exception:
+            self.failed += 1
+            raise
+
+    def stats(self):
+        return (f"Output sync to {self.folder} - downloaded: {self.downloaded} ({self.bytes / 2**20:.1f} MB), "
+                f"skipped: {self.skipped}, failed: {self.failed}")
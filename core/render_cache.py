@@ -0,0 +1,151 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from png_metadata import copy_png_with_text
+from wedge_combinations import wedge_inputs
+from workflow_patch import PatchPlan, build_node_index
+
+# Renders shared between wedges, keyed by a hash of the resolved prompt. Overlapping sweeps
+# often repeat the same seed, model and settings; a combination whose prompt has already
+# been rendered is copied from the earlier image, with this wedge's metadata, instead of
+# being queued again. The index is a SQLite file that any number of wedge folders can point
+# at. Images are read and written on local disk: the sync_folder copies, or ComfyUI's own
+# output folder when the server runs on this machine.
+
+SCHEMA_VERSION = 1
+
+
+def normalize_number(value):
+    # 7.0 and 7 render the same, so integral floats are encoded as ints. Lists are node links or
+    # list inputs.
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [normalize_number(v) for v in value]
+    return value
+
+
+class RenderKeyPlan(PatchPlan):
+    # PatchPlan that encodes numbers the same however a wedge or workflow spells them.
+
+    def encode_workflow(self, values):
+        return super().encode_workflow([normalize_number(value) for value in values])
+
+
+def compile_render_key_plan(loaded_workflow, params, out_node_number=None, wedge_node_title="WEDGE_string"):
+    # RenderKeyPlan of just what decides the pixels: no WEDGE_string node, node titles or output
+    # filename prefix, with sorted keys so the same prompt encodes the same from any wedge.
+    node_index = build_node_index(loaded_workflow)
+    slots = [(node_index[node_title], name) for name, node_title, _ in wedge_inputs(params)]
+    workflow = {}
+    for node_id, node in loaded_workflow.items():
+        if node["_meta"]["title"] == wedge_node_title:
+            continue
+        inputs = {key: normalize_number(value) for key, value in node["inputs"].items()}
+        if node_id == out_node_number:
+            inputs.pop("filename_prefix", None)
+        workflow[node_id] = {key: value for key, value in node.items() if key != "_meta"}
+        workflow[node_id]["inputs"] = inputs
+    return RenderKeyPlan(workflow, slots, sort_keys=True)
+
+
+def free_output_path(folder, name):
+    # First unused ComfyUI style name_00001_.png in folder.
+    counter = 1
+    while os.path.exists(os.path.join(folder, f"{name}_{counter:05}_.png")):
+        counter += 1
+    return os.path.join(folder, f"{name}_{counter:05}_.png")
+
+
+class RenderCache:
+
+    def __init__(self, path, image_root):
+        self.path = path
+        self.image_root = image_root
+        self.hits = 0
+        self.added = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Looked up from the thread running the wedge, which isn't the one that loaded it in the UI.
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.executescript(f"""
+                DROP TABLE IF EXISTS renders;
+                CREATE TABLE renders (
+                    render_key TEXT PRIMARY KEY,
+                    paths TEXT,
+                    time REAL
+                );
+                PRAGMA user_version = {SCHEMA_VERSION};
+            """)
+            self.db.commit()
+
+    @staticmethod
+    def render_key(encoded_workflow):
+        return hashlib.sha256(encoded_workflow).hexdigest()
+
+    def local_path(self, out_img_path):
+        return os.path.join(self.image_root, out_img_path)
+
+    def lookup(self, render_key):
+        # Image paths of an earlier render of this prompt, in batch order. Entries whose images
+        # have since been deleted are dropped.
+        row = self.db.execute("SELECT paths FROM renders WHERE render_key = ?", (render_key,)).fetchone()
+        if row is None:
+            return None
+        paths = json.loads(row[0])
+        if not all(os.path.exists(path) for path in paths):
+            self.db.execute("DELETE FROM renders WHERE render_key = ?", (render_key,))
+            self.db.commit()
+            return None
+        return paths
+
+    def add(self, render_key, paths):
+        if not paths or not all(path and os.path.exists(path) for path in paths):
+            return
+        self.db.execute("INSERT OR REPLACE INTO renders VALUES (?, ?, ?)", (render_key, json.dumps(paths), time.time()))
+        self.db.commit()
+        self.added += 1
+
+    def copy_render(self, source, out_name, prompt):
+        # Copies source to the next free out_name_NNNNN_.png under image_root, with prompt as its
+        # metadata. Returns the output path relative to image_root, like ComfyUI reports it.
+        folder = os.path.join(self.image_root, os.path.dirname(out_name))
+        os.makedirs(folder, exist_ok=True)
+        path = free_output_path(folder, os.path.basename(out_name))
+        temp_path = path + ".part"
+        try:
+            copy_png_with_text(source, temp_path, {"prompt": prompt})
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.hits += 1
+        return os.path.relpath(path, self.image_root)
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM renders").fetchone()[0]
+
+    def stats(self):
+        return f"Render cache {self.path} - {self.hits} images copied from earlier renders, {self.added} renders added"
+
+    def close(self):
+        self.db.close()
+
+
+# ------------------ MAIN ENTRY ------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or prune a render cache index")
+    parser.add_argument("path", help="Render cache index file")
+    parser.add_argument("--prune", action="store_true", help="Drop entries whose images no longer exist")
+    args = parser.parse_args()
+
+    cache = RenderCache(args.path, "")
+    if args.prune:
+        keys = [row[0] for row in cache.db.execute("SELECT render_key FROM renders")]
+        dropped = sum(cache.lookup(key) is None for key in keys)
+        print(f"Dropped {dropped} entries with missing images")
+    print(f"{cache.count()} renders in {args.path}")
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+# Persistent thumbnails for a folder of renders, kept in a .wedge_thumbs folder next to them.
+# The thumbnail name includes the source's mtime and size, so a re-rendered image gets a new
+# thumbnail instead of a stale one. Thumbnails of deleted or re-rendered images are pruned when
+# the folder is opened, and the least recently used ones once the folder is over its size cap.
+# Use is tracked in each thumbnail's mtime, set when it is first shown in a session.
+
+THUMBNAIL_DIRNAME = ".wedge_thumbs"
+THUMBNAIL_SIZE = 256
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def entry_name(src_name, stat, size):
+    # Hash of the source's name, then of its version, so stale versions of a source can be found.
+    name_hash = hashlib.sha1(src_name.encode("utf-8")).hexdigest()[:16]
+    version_hash = hashlib.sha1(f"{stat.st_mtime_ns}|{stat.st_size}|{size}".encode("utf-8")).hexdigest()[:16]
+    return f"{name_hash}_{version_hash}"
+
+
+def touch_entry(path):
+    # Marks a cache entry as used. Its mtime is the last use: access times aren't kept up to date
+    # on noatime or relatime mounts, or on NTFS.
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def entry_usage(entry):
+    # (last use, bytes) of a cache entry, a file or a folder of files.
+    last_use = entry.stat().st_mtime
+    if not entry.is_dir():
+        return last_use, entry.stat().st_size
+    with os.scandir(entry.path) as files:
+        return last_use, sum(f.stat().st_size for f in files)
+
+
+def remove_entry(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def prune_cache(folder, cache_dir, size, max_bytes, suffix=""):
+    # Removes the entries of renders that were deleted or re-rendered since, then the least
+    # recently used ones until the cache is at most max_bytes. Returns how many were removed.
+    current = set()
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file():
+                current.add(entry_name(entry.name, entry.stat(), size) + suffix)
+    try:
+        entries = list(os.scandir(cache_dir))
+    except OSError:
+        return 0
+    removed = 0
+    kept = []
+    for entry in entries:
+        # Entries still being written.
+        if entry.name.endswith(".tmp"):
+            continue
+        try:
+            if entry.name not in current:
+                remove_entry(entry.path)
+                removed += 1
+            else:
+                kept.append(entry_usage(entry) + (entry.path,))
+        except OSError:
+            continue
+    total = sum(entry_bytes for _, entry_bytes, _ in kept)
+    for _, entry_bytes, path in sorted(kept):
+        if total <= max_bytes:
+            break
+        remove_entry(path)
+        total -= entry_bytes
+        removed += 1
+    return removed
+
+
+def make_thumbnail(src_path, dst_path, size):
+    # Runs in a worker process. Writes to a temp name first so readers never see half a file.
+    with Image.open(src_path) as img:
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+        img.thumbnail((size, size), Image.LANCZOS)
+        tmp_path = dst_path + ".tmp"
+        img.save(tmp_path, "JPEG", quality=85)
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+class ThumbnailCache:
+
+    def __init__(self, folder, size=THUMBNAIL_SIZE, max_workers=None, max_bytes=MAX_CACHE_BYTES):
+        self.folder = folder
+        self.size = size
+        self.cache_dir = os.path.join(folder, THUMBNAIL_DIRNAME)
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.executor = None
+        self.pending = {}
+        # Thumbnails already marked as used this session.
+        self.touched = set()
+
+    def thumbnail_path(self, src_path):
+        try:
+            stat = os.stat(src_path)
+        except OSError:
+            return None
+        return os.path.join(self.cache_dir, entry_name(os.path.basename(src_path), stat, self.size) + ".jpg")
+
+    def prune(self):
+        # Runs prune_cache in a background thread, it reads every file in the folder.
+        if os.path.isdir(self.cache_dir):
+            threading.Thread(target=prune_cache, args=(self.folder, self.cache_dir, self.size, self.max_bytes, ".jpg"), daemon=True).start()
+
+    def get(self, src_path):
+        # Path of an up to date thumbnail, or None if it still has to be made.
+        thumbnail_path = self.thumbnail_path(src_path)
+        if thumbnail_path is None or not os.path.exists(thumbnail_path):
+            return None
+        if thumbnail_path not in self.touched:
+            self.touched.add(thumbnail_path)
+            touch_entry(thumbnail_path)
+        return thumbnail_path
+
+    def request(self, src_path, callback=None):
+        # Makes the thumbnail in a worker process. callback(src_path, thumbnail_path or None) is
+        # called from a background thread once it's done.
+        thumbnail_path = self.thumbnail_path(src_path)
+        if thumbnail_path is None or thumbnail_path in self.pending:
+            return
+        if self.executor is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        future = self.executor.submit(make_thumbnail, src_path, thumbnail_path, self.size)
+        self.pending[thumbnail_path] = future
+
+        def done(future):
+            self.pending.pop(thumbnail_path, None)
+            if callback is not None:
+                callback(src_path, None if future.cancelled() or future.exception() else thumbnail_path)
+        future.add_done_callback(done)
+
+    def cancel_pending(self):
+        for future in list(self.pending.values()):
+            future.cancel()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
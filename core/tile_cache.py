@@ -0,0 +1,131 @@
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from thumbnail_cache import entry_name, prune_cache, touch_entry
+
+# Persistent tile pyramids for zooming into renders, kept in a .wedge_tiles folder next to
+# them. Level 0 is the full resolution image cut into tiles, every further level halves it,
+# until the whole image fits in one tile. The viewer only ever loads the tiles on screen at the
+# level closest to the zoom, so memory depends on the window size rather than the image size.
+# Like thumbnails, the pyramid's name includes the source's mtime and size, and the folder is
+# pruned the same way. A new pyramid replaces the older ones of the same image.
+
+TILE_DIRNAME = ".wedge_tiles"
+TILE_SIZE = 256
+INFO_FILENAME = "pyramid.json"
+MAX_CACHE_BYTES = 4 * 1024 * 1024 * 1024
+
+
+def tile_filename(level, x, y):
+    return f"{level}_{x}_{y}.png"
+
+
+def make_pyramid(src_path, dst_dir, tile_size):
+    # Runs in a worker process. Tiles are written to a temp folder that is renamed once complete,
+    # so a pyramid is either all there or not at all.
+    tmp_dir = f"{dst_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        with Image.open(src_path) as img:
+            img = img.convert("RGB")
+        info = {"width": img.width, "height": img.height, "tile_size": tile_size, "levels": 0}
+        while True:
+            for y in range(0, img.height, tile_size):
+                for x in range(0, img.width, tile_size):
+                    tile = img.crop((x, y, min(x + tile_size, img.width), min(y + tile_size, img.height)))
+                    tile.save(os.path.join(tmp_dir, tile_filename(info["levels"], x // tile_size, y // tile_size)), compress_level=1)
+            info["levels"] += 1
+            if img.width <= tile_size and img.height <= tile_size:
+                break
+            img = img.reduce(2)
+        with open(os.path.join(tmp_dir, INFO_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        try:
+            os.replace(tmp_dir, dst_dir)
+        except OSError:
+            # Another process made the same pyramid first.
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    # Pyramids of earlier versions of the image.
+    cache_dir, name = os.path.split(dst_dir)
+    prefix = name.split("_")[0] + "_"
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(prefix) and entry.name != name and not entry.name.endswith(".tmp"):
+                shutil.rmtree(entry.path, ignore_errors=True)
+    return dst_dir
+
+
+class TileCache:
+
+    def __init__(self, folder, tile_size=TILE_SIZE, max_workers=None, max_bytes=MAX_CACHE_BYTES):
+        self.folder = folder
+        self.tile_size = tile_size
+        self.cache_dir = os.path.join(folder, TILE_DIRNAME)
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.executor = None
+        self.pending = {}
+        # Pyramid folder -> info of pyramids already read.
+        self.infos = {}
+
+    def pyramid_dir(self, src_path):
+        try:
+            stat = os.stat(src_path)
+        except OSError:
+            return None
+        return os.path.join(self.cache_dir, entry_name(os.path.basename(src_path), stat, self.tile_size))
+
+    def prune(self):
+        # Runs prune_cache in a background thread, it reads every file in the folder.
+        if os.path.isdir(self.cache_dir):
+            threading.Thread(target=prune_cache, args=(self.folder, self.cache_dir, self.tile_size, self.max_bytes), daemon=True).start()
+
+    def get(self, src_path):
+        # Info of an up to date pyramid ({"dir", "width", "height", "tile_size", "levels"}), or
+        # None if it still has to be made.
+        pyramid_dir = self.pyramid_dir(src_path)
+        if pyramid_dir is None:
+            return None
+        if pyramid_dir not in self.infos:
+            try:
+                with open(os.path.join(pyramid_dir, INFO_FILENAME), encoding="utf-8") as f:
+                    self.infos[pyramid_dir] = dict(json.load(f), dir=pyramid_dir)
+            except (OSError, ValueError):
+                return None
+            # Marks the pyramid as used for pruning, once per session.
+            touch_entry(pyramid_dir)
+        return self.infos[pyramid_dir]
+
+    def request(self, src_path, callback=None):
+        # Makes the pyramid in a worker process. callback(src_path, pyramid_dir or None) is called
+        # from a background thread once it's done.
+        pyramid_dir = self.pyramid_dir(src_path)
+        if pyramid_dir is None or pyramid_dir in self.pending:
+            return
+        if self.executor is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        future = self.executor.submit(make_pyramid, src_path, pyramid_dir, self.tile_size)
+        self.pending[pyramid_dir] = future
+
+        def done(future):
+            self.pending.pop(pyramid_dir, None)
+            if callback is not None:
+                callback(src_path, None if future.cancelled() or future.exception() else pyramid_dir)
+        future.add_done_callback(done)
+
+    def cancel_pending(self):
+        for future in list(self.pending.values()):
+            future.cancel()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -1,18 +1,33 @@
+import argparse
 import sys
 import os
 import json
-from PIL import Image
+import time
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QVBoxLayout, QSlider, QComboBox,
-    QFileDialog, QPushButton, QMainWindow, QScrollArea
+    QFileDialog, QPushButton, QMainWindow, QScrollArea, QSpinBox, QHBoxLayout,
+    QCheckBox, QStackedWidget
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QPixmap
 import qdarkstyle
 
+from image_cache import ImageCache, ImageLoader
+from thumbnail_cache import ThumbnailCache
+from tile_cache import TileCache
+from wedge_grid import ThumbnailGridModel, WedgeGridView
+from wedge_combinations import CombinationSpace
+from wedge_index import WedgeIndex, read_wedge_entry
+from zoom_view import ZoomView
+
+# How many values either side of the current one are prefetched along each axis.
+PREFETCH_RADIUS = 2
+# Minimum seconds between rescans of the folder when an image is missing from the index.
+RESCAN_INTERVAL = 2
+
 
 class WedgeViewer(QMainWindow):
-    def __init__(self):
+    def __init__(self, cache_mb=512):
         super().__init__()
         self.setWindowTitle("Wedge Viewer")
 
@@ -27,62 +42,158 @@ class WedgeViewer(QMainWindow):
         self.load_button = QPushButton("Load Image")
         self.load_button.clicked.connect(self.load_image)
 
+        self.load_folder_button = QPushButton("Load Folder")
+        self.load_folder_button.clicked.connect(self.load_folder)
+
         self.slider_container = QWidget()
         self.slider_layout = QVBoxLayout()
         self.slider_container.setLayout(self.slider_layout)
 
         self.param_sliders = {}
+        self.space = None
         self.metadata = {}
         self.folder_path = ""
         self.filename_prefix = ""
         self.current_pixmap = None
+        self.current_key = None
+        self.wedge_index = None
+        self.last_scan_time = 0
+        self.thumbnail_cache = None
+        self.tile_cache = None
+        self.grid_model = None
+        self.grid_view = None
+
+        # --- Contact sheet of two axes, the other axes stay on the sliders ---
+        self.grid_checkbox = QCheckBox("Grid")
+        self.grid_checkbox.setEnabled(False)
+        self.grid_checkbox.toggled.connect(self.toggle_grid)
+        self.grid_row_dropdown = QComboBox()
+        self.grid_col_dropdown = QComboBox()
+        self.grid_row_dropdown.currentIndexChanged.connect(self.update_grid)
+        self.grid_col_dropdown.currentIndexChanged.connect(self.update_grid)
+
+        self.view_stack = QStackedWidget()
+        self.view_stack.addWidget(self.scroll_area)
+
+        # --- Decoded, display-sized images are cached and neighbours loaded in the background ---
+        self.image_cache = ImageCache(cache_mb * 2**20)
+        self.image_loader = ImageLoader(self.image_cache, parent=self)
+        self.image_loader.image_ready.connect(self.on_image_ready)
+
+        # --- Zoom and pan over tiles, the zoom is kept when the sliders move ---
+        self.zoom_checkbox = QCheckBox("Zoom")
+        self.zoom_checkbox.toggled.connect(self.toggle_zoom)
+        self.zoom_view = ZoomView(self.image_cache, self.image_loader)
+        self.view_stack.addWidget(self.zoom_view)
+
+        self.cache_size_box = QSpinBox()
+        self.cache_size_box.setRange(64, 65536)
+        self.cache_size_box.setSingleStep(64)
+        self.cache_size_box.setSuffix(" MB cache")
+        self.cache_size_box.setValue(cache_mb)
+        self.cache_size_box.valueChanged.connect(lambda mb: self.image_cache.set_max_bytes(mb * 2**20))
+        self.cache_stats_label = QLabel("")
+        self.statusBar().addWidget(self.cache_stats_label)
+        self.statusBar().addPermanentWidget(self.cache_size_box)
+
+        # Reloads at the new size once the window stops resizing.
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self.update_image_display)
 
         central_layout = QVBoxLayout()
-        central_layout.addWidget(self.load_button)
-        central_layout.addWidget(self.scroll_area)
+        load_layout = QHBoxLayout()
+        load_layout.addWidget(self.load_button)
+        load_layout.addWidget(self.load_folder_button)
+        load_layout.addWidget(self.zoom_checkbox)
+        load_layout.addWidget(self.grid_checkbox)
+        load_layout.addWidget(QLabel("Rows:"))
+        load_layout.addWidget(self.grid_row_dropdown)
+        load_layout.addWidget(QLabel("Columns:"))
+        load_layout.addWidget(self.grid_col_dropdown)
+        central_layout.addLayout(load_layout)
+        central_layout.addWidget(self.view_stack)
         central_layout.addWidget(self.slider_container)
 
         central_widget = QWidget()
         central_widget.setLayout(central_layout)
         self.setCentralWidget(central_widget)
 
-    def load_image(self):
-        
+    def default_directory(self):
         default_directory = "D:\\AI\ComfyUI\\output"
         if not os.path.isdir(default_directory):
             default_directory = ""
-        
-        file_path, _ = QFileDialog.getOpenFileName(self, "Open Image", default_directory, "PNG Images (*.png)")
+        return default_directory
+
+    def load_image(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Image", self.default_directory(), "PNG Images (*.png)")
         if not file_path:
             return
+        self.open_folder(os.path.dirname(file_path), os.path.basename(file_path))
 
-        self.folder_path = os.path.dirname(file_path)
-
-        try:
-            # image = Image.open(file_path)
-            # wedge_info_json = image.info.get("Wedge Info", "")
-
-            with Image.open(file_path) as img:
-                metadata = json.loads(img.info.get("prompt"))
-                for k, v in metadata.items():
-                    if v["_meta"]["title"] == "WEDGE_string":
-                        # wedge_info_json = json.loads(v["inputs"]["value"])
-                        wedge_info_json = v["inputs"]["value"]
-                        
-        except Exception as e:
-            self.image_label.setText(f"Failed to read image: {e}")
+    def load_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Open Wedge Folder", self.default_directory())
+        if not folder:
             return
+        self.open_folder(folder)
 
-        if not wedge_info_json:
-            self.image_label.setText("No 'Wedge Info' metadata found in image.")
-            return
+    def open_folder(self, folder, filename=None):
+        # Indexes the folder, then shows the wedge filename belongs to, or the most recent one.
+        self.folder_path = folder
+        self.image_loader.cancel_prefetch()
+        if self.wedge_index is not None:
+            self.wedge_index.close()
 
+        QApplication.setOverrideCursor(Qt.WaitCursor)
         try:
+            self.wedge_index = WedgeIndex(folder)
+            self.rescan_index()
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.setup_thumbnails(folder)
+
+        start_combo = None
+        if filename is not None:
+            entry = read_wedge_entry(os.path.join(folder, filename))
+            if entry is None:
+                self.image_label.setText("No 'WEDGE_string' metadata found in image.")
+                return
+            wedge_info_json, start_combo = entry
             self.metadata = json.loads(wedge_info_json)
-        except json.JSONDecodeError:
-            self.image_label.setText("Invalid JSON in 'Wedge Info' metadata.")
-            return
+        else:
+            self.metadata = self.wedge_index.latest_wedge_config()
+            if self.metadata is None:
+                self.image_label.setText("No wedge renders found in folder.")
+                return
+
+        self.setup_wedge(start_combo)
+
+    def setup_thumbnails(self, folder):
+        if self.thumbnail_cache is not None:
+            self.thumbnail_cache.close()
+        if self.grid_view is not None:
+            self.view_stack.removeWidget(self.grid_view)
+            self.grid_view.deleteLater()
+        self.thumbnail_cache = ThumbnailCache(folder)
+        self.thumbnail_cache.prune()
+        if self.tile_cache is not None:
+            self.tile_cache.close()
+        self.tile_cache = TileCache(folder)
+        self.tile_cache.prune()
+        self.zoom_view.set_tile_cache(self.tile_cache)
+        self.grid_model = ThumbnailGridModel(
+            self.thumbnail_cache, lambda labels: self.build_image_path(self.label_indices(labels)), parent=self
+        )
+        self.grid_view = WedgeGridView(self.grid_model)
+        self.grid_view.combination_activated.connect(self.show_combination)
+        self.view_stack.addWidget(self.grid_view)
+
+    def rescan_index(self):
+        self.wedge_index.scan()
+        self.last_scan_time = time.time()
 
+    def setup_wedge(self, start_combo=None):
         self.filename_prefix = self.metadata.get("filename_prefix", "image")
         self.wedge_params = self.metadata.get("param_wedges", {})
         print(self.wedge_params)
@@ -93,135 +204,278 @@ class WedgeViewer(QMainWindow):
 
         self.param_sliders.clear()
 
-        for param, value in self.wedge_params.items():
-            range_type = value[2]
-            if range_type == "explicit":
-                values = value[1]
-
-                # If all values are strings, use a dropdown
-                if all(isinstance(v, str) for v in values):
-                    dropdown = QComboBox()
-                    dropdown.addItems(values)
-                    dropdown.currentIndexChanged.connect(self.make_dropdown_callback(param, dropdown, values))
-
-                    label = QLabel(f"{param}: {values[0]}")
-                    self.slider_layout.addWidget(label)
-                    self.slider_layout.addWidget(dropdown)
-
-                    self.param_sliders[param] = {
-                        "dropdown": dropdown,
-                        "values": values,
-                        "label": label
-                    }
-                    continue
-
-            elif range_type == "minmax":
-                min_val, max_val, step = value[1]
-                num_steps = int(round((max_val - min_val) / step)) + 1
-                values = [round(min_val + i * step, 10) for i in range(num_steps)]
-            else:
-                continue  # Unknown type
+        # One control per axis: zipped parameters move with their axis and a group axis sets
+        # several inputs, so a combination is a position on every control.
+        try:
+            self.space = CombinationSpace(self.wedge_params, constraints=self.metadata.get("constraints"))
+        except ValueError as e:
+            self.space = None
+            self.image_label.setText(f"Invalid wedge config:\n{e}")
+            return
+        start_digits = None
+        if start_combo:
+            try:
+                start_digits = self.space.digits(self.space.index_of(start_combo))
+            except (KeyError, ValueError, IndexError):
+                start_digits = None
+
+        for axis, param in enumerate(self.space.names):
+            range_type = self.wedge_params[param][2]
+            values = list(self.space.axes[axis])
+            labels = [self.space.value_label(axis, d) for d in range(len(values))]
+            start = start_digits[axis] if start_digits else 0
+            label = QLabel(f"{param}: {labels[start]}")
+
+            # If all values are strings, or each sets several inputs, use a dropdown
+            if range_type == "group" or (range_type == "explicit" and all(isinstance(v, str) for v in values)):
+                dropdown = QComboBox()
+                dropdown.addItems(labels)
+                dropdown.setCurrentIndex(start)
+                dropdown.currentIndexChanged.connect(self.make_dropdown_callback(param, dropdown, labels))
+                self.slider_layout.addWidget(label)
+                self.slider_layout.addWidget(dropdown)
+
+                self.param_sliders[param] = {
+                    "dropdown": dropdown,
+                    "values": values,
+                    "labels": labels,
+                    "label": label
+                }
+                continue
 
             # Create slider
             slider = QSlider(Qt.Horizontal)
             slider.setMinimum(0)
             slider.setMaximum(len(values) - 1)
             slider.setTickInterval(1)
-            slider.setValue(0)
+            slider.setValue(start)
             slider.setSingleStep(1)
-
-            label = QLabel(f"{param}: {values[0]}")
-            slider.valueChanged.connect(self.make_slider_callback(param, slider, label, values))
+            slider.valueChanged.connect(self.make_slider_callback(param, slider, label, labels))
 
             self.slider_layout.addWidget(label)
             self.slider_layout.addWidget(slider)
             self.param_sliders[param] = {
                 "slider": slider,
                 "values": values,
+                "labels": labels,
                 "label": label
             }
 
+        # --- Grid axis choices ---
+        for dropdown in (self.grid_row_dropdown, self.grid_col_dropdown):
+            dropdown.blockSignals(True)
+            dropdown.clear()
+            dropdown.addItems(list(self.param_sliders))
+            dropdown.blockSignals(False)
+        if len(self.param_sliders) >= 2:
+            self.grid_row_dropdown.setCurrentIndex(0)
+            self.grid_col_dropdown.setCurrentIndex(1)
+        self.grid_checkbox.setEnabled(len(self.param_sliders) >= 2)
+        if not self.grid_checkbox.isEnabled():
+            self.grid_checkbox.setChecked(False)
+
         self.update_image_display()
 
-    def make_slider_callback(self, param, slider, label, values):
+    def make_slider_callback(self, param, slider, label, labels):
         def callback(value_index):
-            val = values[value_index]
-            label.setText(f"{param}: {val}")
+            label.setText(f"{param}: {labels[value_index]}")
             self.update_image_display()
         return callback
 
-    def make_dropdown_callback(self, param, dropdown, values):
+    def make_dropdown_callback(self, param, dropdown, labels):
         def callback(index):
-            val = values[index]
-            self.param_sliders[param]["label"].setText(f"{param}: {val}")
+            self.param_sliders[param]["label"].setText(f"{param}: {labels[index]}")
             self.update_image_display()
         return callback
 
-    def update_image_display(self):
-        if not self.folder_path:
+    def get_value_indices(self):
+        indices = {}
+        for param, control_data in self.param_sliders.items():
+            if "slider" in control_data:
+                indices[param] = control_data["slider"].value()
+            elif "dropdown" in control_data:
+                indices[param] = control_data["dropdown"].currentIndex()
+        return indices
+
+    def combination_at(self, value_indices):
+        return self.space.combination([value_indices[param] for param in self.space.names])
+
+    def label_indices(self, labels):
+        # Value positions of {param: value label}, as shown in the grid.
+        return {param: self.param_sliders[param]["labels"].index(label) for param, label in labels.items()}
+
+    def build_image_path(self, value_indices):
+        # None if there is no render, or the wedge's constraints exclude the combination.
+        combo = self.combination_at(value_indices)
+        if not self.space.allows(combo):
+            return None
+        return self.wedge_index.lookup(self.filename_prefix, combo)
+
+    def missing_text(self, value_indices):
+        combo = self.combination_at(value_indices)
+        if not self.space.allows(combo):
+            return f"Excluded by the wedge's constraints:\n{combo}"
+        return f"Image not found:\n{combo}"
+
+    def neighbour_indices(self, value_indices):
+        # Positions one to PREFETCH_RADIUS steps away along each axis, nearest first.
+        for distance in range(1, PREFETCH_RADIUS + 1):
+            for param, value_index in value_indices.items():
+                for neighbour in (value_index - distance, value_index + distance):
+                    if 0 <= neighbour < len(self.param_sliders[param]["values"]):
+                        yield dict(value_indices, **{param: neighbour})
+
+    def display_key(self, path):
+        size = self.scroll_area.viewport().size()
+        return (path, size.width(), size.height())
+
+    def single_view(self):
+        return self.zoom_view if self.zoom_checkbox.isChecked() else self.scroll_area
+
+    def toggle_grid(self, enabled):
+        if enabled:
+            self.zoom_checkbox.blockSignals(True)
+            self.zoom_checkbox.setChecked(False)
+            self.zoom_checkbox.blockSignals(False)
+        self.view_stack.setCurrentWidget(self.grid_view if enabled else self.single_view())
+        self.update_image_display()
+
+    def toggle_zoom(self, enabled):
+        if enabled and self.grid_checkbox.isChecked():
+            self.grid_checkbox.blockSignals(True)
+            self.grid_checkbox.setChecked(False)
+            self.grid_checkbox.blockSignals(False)
+        self.view_stack.setCurrentWidget(self.single_view())
+        self.update_image_display()
+
+    def grid_axes(self):
+        row_param = self.grid_row_dropdown.currentText()
+        col_param = self.grid_col_dropdown.currentText()
+        if not row_param or not col_param or row_param == col_param:
+            return None
+        return row_param, col_param
+
+    def update_grid(self):
+        if not self.grid_checkbox.isChecked() or self.grid_model is None:
+            return
+        axes = self.grid_axes()
+        for param, control_data in self.param_sliders.items():
+            control = control_data.get("slider") or control_data.get("dropdown")
+            control.setEnabled(axes is None or param not in axes)
+        if axes is None:
             return
+        # The grid is laid out with value labels, which label_indices turns back into positions.
+        row_param, col_param = axes
+        labels = {param: self.param_sliders[param]["labels"][i] for param, i in self.get_value_indices().items()}
+        fixed_labels = {param: label for param, label in labels.items() if param not in axes}
+        self.grid_model.set_layout(
+            row_param, self.param_sliders[row_param]["labels"],
+            col_param, self.param_sliders[col_param]["labels"],
+            fixed_labels,
+        )
 
-        parts = [self.filename_prefix]
-        for param in self.param_sliders:
+    def show_combination(self, labels):
+        # Opens one cell of the grid in the single image view.
+        for param, value_index in self.label_indices(labels).items():
             control_data = self.param_sliders[param]
-            values = control_data["values"]
-
-            # Get current value
+            control = control_data.get("slider") or control_data.get("dropdown")
+            control.blockSignals(True)
             if "slider" in control_data:
-                value_index = control_data["slider"].value()
-            elif "dropdown" in control_data:
-                value_index = control_data["dropdown"].currentIndex()
+                control.setValue(value_index)
             else:
-                continue
+                control.setCurrentIndex(value_index)
+            control.blockSignals(False)
+            control_data["label"].setText(f"{param}: {control_data['labels'][value_index]}")
+            control.setEnabled(True)
+        self.grid_checkbox.setChecked(False)
 
-            value = values[value_index]
+    def update_image_display(self):
+        if not self.folder_path or self.space is None:
+            return
+        if self.grid_checkbox.isChecked():
+            self.update_grid()
+            return
+        for control_data in self.param_sliders.values():
+            (control_data.get("slider") or control_data.get("dropdown")).setEnabled(True)
+
+        value_indices = self.get_value_indices()
+        full_path = self.build_image_path(value_indices)
+        if full_path is None and self.space.allows(self.combination_at(value_indices)) \
+                and time.time() - self.last_scan_time > RESCAN_INTERVAL:
+            # Picks up renders from a wedge that is still running.
+            self.rescan_index()
+            full_path = self.build_image_path(value_indices)
+
+        neighbour_paths = (self.build_image_path(indices) for indices in self.neighbour_indices(value_indices))
+        if self.zoom_checkbox.isChecked():
+            self.zoom_view.set_image(full_path, self.missing_text(value_indices))
+            self.zoom_view.prefetch(path for path in neighbour_paths if path is not None)
+            self.cache_stats_label.setText(self.image_cache.stats_text())
+            return
 
-            # Format value correctly
-            if isinstance(value, str):
-                value_str = value
-            else:
-                is_float_series = any(isinstance(v, float) and not v.is_integer() for v in values)
-                if is_float_series:
-                    max_decimals = max(
-                        len(str(v).split(".")[1]) if isinstance(v, float) else 0
-                        for v in values
-                    )
-                    value_str = f"{value:.{max_decimals}f}"
-                else:
-                    value_str = str(int(value))
-
-            parts.append(f"{param}-{value_str}")
-
-        filename = "__".join(parts) + "_00001_.png"
-        full_path = os.path.join(self.folder_path, filename)
-
-        if os.path.exists(full_path):
-            self.current_pixmap = QPixmap(full_path)
-            self.resize_image_to_fit()
-        else:
+        if full_path is None:
+            self.current_key = None
+            self.current_pixmap = None
             self.image_label.setPixmap(QPixmap())  # Clear image
-            self.image_label.setText(f"Image not found:\n{filename}")
+            self.image_label.setText(self.missing_text(value_indices))
+        else:
+            self.current_key = self.display_key(full_path)
+            image = self.image_cache.get(self.current_key)
+            if image is not None:
+                self.show_image(image)
+            else:
+                # Keeps showing the previous image until this one is decoded.
+                self.image_loader.request(self.current_key)
+
+        self.image_loader.prefetch(self.display_key(path) for path in neighbour_paths if path is not None)
+        self.cache_stats_label.setText(self.image_cache.stats_text())
+
+    def on_image_ready(self, key):
+        if self.zoom_checkbox.isChecked() and key in self.image_cache:
+            # A tile; repaints are merged so a burst of them draws once.
+            self.zoom_view.update()
+        if key == self.current_key:
+            image = self.image_cache.get(key)
+            if image is not None:
+                self.show_image(image)
+        self.cache_stats_label.setText(self.image_cache.stats_text())
+
+    def show_image(self, image):
+        self.current_pixmap = QPixmap.fromImage(image)
+        self.image_label.setPixmap(self.current_pixmap)
 
     def resize_image_to_fit(self):
         if not self.current_pixmap or self.current_pixmap.isNull():
             return
 
+        # Quick preview while resizing, the smooth version is loaded at the new size afterwards.
         scroll_size = self.scroll_area.viewport().size()
         scaled_pixmap = self.current_pixmap.scaled(
-            scroll_size, Qt.KeepAspectRatio, Qt.SmoothTransformation
+            scroll_size, Qt.KeepAspectRatio, Qt.FastTransformation
         )
         self.image_label.setPixmap(scaled_pixmap)
+        self.resize_timer.start()
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.resize_image_to_fit()
 
+    def closeEvent(self, event):
+        if self.thumbnail_cache is not None:
+            self.thumbnail_cache.close()
+        if self.tile_cache is not None:
+            self.tile_cache.close()
+        super().closeEvent(event)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="View wedge renders")
+    parser.add_argument("--cache-mb", type=int, default=512, help="Memory used for decoded images")
+    args = parser.parse_args()
 
     app = QApplication(sys.argv)
     app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
-    viewer = WedgeViewer()
+    viewer = WedgeViewer(cache_mb=args.cache_mb)
     viewer.resize(1000, 700)
     viewer.show()
     sys.exit(app.exec_())
@@ -0,0 +1,73 @@
+import argparse
+import sys
+
+# Command line entry point for scripts and scheduled jobs:
+#   wedge submit <wedge folder>   render a wedge
+#   wedge plan <wedge folder>     print what a submit would do, without contacting a server
+#   wedge index <image folder>    build or update the wedge index of an output folder
+# Each command imports only the modules it uses, so a plan or index doesn't load aiohttp,
+# PIL or Qt.
+
+
+def command_submit(args):
+    from wedge_submitter import load_wedge, setup_logging, submit_iterations
+
+    setup_logging()
+    wedge = load_wedge(args.folder)
+    if args.yes:
+        wedge["_confirmation"] = False
+    scheduler = submit_iterations(**wedge)
+    # Non-zero when anything wasn't rendered, for scripts to check.
+    if scheduler is not None and (scheduler.remaining > 0 or scheduler.progress()["failed"]):
+        return 1
+    return 0
+
+
+def command_plan(args):
+    from wedge_submitter import load_wedge, setup_logging, submit_iterations
+
+    setup_logging()
+    submit_iterations(**load_wedge(args.folder), dry_run=True, dry_run_sample=args.sample)
+    return 0
+
+
+def command_index(args):
+    from wedge_index import index_folder
+
+    index_folder(args.folder, args.workers)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="wedge", description="Submit, plan and index ComfyUI wedges")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Render a wedge")
+    submit.add_argument("folder", help="Folder containing workflow_api.json and wedge_config.json")
+    submit.add_argument("--yes", action="store_true", help="Don't ask for confirmation, whatever show_confirmation says")
+    submit.set_defaults(run=command_submit)
+
+    plan = commands.add_parser("plan", help="Print the combinations, axis order and first output files without submitting")
+    plan.add_argument("folder", help="Folder containing workflow_api.json and wedge_config.json")
+    plan.add_argument("--sample", type=int, default=5, help="How many of the first prompts' output files to print")
+    plan.set_defaults(run=command_plan)
+
+    index = commands.add_parser("index", help="Build or update the wedge index of an output folder")
+    index.add_argument("folder", help="Folder containing wedge renders")
+    index.add_argument("--workers", type=int, default=None, help="Worker processes for reading metadata (default: CPU count)")
+    index.set_defaults(run=command_index)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.run(args)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"wedge {args.command}: {type(e).__name__}: {e}", file=sys.stderr)
+        return 2
+
+
+# ------------------ MAIN ENTRY ------------------
+if __name__ == "__main__":
+    sys.exit(main())
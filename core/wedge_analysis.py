@@ -0,0 +1,236 @@
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from wedge_combinations import CombinationSpace, axis_values, zip_followers
+from wedge_index import open_wedge_folder
+
+# How much each wedged parameter changes the image. Every pair of renders that differ by one
+# step along one param_wedges axis is compared on small thumbnails (mean absolute difference and
+# a block SSIM), and the results are averaged per axis and per pair of neighbouring values.
+#
+# Renders are streamed in combination order, so the neighbour of an image along an axis is
+# always a fixed number of images earlier. Only that many thumbnails are kept (one stride of
+# the slowest axis) and they are decoded a chunk at a time in worker processes, so memory
+# depends on the wedge's shape and the thumbnail size, not on the number of images.
+
+SSIM_BLOCK = 8
+# SSIM stabilising constants for 8 bit values.
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def load_array(path, size):
+    # Runs in a worker process. size x size RGB thumbnail as uint8, None if it can't be read.
+    if path is None:
+        return None
+    try:
+        with Image.open(path) as image:
+            image.draft("RGB", (size, size))
+            return np.asarray(image.convert("RGB").resize((size, size), Image.BOX), dtype=np.uint8)
+    except OSError:
+        return None
+
+
+def pair_metrics(a, b):
+    # Mean absolute difference (0-1) and mean block SSIM of image pairs a[i], b[i], each an
+    # (n, size, size, 3) uint8 array.
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    mad = np.abs(a - b).mean(axis=(1, 2, 3)) / 255
+    n, height, width, _ = a.shape
+    blocks = (n, height // SSIM_BLOCK, SSIM_BLOCK, width // SSIM_BLOCK, SSIM_BLOCK)
+    x = (a @ LUMA)[:, :blocks[1] * SSIM_BLOCK, :blocks[3] * SSIM_BLOCK].reshape(blocks)
+    y = (b @ LUMA)[:, :blocks[1] * SSIM_BLOCK, :blocks[3] * SSIM_BLOCK].reshape(blocks)
+    mean_x = x.mean(axis=(2, 4))
+    mean_y = y.mean(axis=(2, 4))
+    var_x = x.var(axis=(2, 4))
+    var_y = y.var(axis=(2, 4))
+    cov = (x * y).mean(axis=(2, 4)) - mean_x * mean_y
+    ssim = ((2 * mean_x * mean_y + SSIM_C1) * (2 * cov + SSIM_C2)
+            / ((mean_x ** 2 + mean_y ** 2 + SSIM_C1) * (var_x + var_y + SSIM_C2)))
+    return mad, ssim.mean(axis=(1, 2))
+
+
+class AxisStats:
+    # Running totals for the neighbouring value pairs of one axis: pair k compares value k
+    # with value k + 1.
+
+    def __init__(self, values):
+        self.values = list(values)
+        pairs = max(0, len(self.values) - 1)
+        self.count = np.zeros(pairs, dtype=np.int64)
+        self.mad = np.zeros(pairs)
+        self.ssim = np.zeros(pairs)
+        self.duplicates = np.zeros(pairs, dtype=np.int64)
+
+    def add(self, pair_index, mad, ssim, duplicate):
+        np.add.at(self.count, pair_index, 1)
+        np.add.at(self.mad, pair_index, mad)
+        np.add.at(self.ssim, pair_index, ssim)
+        np.add.at(self.duplicates, pair_index, duplicate.astype(np.int64))
+
+    def pairs(self):
+        for k in range(len(self.count)):
+            count = self.count[k]
+            yield {
+                "from": self.values[k],
+                "to": self.values[k + 1],
+                "pairs": int(count),
+                "mean_abs_diff": float(self.mad[k] / count) if count else None,
+                "ssim": float(self.ssim[k] / count) if count else None,
+                "near_duplicate": float(self.duplicates[k] / count) if count else None,
+            }
+
+    def sensitivity(self):
+        # Mean difference between neighbouring values over every compared pair.
+        total = self.count.sum()
+        return float(self.mad.sum() / total) if total else None, float(self.ssim.sum() / total) if total else None
+
+    def suggested_indices(self, mad_threshold):
+        # Positions of the values left after dropping each one that differs from the last kept
+        # value by less than mad_threshold, adding up the steps in between. The last value is
+        # always kept.
+        kept = [0] if self.values else []
+        drift = 0.0
+        for k, pair in enumerate(self.pairs(), 1):
+            drift += pair["mean_abs_diff"] if pair["mean_abs_diff"] is not None else mad_threshold
+            if drift >= mad_threshold or k == len(self.values) - 1:
+                kept.append(k)
+                drift = 0.0
+        return kept
+
+    def suggested_values(self, mad_threshold):
+        return [self.values[k] for k in self.suggested_indices(mad_threshold)]
+
+
+def analyse(space, lookup, size=64, chunk_size=256, max_workers=None, ssim_threshold=0.98, mad_threshold=0.01):
+    # ({axis name: AxisStats}, number of missing renders). lookup gives the render of a
+    # combination, or None if there isn't one. Combinations excluded by constraints hold the
+    # place of a missing render in the stream, but don't count as missing.
+    stats = {name: AxisStats(values) for name, values in zip(space.names, space.axes)}
+    window = space.strides[0] if space.strides else 0
+    previous = np.zeros((0, size, size, 3), dtype=np.uint8)
+    previous_valid = np.zeros(0, dtype=bool)
+    missing = 0
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, space.size, chunk_size):
+            stop = min(start + chunk_size, space.size)
+            # Paths are looked up a chunk at a time too, so those of a huge wedge are never all held at once.
+            combos = list(space.iter_range(start, stop))
+            allowed = np.array([space.allows(combo) for combo in combos], dtype=bool)
+            paths = [lookup(combo) if ok else None for combo, ok in zip(combos, allowed)]
+            arrays = list(executor.map(load_array, paths, [size] * len(paths), chunksize=16))
+            valid = np.array([array is not None for array in arrays], dtype=bool)
+            missing += int((~valid & allowed).sum())
+            chunk = np.stack([array if array is not None else np.zeros((size, size, 3), dtype=np.uint8) for array in arrays])
+
+            # buffer[i] is the image at index base + i.
+            buffer = np.concatenate([previous, chunk])
+            buffer_valid = np.concatenate([previous_valid, valid])
+            base = start - len(previous)
+            indices = np.arange(start, stop)
+            for name, values, stride in zip(space.names, space.axes, space.strides):
+                digit = (indices // stride) % len(values)
+                has_neighbour = digit > 0
+                current = indices[has_neighbour] - base
+                neighbour = current - stride
+                compared = buffer_valid[current] & buffer_valid[neighbour]
+                current, neighbour = current[compared], neighbour[compared]
+                if not len(current):
+                    continue
+                mad, ssim = pair_metrics(buffer[neighbour], buffer[current])
+                duplicate = (ssim >= ssim_threshold) & (mad <= mad_threshold)
+                stats[name].add(digit[has_neighbour][compared] - 1, mad, ssim, duplicate)
+
+            previous = buffer[len(buffer) - window:] if window else buffer[:0]
+            previous_valid = buffer_valid[len(buffer_valid) - window:] if window else buffer_valid[:0]
+    return stats, missing
+
+
+def format_report(stats, ssim_threshold, mad_threshold):
+    lines = ["Sensitivity - mean abs diff and SSIM between neighbouring values, most sensitive first"]
+    ranked = sorted(stats.items(), key=lambda item: item[1].sensitivity()[0] or 0, reverse=True)
+    for name, axis in ranked:
+        mad, ssim = axis.sensitivity()
+        if mad is None:
+            lines.append(f"  {name:<24} no neighbouring renders")
+            continue
+        lines.append(f"  {name:<24} mad {mad:.4f}  ssim {ssim:.3f}  {'#' * min(40, int(mad * 400))}")
+    for name, axis in ranked:
+        lines.append(f"\n{name}")
+        for pair in axis.pairs():
+            if not pair["pairs"]:
+                lines.append(f"  {str(pair['from']):>14} -> {str(pair['to']):<14} no renders to compare")
+                continue
+            flag = "  near-duplicate" if pair["near_duplicate"] >= 0.5 else ""
+            lines.append(f"  {str(pair['from']):>14} -> {str(pair['to']):<14} mad {pair['mean_abs_diff']:.4f}  "
+                         f"ssim {pair['ssim']:.3f}  {pair['near_duplicate']:4.0%} of {pair['pairs']} pairs near-duplicate{flag}")
+        lines.append(f"  suggested values: {axis.suggested_values(mad_threshold)}")
+    lines.append(f"\nNear-duplicate: ssim >= {ssim_threshold} and mad <= {mad_threshold}")
+    return "\n".join(lines)
+
+
+def suggested_param_wedges(stats, params, mad_threshold):
+    # param_wedges entries with the suggested values. Zipped parameters keep the values at the
+    # positions kept on their axis.
+    followers = zip_followers(params)
+    suggested = {}
+    for name, axis in stats.items():
+        node_title, _, mode = params[name]
+        if mode == "batch":
+            continue
+        kept = axis.suggested_indices(mad_threshold)
+        suggested[name] = [node_title, [axis.values[k] for k in kept], "group" if mode == "group" else "explicit"]
+        for param in followers.get(name, []):
+            values = axis_values(param, *params[param][1:3])
+            suggested[param] = [params[param][0], {"with": name, "values": [values[k] for k in kept]}, "zip"]
+    return suggested
+
+
+def report_json(stats, params, missing, ssim_threshold, mad_threshold):
+    # Everything in the report, plus param_wedges entries with the suggested values that can be
+    # pasted into the next wedge_config.json.
+    return {
+        "thresholds": {"ssim": ssim_threshold, "mean_abs_diff": mad_threshold},
+        "missing_images": missing,
+        "axes": {name: {"mean_abs_diff": axis.sensitivity()[0], "ssim": axis.sensitivity()[1], "pairs": list(axis.pairs())}
+                 for name, axis in stats.items()},
+        "suggested_param_wedges": suggested_param_wedges(stats, params, mad_threshold),
+    }
+
+
+# ------------------ MAIN ENTRY ------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how much each wedged parameter changes the renders")
+    parser.add_argument("folder", help="Folder containing wedge renders")
+    parser.add_argument("--prefix", help="filename_prefix of the wedge (default: most recently rendered)")
+    parser.add_argument("--size", type=int, default=64, help="Thumbnail width and height the renders are compared at")
+    parser.add_argument("--chunk", type=int, default=256, help="Images decoded per chunk")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for decoding (default: CPU count)")
+    parser.add_argument("--ssim", type=float, default=0.98, help="SSIM at or above which a pair can be a near-duplicate")
+    parser.add_argument("--mad", type=float, default=0.01, help="Mean abs diff at or below which a pair can be a near-duplicate")
+    parser.add_argument("--json", help="Also write the results and suggested param_wedges to this file")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    index, wedge_config = open_wedge_folder(args.folder, args.prefix, args.workers)
+    if wedge_config is None:
+        raise SystemExit(f"No wedge renders found in {args.folder}")
+    params = wedge_config["param_wedges"]
+    filename_prefix = wedge_config.get("filename_prefix", "image")
+    space = CombinationSpace(params, constraints=wedge_config.get("constraints"))
+
+    stats, missing = analyse(space, lambda combo: index.lookup(filename_prefix, combo), args.size, args.chunk, args.workers, args.ssim, args.mad)
+    print(format_report(stats, args.ssim, args.mad))
+    print(f"{len(space) - missing}/{len(space)} renders of {filename_prefix} analysed in {time.perf_counter() - start_time:.1f}s")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report_json(stats, params, missing, args.ssim, args.mad), f, indent=2)
+        print(f"Wrote {args.json}")
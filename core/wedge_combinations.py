@@ -0,0 +1,518 @@
+from decimal import Decimal
+from itertools import count, islice, product
+from math import prod
+
+
+class StepRange:
+    # Values from start to stop (inclusive) in increments of step, computed as start + i * step
+    # in decimal arithmetic so long ranges don't accumulate float drift. The types are those of
+    # the plain float loop it replaces, which filenames depend on: the first value is start as
+    # given, the others are ints when start and step are ints, floats otherwise.
+
+    def __init__(self, start, stop, step):
+        if step <= 0:
+            raise ValueError(f"minmax step must be positive, got {step}")
+        self.first = start
+        self.is_int = all(isinstance(v, int) and not isinstance(v, bool) for v in (start, step))
+        self.start = Decimal(str(start))
+        self.stop = Decimal(str(stop))
+        self.step = Decimal(str(step))
+        self.length = int((self.stop - self.start) // self.step) + 1 if self.stop >= self.start else 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.length))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("StepRange index out of range")
+        if i == 0:
+            return self.first
+        value = self.start + i * self.step
+        return int(value) if self.is_int else float(value)
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self[i]
+
+    def index(self, value):
+        offset = (Decimal(str(value)) - self.start) / self.step
+        i = int(offset.to_integral_value())
+        if 0 <= i < self.length and abs(offset - i) < Decimal("1e-9"):
+            return i
+        raise ValueError(f"{value} is not in {self}")
+
+    def __repr__(self):
+        return f"StepRange({self.start}, {self.stop}, {self.step})"
+
+
+def get_batch_param(params_dict):
+    # The param_wedges axis rendered as one batched prompt, if any.
+    batch_params = [param for param, values in params_dict.items() if values[2] == "batch"]
+    if len(batch_params) > 1:
+        raise ValueError(f"Only one parameter can use batch mode, got {batch_params}")
+    return batch_params[0] if batch_params else None
+
+
+def bisection_levels(length):
+    # Coarse to fine level of each index of an axis: both ends are level 0, the middle level 1,
+    # the quarter points level 2 and so on, so every level halves the gaps left by the last.
+    levels = [None] * length
+    for i in {0, length - 1} if length else ():
+        levels[i] = 0
+    level = 0
+    while None in levels:
+        level += 1
+        parts = 2 ** level
+        for j in range(1, parts, 2):
+            i = (j * (length - 1) + parts // 2) // parts
+            if levels[i] is None:
+                levels[i] = level
+    return levels
+
+
+def axis_values(param, values_config, mode):
+    if mode == "minmax":
+        min_val, max_val, step = values_config
+        return StepRange(min_val, max_val, step)
+    elif mode == "explicit":
+        return list(values_config)
+    elif mode == "batch":
+        # values_config is the batch size, each value is an image's index in the batch.
+        return StepRange(0, int(values_config) - 1, 1)
+    elif mode == "zip":
+        # {"with": axis, "values": [...]} or {"with": axis, "minmax": [min, max, step]}: one value
+        # per value of the axis it moves with.
+        if not isinstance(values_config, dict) or ("values" in values_config) == ("minmax" in values_config):
+            raise ValueError(f"Zipped parameter '{param}' needs 'with' and either 'values' or 'minmax'")
+        if "minmax" in values_config:
+            return StepRange(*values_config["minmax"])
+        return list(values_config["values"])
+    elif mode == "group":
+        # A list of {input: value} dicts, each setting several inputs of the node at once.
+        values = list(values_config)
+        if not values or not all(isinstance(value, dict) and value for value in values):
+            raise ValueError(f"Grouped parameter '{param}' needs a list of {{input: value}} dicts")
+        if any(set(value) != set(values[0]) for value in values):
+            raise ValueError(f"Every value of grouped parameter '{param}' must set the same inputs")
+        return values
+    raise ValueError(f"Unknown mode '{mode}' for parameter '{param}'")
+
+
+def wedge_inputs(params_dict):
+    # (input, node title, mode) of every node input a combination sets, in param_wedges order.
+    # Combinations are flat {input: value} dicts: a group axis contributes one input per key of
+    # its values, a zipped parameter its own input.
+    inputs = []
+    for param, (node_title, values_config, mode) in params_dict.items():
+        if mode == "group":
+            inputs += [(key, node_title, mode) for key in axis_values(param, values_config, mode)[0]]
+        else:
+            inputs.append((param, node_title, mode))
+    names = [name for name, _, _ in inputs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Inputs set by more than one wedge parameter: {duplicates}")
+    return inputs
+
+
+def zip_followers(params_dict):
+    # Axis -> parameters zipped to it, in param_wedges order.
+    followers = {}
+    for param, (node_title, values_config, mode) in params_dict.items():
+        if mode != "zip":
+            continue
+        leader = values_config.get("with") if isinstance(values_config, dict) else None
+        if leader not in params_dict or params_dict[leader][2] in ("zip", "batch"):
+            # A batch axis varies inside one prompt, where nothing else can change with it.
+            raise ValueError(f"Zipped parameter '{param}' must be 'with' a minmax, explicit or group parameter, got {leader}")
+        followers.setdefault(leader, []).append(param)
+    return followers
+
+
+def wedge_axes(params_dict):
+    # Names of the axes of the wedge: every parameter except zipped ones, which move with theirs.
+    return [param for param, values in params_dict.items() if values[2] != "zip"]
+
+
+def axis_node_titles(params_dict):
+    # Axis -> titles of the nodes its values change, including those of its zipped parameters.
+    titles = {param: [params_dict[param][0]] for param in wedge_axes(params_dict)}
+    for leader, followers in zip_followers(params_dict).items():
+        titles[leader] += [params_dict[param][0] for param in followers if params_dict[param][0] not in titles[leader]]
+    return titles
+
+
+def value_matcher(match):
+    if isinstance(match, dict):
+        if not match or set(match) - {"min", "max"}:
+            raise ValueError(f"A constraint range takes 'min' and/or 'max', got {match}")
+        low, high = match.get("min"), match.get("max")
+        return lambda value: (low is None or value >= low) and (high is None or value <= high)
+    values = match if isinstance(match, list) else [match]
+    return lambda value: value in values
+
+
+class Constraint:
+    # One entry of the wedge config's "constraints" list:
+    #   {"exclude": {input: match, ...}}                skips combinations where every input matches
+    #   {"when": {input: match}, "require": {...}}      skips combinations where every "when" input
+    #                                                   matches but a "require" input doesn't
+    # "when" is optional. A match is a value, a list of values or {"min": x, "max": y} (inclusive,
+    # either can be left out).
+
+    def __init__(self, rule, inputs):
+        if not isinstance(rule, dict) or ("exclude" in rule) == ("require" in rule) \
+                or set(rule) - ({"exclude"} if "exclude" in rule else {"require", "when"}):
+            raise ValueError(f"A constraint needs 'exclude', or 'require' with an optional 'when', got {rule}")
+        self.exclude = "exclude" in rule
+        self.when = self.matchers(rule.get("when", {}), inputs)
+        self.terms = self.matchers(rule["exclude" if self.exclude else "require"], inputs)
+        if not self.terms:
+            raise ValueError(f"Empty constraint {rule}")
+        self.inputs = set(self.when) | set(self.terms)
+
+    @staticmethod
+    def matchers(terms, inputs):
+        if not isinstance(terms, dict):
+            raise ValueError(f"Constraint terms must be an {{input: match}} dict, got {terms}")
+        for name in terms:
+            if name not in inputs:
+                raise ValueError(f"Unknown parameter '{name}' in constraint")
+        return {name: value_matcher(match) for name, match in terms.items()}
+
+    def allows(self, combo):
+        if self.exclude:
+            return not all(match(combo[name]) for name, match in self.terms.items())
+        if not all(match(combo[name]) for name, match in self.when.items()):
+            return True
+        return all(match(combo[name]) for name, match in self.terms.items())
+
+    @staticmethod
+    def settled(matchers, combo):
+        # (every input is in combo, one of those in combo doesn't match)
+        complete, failed = True, False
+        for name, match in matchers.items():
+            if name not in combo:
+                complete = False
+            elif not match(combo[name]):
+                failed = True
+        return complete, failed
+
+    def decide(self, combo):
+        # For a partial combination: True if it's allowed whatever the missing inputs are, False
+        # if it's excluded whatever they are, None if that depends on them.
+        terms_complete, terms_failed = self.settled(self.terms, combo)
+        if self.exclude:
+            if terms_failed:
+                return True
+            return False if terms_complete else None
+        when_complete, when_failed = self.settled(self.when, combo)
+        if when_failed or (terms_complete and not terms_failed):
+            return True
+        if when_complete and terms_failed:
+            return False
+        return None
+
+
+class CombinationSpace:
+    # The Cartesian product of every param_wedges axis without expanding it. Combinations are
+    # numbered in the same order as itertools.product (last axis varies fastest), and any
+    # index can be decoded to its combination and back. order lists the axes slowest first
+    # and defaults to the param_wedges order. Zipped parameters aren't axes, they take the
+    # value at their axis' position. constraints prune the product: indices still address the
+    # whole grid, but len(), iteration and enumerate() only count the allowed combinations.
+
+    def __init__(self, params_dict, order=None, constraints=None):
+        self.params = params_dict
+        self.inputs = [name for name, _, _ in wedge_inputs(params_dict)]
+        axis_names = wedge_axes(params_dict)
+        self.names = list(order) if order is not None else axis_names
+        if sorted(self.names) != sorted(axis_names):
+            raise ValueError(f"Axis order {self.names} does not match the wedge parameters")
+        self.axes = [axis_values(param, *params_dict[param][1:3]) for param in self.names]
+        self.grouped = [params_dict[param][2] == "group" for param in self.names]
+        # (parameter, values) zipped to each axis.
+        followers = zip_followers(params_dict)
+        self.zipped = [[(param, axis_values(param, *params_dict[param][1:3])) for param in followers.get(name, [])]
+                       for name in self.names]
+        for name, values, zipped in zip(self.names, self.axes, self.zipped):
+            for param, zipped_values in zipped:
+                if len(zipped_values) != len(values):
+                    raise ValueError(f"Zipped parameter '{param}' has {len(zipped_values)} values but '{name}' has {len(values)}")
+        self.simple = not any(self.grouped) and not any(self.zipped)
+        # strides[i] is how many combinations pass before axis i changes value.
+        self.strides = []
+        stride = 1
+        for values in reversed(self.axes):
+            self.strides.insert(0, stride)
+            stride *= len(values)
+        self.size = stride if self.axes else 0
+
+        self.constraints = [Constraint(rule, self.inputs) for rule in constraints or ()]
+        input_axis = {}
+        for axis, values in enumerate(self.axes):
+            for name in (values[0] if self.grouped[axis] else [self.names[axis]]):
+                input_axis[name] = axis
+            for param, _ in self.zipped[axis]:
+                input_axis[param] = axis
+        batch_param = get_batch_param(params_dict)
+        if any(batch_param in constraint.inputs for constraint in self.constraints):
+            raise ValueError(f"Constraints can't use the batch parameter '{batch_param}'")
+        # Axes the constraints read.
+        self.constrained_axes = sorted({input_axis[name] for constraint in self.constraints for name in constraint.inputs})
+        self.allowed_count = None
+
+    def __len__(self):
+        if not self.constraints:
+            return self.size
+        if self.allowed_count is None:
+            self.allowed_count = self.count_allowed([range(len(values)) for values in self.axes]) if self.size else 0
+        return self.allowed_count
+
+    def axis_sizes(self):
+        return {name: len(values) for name, values in zip(self.names, self.axes)}
+
+    def value_label(self, axis, d):
+        # Text for the d-th value of an axis, followed by the values zipped to it.
+        value = self.axes[axis][d]
+        label = ", ".join(f"{key} {v}" for key, v in value.items()) if self.grouped[axis] else str(value)
+        zipped = ", ".join(f"{param} {values[d]}" for param, values in self.zipped[axis])
+        return f"{label} ({zipped})" if zipped else label
+
+    def set_axis(self, combo, axis, d):
+        # Sets the inputs axis changes to its d-th value.
+        value = self.axes[axis][d]
+        if self.grouped[axis]:
+            combo.update(value)
+        else:
+            combo[self.names[axis]] = value
+        for param, values in self.zipped[axis]:
+            combo[param] = values[d]
+
+    def combination(self, digits):
+        if self.simple:
+            return {name: values[d] for name, values, d in zip(self.names, self.axes, digits)}
+        combo = {}
+        for axis, d in enumerate(digits):
+            self.set_axis(combo, axis, d)
+        return combo
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CombinationSlice(self, range(*index.indices(self.size)))
+        if index < 0:
+            index += self.size
+        return self.combination(self.digits(index))
+
+    def digits(self, index):
+        # Mixed-radix decoding of index into one value position per axis.
+        if not 0 <= index < self.size:
+            raise IndexError("combination index out of range")
+        digits = []
+        for stride in self.strides:
+            digit, index = divmod(index, stride)
+            digits.append(digit)
+        return digits
+
+    def index_of(self, combo):
+        index = 0
+        for axis, (name, values, stride) in enumerate(zip(self.names, self.axes, self.strides)):
+            value = {key: combo[key] for key in values[0]} if self.grouped[axis] else combo[name]
+            index += values.index(value) * stride
+        return index
+
+    def allows(self, combo):
+        return all(constraint.allows(combo) for constraint in self.constraints)
+
+    def __contains__(self, combo):
+        if set(combo) != set(self.inputs):
+            return False
+        try:
+            digits = self.digits(self.index_of(combo))
+        except (KeyError, ValueError):
+            return False
+        # Zipped values must be the ones at their axis' position.
+        return (self.simple or combo == self.combination(digits)) and self.allows(combo)
+
+    # --- Constraints ---
+
+    def allowed_blocks(self, axes, digit_choices):
+        # Digit prefixes (ascending axis positions, values from digit_choices[axis]) whose every
+        # completion is allowed. A branch stops as soon as every constraint is settled, so neither
+        # excluded blocks of the product nor those no constraint depends on are walked.
+        def walk(k, combo, digits, pending):
+            undecided = []
+            for constraint in pending:
+                decision = constraint.decide(combo)
+                if decision is False:
+                    return
+                if decision is None:
+                    undecided.append(constraint)
+            if not undecided:
+                yield digits
+                return
+            axis = axes[k]
+            for d in digit_choices[axis]:
+                partial = dict(combo)
+                self.set_axis(partial, axis, d)
+                yield from walk(k + 1, partial, digits + (d,), undecided)
+        return walk(0, {}, (), self.constraints)
+
+    def count_allowed(self, digit_choices):
+        # Allowed combinations with digits from digit_choices[axis]. Only the constrained axes are
+        # walked, every other axis multiplies the count.
+        axes = self.constrained_axes
+        total = 0
+        for digits in self.allowed_blocks(axes, digit_choices):
+            total += prod(len(digit_choices[axis]) for axis in axes[len(digits):])
+        return total * prod(len(choices) for axis, choices in enumerate(digit_choices) if axis not in axes)
+
+    def count_allowed_before(self, index):
+        # Allowed combinations among the first index ones of the grid. The range splits into one
+        # block per axis: the digits of index before it, a smaller digit on it, anything after.
+        if index >= self.size:
+            return len(self)
+        if index <= 0:
+            return 0
+        digits = self.digits(index)
+        full = [range(len(values)) for values in self.axes]
+        return sum(self.count_allowed([[d] for d in digits[:k]] + [range(digits[k])] + full[k + 1:])
+                   for k in range(len(digits)) if digits[k])
+
+    def allowed_runs(self):
+        # (start, stop) index ranges of the allowed combinations, in order: one per allowed block.
+        if not self.size:
+            return
+        for digits in self.allowed_blocks(range(len(self.axes)), [range(len(values)) for values in self.axes]):
+            start = sum(d * stride for d, stride in zip(digits, self.strides))
+            yield start, start + (self.strides[len(digits) - 1] if digits else self.size)
+
+    def __iter__(self):
+        if self.simple and not self.constraints:
+            if not self.axes:
+                return
+            for values in product(*self.axes):
+                yield dict(zip(self.names, values))
+            return
+        for start, stop in self.allowed_runs():
+            yield from self.iter_range(start, stop)
+
+    def iter_range(self, start, stop):
+        # Streams combinations start..stop-1, decoding only the first one. Excluded combinations
+        # are included: this walks the grid.
+        if start >= stop:
+            return
+        # Restarts the product from start's digits instead of skipping through it.
+        yield from islice(self.iter_from_digits(self.digits(start)), stop - start)
+
+    def iter_from_digits(self, digits):
+        digits = list(digits)
+        while True:
+            yield self.combination(digits)
+            for axis in reversed(range(len(digits))):
+                digits[axis] += 1
+                if digits[axis] < len(self.axes[axis]):
+                    break
+                digits[axis] = 0
+            else:
+                return
+
+    def enumerate(self, start=1):
+        # (number, combination) pairs of the allowed combinations, numbered from start.
+        return zip(count(start), self)
+
+    # --- Coarse to fine order ---
+    # Only minmax axes are refined, every value of an explicit, group or batch axis is level 0.
+    # Level L holds the combinations whose finest axis value is level L, so the run up to the end
+    # of any level is an even grid over the whole space.
+
+    def axis_levels(self):
+        return [bisection_levels(len(values)) if self.params[name][2] == "minmax" else [0] * len(values)
+                for name, values in zip(self.names, self.axes)]
+
+    def level_sizes(self):
+        # Number of allowed combinations in each level.
+        axis_levels = self.axis_levels()
+        sizes = []
+        covered = 0
+        for level in range(max((max(levels, default=0) for levels in axis_levels), default=0) + 1):
+            total = self.count_allowed([[d for d, l in enumerate(levels) if l <= level] for levels in axis_levels])
+            sizes.append(total - covered)
+            covered = total
+        return sizes
+
+    def iter_level(self, level, axis_levels=None):
+        # Allowed combinations of one level, in the usual order (last axis fastest) within the level.
+        axis_levels = axis_levels or self.axis_levels()
+        indices = [[d for d, l in enumerate(levels) if l <= level] for levels in axis_levels]
+        for digits in product(*indices):
+            if max((levels[d] for levels, d in zip(axis_levels, digits)), default=0) == level:
+                combo = self.combination(digits)
+                if self.allows(combo):
+                    yield combo
+
+    def progressive(self, start=1):
+        # (number, combination) pairs, coarse to fine, numbered in that order.
+        if not self.axes:
+            return
+        axis_levels = self.axis_levels()
+        number = start
+        for level in range(len(self.level_sizes())):
+            for combo in self.iter_level(level, axis_levels):
+                yield number, combo
+                number += 1
+
+    def shard(self, shard_index, shard_count):
+        # Contiguous index range for one of shard_count roughly equal shards.
+        start = self.size * shard_index // shard_count
+        stop = self.size * (shard_index + 1) // shard_count
+        return self[start:stop]
+
+
+class CombinationSlice:
+    # A lazy index range of a CombinationSpace. Iterating it skips excluded combinations.
+
+    def __init__(self, space, indices):
+        self.space = space
+        self.indices = indices
+
+    def __len__(self):
+        # Allowed combinations only, like the space itself.
+        if not self.space.constraints:
+            return len(self.indices)
+        if self.indices.step != 1:
+            return sum(1 for _ in self.items())
+        if self.indices.start >= self.indices.stop:
+            return 0
+        return self.space.count_allowed_before(self.indices.stop) - self.space.count_allowed_before(self.indices.start)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return CombinationSlice(self.space, self.indices[i])
+        return self.space[self.indices[i]]
+
+    def items(self):
+        # (index, combination) pairs of the allowed combinations in the range.
+        if self.indices.step != 1:
+            for i in self.indices:
+                combo = self.space[i]
+                if self.space.allows(combo):
+                    yield i, combo
+            return
+        for run_start, run_stop in self.space.allowed_runs():
+            start, stop = max(run_start, self.indices.start), min(run_stop, self.indices.stop)
+            if start < stop:
+                yield from zip(range(start, stop), self.space.iter_range(start, stop))
+
+    def __iter__(self):
+        for _, combo in self.items():
+            yield combo
+
+    def enumerate(self, start=1):
+        # (number, combination) pairs numbered by position in the whole grid.
+        for i, combo in self.items():
+            yield i + start, combo
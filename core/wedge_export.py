@@ -0,0 +1,465 @@
+import argparse
+import io
+import json
+import math
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+from PIL import Image, ImageDraw, ImageFont
+
+from png_metadata import PNG_SIGNATURE, png_chunk, text_chunk
+from wedge_combinations import CombinationSpace
+from wedge_index import open_wedge_folder, read_wedge_entry
+
+# Exports one or two wedge axes, with every other axis held at a fixed value, as an animated
+# sweep (GIF or WebP) or a labelled comparison sheet (PNG). Renders are found the same way the
+# viewer finds them. Worker processes decode, resize, caption and (for animations) encode each
+# frame; this process only appends the results to the output file in order. At most a few
+# frames per worker are in flight, and a sheet is written one row of cells at a time, so
+# memory doesn't grow with the number of images or the size of the sheet.
+
+BACKGROUND = (32, 32, 32)
+TEXT_COLOR = (230, 230, 230)
+MISSING_COLOR = (64, 24, 24)
+IDAT_SIZE = 2**20
+WEBP_FRAME_CHUNKS = (b"ALPH", b"VP8 ", b"VP8L")
+
+
+def load_font(size):
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow without FreeType only has the fixed size bitmap font.
+        return ImageFont.load_default()
+
+
+def caption_height(font_size):
+    return int(font_size * 1.6)
+
+
+def render_cell(path, image_size, caption, font_size, encoding, placeholder="missing"):
+    # Runs in a worker process. path fitted into image_size, with caption in a band below it,
+    # or placeholder if there's no image. Returned as raw RGB bytes, or as a single frame GIF or
+    # WebP file for encoding "GIF"/"WEBP".
+    band = caption_height(font_size) if caption else 0
+    cell = Image.new("RGB", (image_size[0], image_size[1] + band), BACKGROUND)
+    image = None
+    if path is not None:
+        try:
+            with Image.open(path) as source:
+                source.draft("RGB", image_size)
+                image = source.convert("RGB")
+        except OSError:
+            image = None
+    draw = ImageDraw.Draw(cell)
+    font = load_font(font_size)
+    if image is None:
+        draw.rectangle((0, 0, image_size[0] - 1, image_size[1] - 1), fill=MISSING_COLOR)
+        draw.text((image_size[0] // 2, image_size[1] // 2), placeholder, fill=TEXT_COLOR, font=font, anchor="mm")
+    else:
+        image.thumbnail(image_size, Image.LANCZOS)
+        cell.paste(image, ((image_size[0] - image.width) // 2, (image_size[1] - image.height) // 2))
+    if caption:
+        draw.text((image_size[0] // 2, image_size[1] + band // 2), caption, fill=TEXT_COLOR, font=font, anchor="mm")
+    if encoding == "raw":
+        return cell.tobytes()
+    buffer = io.BytesIO()
+    if encoding == "WEBP":
+        cell.save(buffer, "WEBP", quality=85, method=4)
+    else:
+        cell.save(buffer, "GIF")
+    return buffer.getvalue()
+
+
+def ordered_results(executor, fn, jobs, window):
+    # fn(*job) for every job, in order, with at most window of them submitted at a time.
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(fn, *job))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class GifWriter:
+    # Animated GIF assembled from single frame GIFs. Each frame keeps its own palette as a
+    # local color table, so frames are quantized independently (and in parallel).
+
+    def __init__(self, f, size, duration_ms, loop=0):
+        self.f = f
+        self.delay = max(1, round(duration_ms / 10))
+        f.write(b"GIF89a" + struct.pack("<HHBBB", size[0], size[1], 0, 0, 0))
+        f.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\0")
+
+    def add_frame(self, data):
+        flags = data[10]
+        pos = 13
+        palette = b""
+        if flags & 0x80:
+            palette = data[pos:pos + 3 * 2 ** ((flags & 7) + 1)]
+            pos += len(palette)
+        while data[pos:pos + 1] == b"!":
+            pos = self.skip_sub_blocks(data, pos + 2)
+        if data[pos:pos + 1] != b",":
+            raise ValueError("Unexpected GIF frame layout")
+        left, top, width, height, local_flags = struct.unpack("<HHHHB", data[pos + 1:pos + 10])
+        pos += 10
+        if local_flags & 0x80:
+            palette = data[pos:pos + 3 * 2 ** ((local_flags & 7) + 1)]
+            pos += len(palette)
+        # Local color table of the frame's own size, interlacing as it was encoded.
+        table_bits = (local_flags & 0x07) if local_flags & 0x80 else (flags & 0x07)
+        descriptor_flags = 0x80 | (local_flags & 0x40) | table_bits
+        image_data_end = self.skip_sub_blocks(data, pos + 1)
+        self.f.write(b"!\xf9\x04\x04" + struct.pack("<H", self.delay) + b"\0\0")
+        self.f.write(b"," + struct.pack("<HHHHB", left, top, width, height, descriptor_flags) + palette)
+        self.f.write(data[pos:image_data_end])
+
+    @staticmethod
+    def skip_sub_blocks(data, pos):
+        # Position after the sub-blocks starting at pos and their terminator.
+        while data[pos]:
+            pos += data[pos] + 1
+        return pos + 1
+
+    def close(self):
+        self.f.write(b";")
+
+
+class WebPWriter:
+    # Animated WebP assembled from single frame WebPs, each wrapped in an ANMF chunk. The RIFF
+    # size is patched in once the last frame is written.
+
+    def __init__(self, f, size, duration_ms, loop=0):
+        self.f = f
+        self.size = size
+        self.duration = max(1, round(duration_ms))
+        f.write(b"RIFF\0\0\0\0WEBP")
+        self.write_chunk(b"VP8X", bytes([0x02, 0, 0, 0]) + self.uint24(size[0] - 1) + self.uint24(size[1] - 1))
+        self.write_chunk(b"ANIM", struct.pack("<IH", 0xFF000000 | (BACKGROUND[0] << 16) | (BACKGROUND[1] << 8) | BACKGROUND[2], loop))
+
+    @staticmethod
+    def uint24(value):
+        return struct.pack("<I", value)[:3]
+
+    def write_chunk(self, fourcc, data):
+        self.f.write(fourcc + struct.pack("<I", len(data)) + data + (b"\0" if len(data) % 2 else b""))
+
+    def add_frame(self, data):
+        if data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+            raise ValueError("Not a WebP frame")
+        frame = []
+        pos = 12
+        while pos + 8 <= len(data):
+            fourcc = data[pos:pos + 4]
+            length = struct.unpack("<I", data[pos + 4:pos + 8])[0]
+            if fourcc in WEBP_FRAME_CHUNKS:
+                frame.append(data[pos:pos + 8 + length + length % 2])
+            pos += 8 + length + length % 2
+        # No offset, no blending with the previous frame, no disposal.
+        header = self.uint24(0) + self.uint24(0) + self.uint24(self.size[0] - 1) + self.uint24(self.size[1] - 1)
+        self.write_chunk(b"ANMF", header + self.uint24(self.duration) + b"\x02" + b"".join(frame))
+
+    def close(self):
+        end = self.f.tell()
+        self.f.seek(4)
+        self.f.write(struct.pack("<I", end - 8))
+        self.f.seek(end)
+
+
+class PngStreamWriter:
+    # RGB PNG written a band of rows at a time, compressed as it goes.
+
+    def __init__(self, f, size, texts=None):
+        self.f = f
+        self.width = size[0]
+        self.compressor = zlib.compressobj(6)
+        self.pending = []
+        self.pending_bytes = 0
+        f.write(PNG_SIGNATURE)
+        f.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", size[0], size[1], 8, 2, 0, 0, 0)))
+        for keyword, text in (texts or {}).items():
+            f.write(text_chunk(keyword, text))
+
+    def write_rows(self, image):
+        raw = image.tobytes()
+        stride = self.width * 3
+        # Each row starts with its filter type, 0 (none).
+        self.add_compressed(self.compressor.compress(b"".join(
+            b"\0" + raw[i:i + stride] for i in range(0, len(raw), stride))))
+
+    def add_compressed(self, data):
+        self.pending.append(data)
+        self.pending_bytes += len(data)
+        if self.pending_bytes >= IDAT_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending_bytes:
+            self.f.write(png_chunk(b"IDAT", b"".join(self.pending)))
+        self.pending = []
+        self.pending_bytes = 0
+
+    def close(self):
+        self.add_compressed(self.compressor.flush())
+        self.flush()
+        self.f.write(png_chunk(b"IEND", b""))
+
+
+def parse_axis_value(param, values, text, labels=()):
+    # The value of param's axis that text stands for, compared as text, as one of the values'
+    # labels or as a number.
+    for value in values:
+        if str(value) == text:
+            return value
+    for value, label in zip(values, labels):
+        if label == text:
+            return value
+    try:
+        number = float(text)
+    except ValueError:
+        number = None
+    if number is not None:
+        for value in values:
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and abs(value - number) < 1e-9:
+                return value
+    raise ValueError(f"{text} is not one of the values of {param}: {list(values)}")
+
+
+def image_size_for(paths, max_size):
+    # Size of the first readable render, scaled down to fit max_size.
+    for path in paths:
+        if path is None:
+            continue
+        try:
+            with Image.open(path) as image:
+                width, height = image.size
+        except OSError:
+            continue
+        scale = min(1.0, max_size / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return None
+
+
+class WedgeExport:
+    # The combinations to export and where their renders are: axes vary, every other axis of the
+    # wedge is held at a fixed value. Combinations are addressed by {axis: value position}.
+
+    def __init__(self, index, wedge_config, axes, fixed):
+        self.index = index
+        self.filename_prefix = wedge_config.get("filename_prefix", "image")
+        self.space = CombinationSpace(wedge_config["param_wedges"], constraints=wedge_config.get("constraints"))
+        self.values = {name: list(values) for name, values in zip(self.space.names, self.space.axes)}
+        for param in axes:
+            if param not in self.values:
+                raise ValueError(f"Unknown axis '{param}', the wedge has {list(self.values)}")
+        if len(axes) not in (1, 2) or len(set(axes)) != len(axes):
+            raise ValueError(f"Export one or two different axes, got {axes}")
+        self.axes = list(axes)
+        unknown = [param for param in fixed if param not in self.values and param not in self.space.inputs]
+        if unknown:
+            raise ValueError(f"Unknown axes {unknown}, the wedge has {list(self.values)}")
+        # fixed can be a render's combination, where a group axis' value is spread over its inputs.
+        self.fixed = {}
+        self.positions = {}
+        for axis, (param, values) in enumerate(self.values.items()):
+            if param in axes:
+                continue
+            if param in fixed:
+                value = fixed[param]
+            elif self.space.grouped[axis] and all(key in fixed for key in values[0]):
+                value = {key: fixed[key] for key in values[0]}
+            else:
+                value = values[0]
+            if value not in values:
+                labels = [self.space.value_label(axis, d) for d in range(len(values))]
+                value = parse_axis_value(param, values, str(value), labels)
+            self.fixed[param] = value
+            self.positions[param] = values.index(value)
+
+    def combination(self, positions):
+        digits = [positions[name] if name in positions else self.positions[name] for name in self.space.names]
+        return self.space.combination(digits)
+
+    def label(self, param, position):
+        return f"{param}: {self.space.value_label(self.space.names.index(param), position)}"
+
+    def combinations(self):
+        # Every exported combination, first axis slowest.
+        return [dict(zip(self.axes, digits)) for digits in product(*(range(len(self.values[param])) for param in self.axes))]
+
+    def renders(self, cells):
+        # (paths, placeholders) of cells. A path is None when the render is missing, or when the
+        # constraints exclude the combination, which the placeholder text tells apart.
+        paths, placeholders = [], []
+        for positions in cells:
+            combo = self.combination(positions)
+            allowed = self.space.allows(combo)
+            paths.append(self.index.lookup(self.filename_prefix, combo) if allowed else None)
+            placeholders.append("missing" if allowed else "excluded")
+        return paths, placeholders
+
+    def description(self):
+        fixed = ", ".join(self.label(param, position) for param, position in self.positions.items())
+        return f"{self.filename_prefix} - {' x '.join(self.axes)}" + (f" at {fixed}" if fixed else "")
+
+
+def count_missing(paths, placeholders):
+    return sum(1 for path, placeholder in zip(paths, placeholders) if path is None and placeholder == "missing")
+
+
+def export_animation(export, output_path, encoding, max_size, font_size, duration_ms, max_workers=None):
+    # Returns (frames, missing). Frames of combinations the constraints exclude aren't counted.
+    combos = export.combinations()
+    paths, placeholders = export.renders(combos)
+    image_size = image_size_for(paths, max_size)
+    if image_size is None:
+        raise ValueError(f"No renders of {export.description()} found")
+    frame_size = (image_size[0], image_size[1] + caption_height(font_size))
+    captions = [", ".join(export.label(param, combo[param]) for param in export.axes) for combo in combos]
+    writer_class = WebPWriter if encoding == "WEBP" else GifWriter
+    temp_path = output_path + ".part"
+    try:
+        with open(temp_path, "wb") as f, ProcessPoolExecutor(max_workers=max_workers) as executor:
+            writer = writer_class(f, frame_size, duration_ms)
+            window = 2 * (max_workers or os.cpu_count() or 1)
+            jobs = ((path, image_size, caption, font_size, encoding, placeholder)
+                    for path, caption, placeholder in zip(paths, captions, placeholders))
+            for frame in ordered_results(executor, render_cell, jobs, window):
+                writer.add_frame(frame)
+            writer.close()
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return len(combos) - placeholders.count("excluded"), count_missing(paths, placeholders)
+
+
+def export_sheet(export, output_path, max_size, font_size, columns=None, max_workers=None):
+    # Two axes are laid out as rows and columns with their values as headers. A single axis is
+    # wrapped into rows of columns cells (default about square), each captioned with its value.
+    # Returns (images, missing), not counting the cells of combinations the constraints exclude.
+    combos = export.combinations()
+    paths, placeholders = export.renders(combos)
+    image_size = image_size_for(paths, max_size)
+    if image_size is None:
+        raise ValueError(f"No renders of {export.description()} found")
+    font = load_font(font_size)
+    band = caption_height(font_size)
+    measure = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    if len(export.axes) == 2:
+        row_param, col_param = export.axes
+        columns = len(export.values[col_param])
+        row_labels = [export.label(row_param, d) for d in range(len(export.values[row_param]))]
+        label_width = int(max(measure.textlength(label, font=font) for label in row_labels)) + font_size
+        header_labels = [export.label(col_param, d) for d in range(columns)]
+        if max(measure.textlength(label, font=font) for label in header_labels) > image_size[0]:
+            # Just the values when the labels don't fit the cells, the title says which axis it is.
+            col_axis = export.space.names.index(col_param)
+            header_labels = [export.space.value_label(col_axis, d) for d in range(columns)]
+        captions = [None] * len(combos)
+        cell_size = image_size
+    else:
+        columns = columns or math.ceil(math.sqrt(len(combos)))
+        row_labels = [None] * math.ceil(len(combos) / columns)
+        label_width = 0
+        header_labels = []
+        captions = [export.label(export.axes[0], combo[export.axes[0]]) for combo in combos]
+        cell_size = (image_size[0], image_size[1] + band)
+
+    title = export.description() + (f" - rows {export.axes[0]}, columns {export.axes[1]}" if len(export.axes) == 2 else "")
+    header_height = band * (2 if header_labels else 1)
+    width = max(label_width + columns * cell_size[0], int(measure.textlength(title, font=font)) + font_size)
+    height = header_height + len(row_labels) * cell_size[1]
+
+    header = Image.new("RGB", (width, header_height), BACKGROUND)
+    draw = ImageDraw.Draw(header)
+    draw.text((font_size // 2, band // 2), title, fill=TEXT_COLOR, font=font, anchor="lm")
+    for column, label in enumerate(header_labels):
+        draw.text((label_width + column * cell_size[0] + cell_size[0] // 2, band + band // 2), label,
+                  fill=TEXT_COLOR, font=font, anchor="mm")
+
+    temp_path = output_path + ".part"
+    texts = {"Description": title, "wedge_export": json.dumps({"axes": export.axes, "fixed": export.fixed})}
+    try:
+        with open(temp_path, "wb") as f, ProcessPoolExecutor(max_workers=max_workers) as executor:
+            writer = PngStreamWriter(f, (width, height), texts)
+            writer.write_rows(header)
+            window = max(2 * (max_workers or os.cpu_count() or 1), columns)
+            jobs = ((path, image_size, caption, font_size, "raw", placeholder)
+                    for path, caption, placeholder in zip(paths, captions, placeholders))
+            cells = ordered_results(executor, render_cell, jobs, window)
+            for row, label in enumerate(row_labels):
+                strip = Image.new("RGB", (width, cell_size[1]), BACKGROUND)
+                if label is not None:
+                    ImageDraw.Draw(strip).text((font_size // 2, cell_size[1] // 2), label, fill=TEXT_COLOR, font=font, anchor="lm")
+                for column in range(min(columns, len(combos) - row * columns)):
+                    cell = Image.frombytes("RGB", cell_size, next(cells))
+                    strip.paste(cell, (label_width + column * cell_size[0], 0))
+                writer.write_rows(strip)
+            writer.close()
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return len(combos) - placeholders.count("excluded"), count_missing(paths, placeholders)
+
+
+# ------------------ MAIN ENTRY ------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export wedge axes as an animated sweep (.gif, .webp) or a comparison sheet (.png)")
+    parser.add_argument("folder", help="Folder containing wedge renders")
+    parser.add_argument("output", help="Output file, .gif or .webp for an animation, .png for a sheet")
+    parser.add_argument("--axis", action="append", required=True,
+                        help="param_wedges axis to export, once for a sweep, twice for rows and columns")
+    parser.add_argument("--set", action="append", default=[], metavar="PARAM=VALUE",
+                        help="Value of another axis (default: the value of --image, or the axis' first value)")
+    parser.add_argument("--image", help="Render to take the wedge and the other axes' values from")
+    parser.add_argument("--prefix", help="filename_prefix of the wedge (default: most recently rendered)")
+    parser.add_argument("--size", type=int, default=None, help="Longest side of each image (default: 512 for animations, 256 for sheets)")
+    parser.add_argument("--font-size", type=int, default=16, help="Label text size")
+    parser.add_argument("--fps", type=float, default=4, help="Animation frames per second")
+    parser.add_argument("--columns", type=int, default=None, help="Sheet columns when exporting a single axis")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    extension = os.path.splitext(args.output)[1].lower()
+    if extension not in (".gif", ".webp", ".png"):
+        raise SystemExit(f"Unsupported output type '{extension}', use .gif, .webp or .png")
+
+    start_time = time.perf_counter()
+    fixed = {}
+    prefix = args.prefix
+    if args.image:
+        entry = read_wedge_entry(args.image)
+        if entry is None:
+            raise SystemExit(f"No 'WEDGE_string' metadata found in {args.image}")
+        wedge_string, fixed = entry
+        prefix = json.loads(wedge_string).get("filename_prefix", "image")
+    index, wedge_config = open_wedge_folder(args.folder, prefix, args.workers)
+    if wedge_config is None:
+        raise SystemExit(f"No wedge renders found in {args.folder}")
+    for assignment in args.set:
+        param, separator, text = assignment.partition("=")
+        if not separator:
+            raise SystemExit(f"--set takes PARAM=VALUE, got '{assignment}'")
+        fixed[param] = text
+
+    try:
+        export = WedgeExport(index, wedge_config, args.axis, fixed)
+        if extension == ".png":
+            images, missing = export_sheet(export, args.output, args.size or 256, args.font_size, args.columns, args.workers)
+        else:
+            images, missing = export_animation(export, args.output, extension[1:].upper(), args.size or 512,
+                                               args.font_size, 1000 / args.fps, args.workers)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"Wrote {args.output}: {images} images of {export.description()}"
+          + (f", {missing} missing" if missing else "") + f" ({time.perf_counter() - start_time:.1f}s)")
+    index.close()
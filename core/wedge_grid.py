@@ -0,0 +1,126 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QObject, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtWidgets import QAbstractItemView, QTableView
+
+from image_cache import ImageCache
+
+# Contact sheet of two wedge axes. QTableView only asks for the cells that are on screen, so
+# thumbnails are only read, or made, for what is visible and memory stays flat however big
+# the grid is.
+
+
+class ThumbnailSignals(QObject):
+    # Bridges ThumbnailCache callbacks from worker threads back to the GUI thread.
+    thumbnail_ready = pyqtSignal(str)
+
+
+class ThumbnailGridModel(QAbstractTableModel):
+
+    def __init__(self, thumbnail_cache, resolve_path, cell_size=160, parent=None):
+        super().__init__(parent)
+        self.thumbnail_cache = thumbnail_cache
+        self.resolve_path = resolve_path
+        self.cell_size = cell_size
+        self.row_param = self.col_param = None
+        self.row_values = self.col_values = []
+        self.fixed_combo = {}
+        self.paths = {}
+        self.cells = {}
+        # Decoded thumbnails; at 160px a few hundred of them fit in 32 MB.
+        self.pixmap_cache = ImageCache(32 * 2**20)
+        self.signals = ThumbnailSignals()
+        self.signals.thumbnail_ready.connect(self.on_thumbnail_ready)
+
+    def set_layout(self, row_param, row_values, col_param, col_values, fixed_combo):
+        layout = (row_param, list(row_values), col_param, list(col_values), dict(fixed_combo))
+        if layout == (self.row_param, list(self.row_values), self.col_param, list(self.col_values), self.fixed_combo):
+            return
+        self.beginResetModel()
+        self.row_param, self.row_values = row_param, row_values
+        self.col_param, self.col_values = col_param, col_values
+        self.fixed_combo = dict(fixed_combo)
+        self.paths.clear()
+        self.cells.clear()
+        self.thumbnail_cache.cancel_pending()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return len(self.row_values)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.col_values)
+
+    def combo_at(self, row, column):
+        combo = dict(self.fixed_combo)
+        combo[self.row_param] = self.row_values[row]
+        combo[self.col_param] = self.col_values[column]
+        return combo
+
+    def path_at(self, row, column):
+        if (row, column) not in self.paths:
+            self.paths[(row, column)] = self.resolve_path(self.combo_at(row, column))
+        return self.paths[(row, column)]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if role == Qt.ToolTipRole:
+            return f"{self.row_param}: {self.row_values[row]}\n{self.col_param}: {self.col_values[column]}"
+        if role == Qt.SizeHintRole:
+            return QSize(self.cell_size, self.cell_size)
+        path = self.path_at(row, column)
+        if role == Qt.DisplayRole:
+            return "missing" if path is None else None
+        if role != Qt.DecorationRole or path is None:
+            return None
+
+        thumbnail_path = self.thumbnail_cache.get(path)
+        if thumbnail_path is None:
+            self.cells[path] = (row, column)
+            self.thumbnail_cache.request(path, self.on_thumbnail_done)
+            return None
+        key = (thumbnail_path, self.cell_size, self.cell_size)
+        image = self.pixmap_cache.get(key)
+        if image is None:
+            image = QImage(thumbnail_path).scaled(self.cell_size, self.cell_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            self.pixmap_cache.put(key, image)
+        return QPixmap.fromImage(image)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return f"{self.col_param}: {self.col_values[section]}"
+        return f"{self.row_param}: {self.row_values[section]}"
+
+    def on_thumbnail_done(self, src_path, thumbnail_path):
+        # Worker thread.
+        if thumbnail_path is not None:
+            self.signals.thumbnail_ready.emit(src_path)
+
+    def on_thumbnail_ready(self, src_path):
+        cell = self.cells.pop(src_path, None)
+        if cell is not None:
+            index = self.index(*cell)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class WedgeGridView(QTableView):
+
+    combination_activated = pyqtSignal(dict)
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.setIconSize(QSize(model.cell_size, model.cell_size))
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.horizontalHeader().setDefaultSectionSize(model.cell_size)
+        self.verticalHeader().setDefaultSectionSize(model.cell_size)
+        self.doubleClicked.connect(self.on_double_clicked)
+
+    def on_double_clicked(self, index):
+        self.combination_activated.emit(self.model().combo_at(index.row(), index.column()))
@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+from png_metadata import read_png_prompt
+from wedge_combinations import wedge_inputs
+from wedge_manifest import combination_key
+
+# Index of every wedge render in an output folder, built from the metadata ComfyUI embeds in
+# each PNG and kept in a SQLite file inside the folder. Rescans only read files that are new
+# or whose mtime/size changed since the last scan.
+
+INDEX_FILENAME = ".wedge_index.sqlite"
+SCHEMA_VERSION = 1
+COUNTER_PATTERN = re.compile(r"_(\d+)_\.png$", re.IGNORECASE)
+# Below this many files, starting worker processes costs more than it saves.
+MIN_PARALLEL_FILES = 200
+
+
+def get_wedge_string(prompt, node_title="WEDGE_string"):
+    for node in prompt.values():
+        if node.get("_meta", {}).get("title") == node_title:
+            return node["inputs"]["value"]
+    return None
+
+
+def combination_from_prompt(prompt, wedge_config, filename=None):
+    # The value each param_wedges input actually had when the image was rendered. The prompt of
+    # a batch mode axis holds the batch size, the image's index in the batch is in its filename.
+    titles = {}
+    for node in prompt.values():
+        titles.setdefault(node.get("_meta", {}).get("title"), node)
+    combo = {}
+    for param, node_title, mode in wedge_inputs(wedge_config.get("param_wedges", {})):
+        if mode == "batch":
+            match = re.search(rf"__{re.escape(param)}-(\d+)_", filename or "")
+            if match is None:
+                return None
+            combo[param] = int(match.group(1))
+            continue
+        node = titles.get(node_title)
+        if node is None or param not in node["inputs"]:
+            return None
+        combo[param] = node["inputs"][param]
+    return combo
+
+
+def read_wedge_entry(path):
+    # (wedge_string, combination) for a wedge render, None for any other file.
+    try:
+        prompt = read_png_prompt(path)
+    except Exception:
+        return None
+    if not prompt:
+        return None
+    wedge_string = get_wedge_string(prompt)
+    if wedge_string is None:
+        return None
+    try:
+        wedge_config = json.loads(wedge_string)
+    except json.JSONDecodeError:
+        return None
+    combo = combination_from_prompt(prompt, wedge_config, os.path.basename(path))
+    if combo is None:
+        return None
+    return wedge_string, combo
+
+
+def read_wedge_entries(paths, max_workers=None):
+    # read_wedge_entry for many files, spread over worker processes for large batches.
+    if len(paths) < MIN_PARALLEL_FILES or max_workers == 1:
+        return [read_wedge_entry(path) for path in paths]
+    # Only imported when needed, an index that is up to date starts faster without it.
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(read_wedge_entry, paths, chunksize=64))
+
+
+class WedgeIndex:
+
+    def __init__(self, folder, db_path=None):
+        self.folder = folder
+        self.db_path = db_path or os.path.join(folder, INDEX_FILENAME)
+        try:
+            self.db = sqlite3.connect(self.db_path)
+            self.db.execute("PRAGMA user_version").fetchone()
+        except sqlite3.OperationalError:
+            # Read-only folders get a throwaway in-memory index.
+            self.db_path = ":memory:"
+            self.db = sqlite3.connect(self.db_path)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.create_schema()
+
+    def create_schema(self):
+        self.db.executescript(f"""
+            DROP TABLE IF EXISTS files;
+            DROP TABLE IF EXISTS wedges;
+            CREATE TABLE wedges (
+                wedge_id TEXT PRIMARY KEY,
+                filename_prefix TEXT,
+                config TEXT
+            );
+            CREATE TABLE files (
+                filename TEXT PRIMARY KEY,
+                mtime REAL,
+                size INTEGER,
+                wedge_id TEXT,
+                combo_key TEXT,
+                counter INTEGER
+            );
+            CREATE INDEX files_combo ON files (combo_key);
+            PRAGMA user_version = {SCHEMA_VERSION};
+        """)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def scan(self, read_entries=read_wedge_entries):
+        # Returns (added or updated, removed) file counts. read_entries maps a list of paths to
+        # a list of read_wedge_entry results.
+        known = {row[0]: (row[1], row[2]) for row in self.db.execute("SELECT filename, mtime, size FROM files")}
+        on_disk = {}
+        changed = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(".png") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                on_disk[entry.name] = (stat.st_mtime, stat.st_size)
+                if known.get(entry.name) != on_disk[entry.name]:
+                    changed.append(entry.name)
+
+        removed = [name for name in known if name not in on_disk]
+        self.db.executemany("DELETE FROM files WHERE filename = ?", [(name,) for name in removed])
+
+        paths = [os.path.join(self.folder, name) for name in changed]
+        results = read_entries(paths)
+        rows = []
+        for name, result in zip(changed, results):
+            mtime, size = on_disk[name]
+            # Files without wedge metadata are still recorded so they aren't re-read every scan.
+            wedge_id = combo_key = None
+            if result is not None:
+                wedge_string, combo = result
+                wedge_id = hashlib.sha1(wedge_string.encode("utf-8")).hexdigest()
+                prefix = json.loads(wedge_string).get("filename_prefix", "")
+                self.db.execute("INSERT OR IGNORE INTO wedges VALUES (?, ?, ?)", (wedge_id, prefix, wedge_string))
+                combo_key = combination_key(combo)
+            match = COUNTER_PATTERN.search(name)
+            counter = int(match.group(1)) if match else 0
+            rows.append((name, mtime, size, wedge_id, combo_key, counter))
+        self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+        return len(changed), len(removed)
+
+    def lookup(self, filename_prefix, combo):
+        # Newest render of combo, so re-rendered duplicates show the latest version.
+        row = self.db.execute("""
+            SELECT files.filename FROM files JOIN wedges USING (wedge_id)
+            WHERE files.combo_key = ? AND wedges.filename_prefix = ?
+            ORDER BY files.mtime DESC, files.counter DESC LIMIT 1
+        """, (combination_key(combo), filename_prefix)).fetchone()
+        return os.path.join(self.folder, row[0]) if row else None
+
+    def latest_wedge_config(self, filename_prefix=None):
+        # Config of the most recently rendered wedge in the folder, optionally for one prefix.
+        query = """
+            SELECT wedges.config FROM files JOIN wedges USING (wedge_id)
+            {} ORDER BY files.mtime DESC LIMIT 1
+        """.format("WHERE wedges.filename_prefix = ?" if filename_prefix is not None else "")
+        row = self.db.execute(query, (filename_prefix,) if filename_prefix is not None else ()).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM files WHERE combo_key IS NOT NULL").fetchone()[0]
+
+
+def open_wedge_folder(folder, filename_prefix=None, max_workers=None):
+    # Indexes folder and returns (index, wedge config) of the most recently rendered wedge, or
+    # of the one with filename_prefix. The config is None if there is no such wedge.
+    index = WedgeIndex(folder)
+    index.scan(lambda paths: read_wedge_entries(paths, max_workers))
+    return index, index.latest_wedge_config(filename_prefix)
+
+
+def index_folder(folder, max_workers=None):
+    # Builds or updates the index of folder and prints what changed, for the command lines.
+    start = time.perf_counter()
+    index = WedgeIndex(folder)
+    added, removed = index.scan(lambda paths: read_wedge_entries(paths, max_workers))
+    print(f"{added} files indexed, {removed} removed, {index.count()} wedge renders in {index.db_path} "
+          f"({time.perf_counter() - start:.2f}s)")
+    index.close()
+
+
+# ------------------ MAIN ENTRY ------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the wedge index of an output folder")
+    parser.add_argument("folder", help="Folder containing wedge renders")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for reading metadata (default: CPU count)")
+    args = parser.parse_args()
+    index_folder(args.folder, args.workers)
@@ -0,0 +1,91 @@
+import copy
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_FILENAME = "wedge_manifest.jsonl"
+
+
+def combination_key(combo):
+    return json.dumps(combo, sort_keys=True)
+
+
+def workflow_fingerprint(loaded_workflow, ignored_inputs=(), ignored_nodes=()):
+    # Hash of the workflow with the per-combination inputs blanked out, so two runs only
+    # share rendered combinations if everything else about the workflow is the same.
+    workflow = copy.deepcopy(loaded_workflow)
+    for node_id in ignored_nodes:
+        workflow.pop(node_id, None)
+    for node_id, input_name in ignored_inputs:
+        if node_id in workflow:
+            workflow[node_id]["inputs"].pop(input_name, None)
+    for node in workflow.values():
+        node.pop("_meta", None)
+    data = json.dumps(workflow, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class RunManifest:
+    # Append-only journal of every submission in a wedge folder. Each line records one
+    # status change for one combination, the last line for a combination wins.
+
+    def __init__(self, path, fingerprint=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.records = {}
+        if os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write can leave a partial last line.
+                    continue
+                self.records[record["key"]] = record
+
+    def record(self, combo, status, **fields):
+        key = combination_key(combo)
+        record = {
+            "key": key,
+            "combination": combo,
+            "status": status,
+            "fingerprint": self.fingerprint,
+            "time": time.time(),
+        }
+        record.update(fields)
+        self.records[key] = record
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        return record
+
+    def get(self, combo):
+        return self.records.get(combination_key(combo))
+
+    def is_done(self, combo):
+        record = self.get(combo)
+        return (record is not None
+                and record["status"] == "done"
+                and record.get("fingerprint") == self.fingerprint)
+
+    def pending(self, combinations):
+        # Combinations that are missing, failed, unfinished or rendered from a different workflow.
+        return ((i, combo) for i, combo in combinations if not self.is_done(combo))
+
+    def done_count(self, space):
+        # How many combinations of space are already rendered, without walking the space.
+        return len([r for r in self.records.values()
+                    if r["status"] == "done" and r.get("fingerprint") == self.fingerprint
+                    and r["combination"] in space])
+
+    def summary(self):
+        counts = {}
+        for record in self.records.values():
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+        return counts
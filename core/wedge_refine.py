@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from itertools import product
+
+from PIL import Image, ImageChops, ImageStat
+
+from wedge_manifest import combination_key
+
+# Adaptive coarse to fine wedges. Combinations are handed out one level at a time (see
+# CombinationSpace.progressive). Each combination of a finer level is compared against the
+# renders that bracket it on the coarser grid: if those images are nearly identical the wedged
+# parameters make no visible difference there, so it is skipped and GPU time goes to the
+# regions where they do.
+
+THUMBNAIL_SIZE = (32, 32)
+
+
+def load_thumbnail(path):
+    with Image.open(path) as image:
+        return image.convert("RGB").resize(THUMBNAIL_SIZE, Image.BOX)
+
+
+def image_difference(a, b):
+    # Mean absolute difference of two thumbnails, from 0 (identical) to 1.
+    return sum(ImageStat.Stat(ImageChops.difference(a, b)).mean) / (3 * 255)
+
+
+class AdaptiveRefiner:
+
+    def __init__(self, space, threshold=0.02, rendered=None):
+        self.space = space
+        self.threshold = threshold
+        self.axis_levels = space.axis_levels()
+        self.level_count = len(space.level_sizes()) if len(space) else 0
+        self.level = 0
+        self.level_combinations = None
+        # Per axis, the value positions of the levels before the current one.
+        self.coarse = None
+        self.number = 0
+        # combination key -> local image path, None if it failed. rendered seeds it with the
+        # renders of an earlier run of the same wedge.
+        self.paths = dict(rendered or {})
+        self.outstanding = set()
+        # combination key -> (level, thumbnail or None if it couldn't be read).
+        self.thumbnails = {}
+        # Keys of the combinations this refiner skipped.
+        self.skipped_keys = set()
+        self.skipped = 0
+        self.finished = False
+        # Called with every combination that is skipped.
+        self.on_skip = None
+
+    def add_result(self, combo, path):
+        key = combination_key(combo)
+        self.outstanding.discard(key)
+        self.paths[key] = path
+
+    def combo_level(self, combo):
+        digits = self.space.digits(self.space.index_of(combo))
+        return max((levels[d] for levels, d in zip(self.axis_levels, digits)), default=0)
+
+    async def thumbnail(self, combo):
+        # None when the render failed, was cancelled or can't be read.
+        key = combination_key(combo)
+        if key not in self.thumbnails:
+            path = self.paths.get(key)
+            try:
+                thumbnail = await asyncio.get_running_loop().run_in_executor(None, load_thumbnail, path) if path else None
+            except OSError:
+                thumbnail = None
+            self.thumbnails[key] = (self.combo_level(combo), thumbnail)
+        return self.thumbnails[key][1]
+
+    def evict_thumbnails(self, level):
+        # Drops the thumbnails of levels below level, once it is finished. The next level mostly
+        # compares against the one just finished; older corners are read again if needed.
+        self.thumbnails = {key: entry for key, entry in self.thumbnails.items() if entry[0] >= level}
+
+    def bracket(self, combo):
+        # Combinations on the coarser grid around combo: its neighbours either side on every axis
+        # where combo's value is new in this level.
+        choices = []
+        digits = self.space.digits(self.space.index_of(combo))
+        for d, levels, coarse in zip(digits, self.axis_levels, self.coarse):
+            if levels[d] < self.level:
+                choices.append([d])
+            else:
+                i = bisect_left(coarse, d)
+                choices.append([coarse[i - 1], coarse[i]])
+        return [self.space.combination(corner) for corner in product(*choices)]
+
+    async def needs_render(self, combo):
+        corners = [corner for corner in self.bracket(combo) if self.space.allows(corner)]
+        # Constraints left nothing to compare against.
+        if len(corners) < 2:
+            return True
+        thumbnails = []
+        for corner in corners:
+            # Corners that were skipped lie in a region that was already found flat.
+            if combination_key(corner) in self.skipped_keys:
+                continue
+            thumbnail = await self.thumbnail(corner)
+            # A failed, cancelled or unreadable corner says nothing about the region.
+            if thumbnail is None:
+                return True
+            thumbnails.append(thumbnail)
+        if len(thumbnails) < 2:
+            return False
+        return any(image_difference(a, b) >= self.threshold
+                   for i, a in enumerate(thumbnails) for b in thumbnails[i + 1:])
+
+    async def next_job(self):
+        # The next (number, combination, members) job to render. None when there is nothing to
+        # hand out right now: finished is set once every level is done, otherwise the next level
+        # is waiting for the renders of the current one.
+        while True:
+            if self.level_combinations is None:
+                if self.outstanding:
+                    return None
+                if self.level >= self.level_count:
+                    self.finished = True
+                    return None
+                self.level_combinations = self.space.iter_level(self.level, self.axis_levels)
+                self.coarse = [[d for d, l in enumerate(levels) if l < self.level] for levels in self.axis_levels]
+                logging.info(f"Adaptive wedge - level {self.level + 1}/{self.level_count}, {self.skipped} combinations skipped so far")
+            combo = next(self.level_combinations, None)
+            if combo is None:
+                self.level_combinations = None
+                self.evict_thumbnails(self.level)
+                self.level += 1
+                continue
+            self.number += 1
+            if combination_key(combo) in self.paths:
+                continue
+            if self.level > 0 and not await self.needs_render(combo):
+                self.skipped_keys.add(combination_key(combo))
+                self.skipped += 1
+                if self.on_skip is not None:
+                    self.on_skip(combo)
+                continue
+            self.outstanding.add(combination_key(combo))
+            return self.number, combo, [(self.number, combo)]
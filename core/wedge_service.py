@@ -0,0 +1,461 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+
+from aiohttp import web
+
+from wedge_submitter import WedgeScheduler, load_wedge, plan_iterations, setup_logging
+
+# A long running wedge service for render farms. Wedge folders are submitted over a small
+# local HTTP API (or the CLI below), kept in a job file on disk and run across the configured
+# ComfyUI servers. Several wedges run at once and share each server's prompt slots by
+# priority, then fairly between projects. After a restart unfinished jobs carry on from
+# their manifests, so nothing that already rendered is submitted again.
+
+JOBS_FILENAME = "wedge_service_jobs.json"
+DEFAULT_SERVICE = "127.0.0.1:8190"
+# Statuses a job can still run from. Anything else is final until it is retried.
+ACTIVE_STATUSES = ("queued", "running")
+THROUGHPUT_WINDOW = 300
+
+
+class FairShare:
+    # Hands out the prompt slots of one server to the wedges running on it. The highest
+    # priority goes first; between equal priorities the project holding the fewest slots
+    # goes next, so one big wedge can't starve the others.
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self.workers = set()
+        self.waiting = set()
+
+    def join(self, worker):
+        self.workers.add(worker)
+
+    def leave(self, worker):
+        self.workers.discard(worker)
+        self.waiting.discard(worker)
+
+    def in_use(self):
+        return sum(worker.slots_in_use() for worker in self.workers)
+
+    def try_acquire(self, worker):
+        self.waiting.add(worker)
+        if self.in_use() >= self.capacity:
+            return False
+        project_slots = {}
+        for other in self.workers:
+            project = other.scheduler.project
+            project_slots[project] = project_slots.get(project, 0) + other.slots_in_use()
+        # Waiting workers that can't submit anything right now don't hold up the others.
+        candidates = [other for other in self.waiting if other is worker or other.wants_slot()]
+        best = min(candidates, key=lambda other: (-other.scheduler.priority, project_slots.get(other.scheduler.project, 0),
+                                                  other.scheduler.started_at))
+        if best is not worker:
+            return False
+        self.waiting.discard(worker)
+        return True
+
+
+class JobStore:
+    # Every job the service knows about, rewritten to disk whenever a job changes state.
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for job in json.load(f):
+                    self.jobs[job["id"]] = job
+
+    def next_id(self):
+        return max((job["id"] for job in self.jobs.values()), default=0) + 1
+
+    def save(self):
+        temp_path = self.path + ".part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(sorted(self.jobs.values(), key=lambda job: job["id"]), f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def close_wedge(wedge):
+    # Closes what load_wedge opened.
+    if wedge["render_cache"] is not None:
+        wedge["render_cache"].close()
+
+
+def load_and_plan(folder, resume=True):
+    # (wedge, plan_iterations result) of a wedge folder, resumed from its manifest. resume=None
+    # leaves it to the wedge config.
+    wedge = load_wedge(folder)
+    if resume is None:
+        resume = wedge["resume"]
+    try:
+        return wedge, plan_iterations(
+            wedge["loaded_workflow"], wedge["params"], wedge["manifest"], resume, wedge["order"], wedge["_for_testing"],
+            image_root=wedge["image_root"], adaptive_threshold=wedge["adaptive_threshold"],
+            constraints=wedge["constraints"])
+    except BaseException:
+        close_wedge(wedge)
+        raise
+
+
+class WedgeService:
+
+    def __init__(self, state_folder, servers=None, max_in_flight=2, max_active_jobs=4):
+        os.makedirs(state_folder, exist_ok=True)
+        self.store = JobStore(os.path.join(state_folder, JOBS_FILENAME))
+        self.servers = servers
+        self.max_in_flight = max_in_flight
+        self.max_active_jobs = max_active_jobs
+        # {server address: FairShare}, shared by the schedulers of every running job.
+        self.slots = {}
+        self.schedulers = {}
+        # Finish times of recent images, for images per minute.
+        self.finished_images = deque()
+        self.started_at = time.time()
+        self.wakeup = None
+
+        # --- Jobs that were running when the service stopped start again from their manifests ---
+        for job in self.store.jobs.values():
+            if job["status"] == "running":
+                job["status"] = "queued"
+        self.store.save()
+
+    # --- Jobs ---
+
+    async def add_job(self, folder, priority=0, project=None):
+        folder = os.path.abspath(folder)
+        # Loading reads the whole manifest, so it runs off the event loop like planning does.
+        try:
+            wedge = await asyncio.get_running_loop().run_in_executor(None, load_wedge, folder)
+        except SystemExit:
+            raise ValueError(f"{folder}: the workflow has no node the wedge config refers to")
+        except (OSError, KeyError) as e:
+            raise ValueError(f"{folder}: could not load the wedge - {e}")
+        # Only loaded to validate the folder, the job loads it again when it starts.
+        close_wedge(wedge)
+        job = {
+            "id": self.store.next_id(),
+            "folder": folder,
+            "project": project or os.path.basename(os.path.dirname(wedge["out_folder"])),
+            "priority": int(priority),
+            "status": "queued",
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "total": None,
+            "already_done": 0,
+            "completed": 0,
+            "failed": 0,
+        }
+        self.store.jobs[job["id"]] = job
+        self.store.save()
+        self.notify()
+        logging.info(f"Job {job['id']} queued - {folder} (project {job['project']}, priority {job['priority']})")
+        return job
+
+    def get_job(self, job_id):
+        job = self.store.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"No job {job_id}")
+        return job
+
+    def cancel_job(self, job_id):
+        job = self.get_job(job_id)
+        if job["id"] in self.schedulers:
+            # The job's task records it as cancelled once queued prompts have been removed.
+            self.schedulers[job["id"]].cancel()
+        elif job["status"] == "queued":
+            self.set_status(job, "cancelled")
+        return job
+
+    def retry_job(self, job_id):
+        job = self.get_job(job_id)
+        if job["status"] not in ACTIVE_STATUSES:
+            job["finished"] = None
+            self.set_status(job, "queued")
+            self.notify()
+        return job
+
+    def set_priority(self, job_id, priority):
+        job = self.get_job(job_id)
+        job["priority"] = int(priority)
+        if job["id"] in self.schedulers:
+            self.schedulers[job["id"]].priority = job["priority"]
+        self.store.save()
+        return job
+
+    def set_status(self, job, status):
+        job["status"] = status
+        if status not in ACTIVE_STATUSES:
+            job["finished"] = time.time()
+        self.store.save()
+
+    # --- Scheduling ---
+
+    def notify(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def next_queued(self):
+        queued = [job for job in self.store.jobs.values() if job["status"] == "queued"]
+        return min(queued, key=lambda job: (-job["priority"], job["created"]), default=None)
+
+    async def dispatch(self):
+        self.wakeup = asyncio.Event()
+        tasks = set()
+        while True:
+            while len(self.schedulers) < self.max_active_jobs:
+                job = self.next_queued()
+                if job is None:
+                    break
+                started = await self.start_job(job)
+                if started is None:
+                    continue
+                task = asyncio.ensure_future(self.run_job(job, *started))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start_job(self, job):
+        # (scheduler resumed from the manifest, wedge), or None if the folder can't be loaded.
+        # Loading and planning read the whole manifest, so they run in a thread while the
+        # running jobs keep receiving.
+        try:
+            wedge, (all_combinations, combinations_to_submit, total_to_submit) = \
+                await asyncio.get_running_loop().run_in_executor(None, load_and_plan, job["folder"])
+        except (OSError, KeyError, ValueError, SystemExit) as e:
+            logging.error(f"Job {job['id']} could not be started: {e}")
+            job["error"] = str(e)
+            self.set_status(job, "error")
+            return None
+        if job["status"] != "queued":
+            # Cancelled while it was loading.
+            close_wedge(wedge)
+            return None
+
+        scheduler = WedgeScheduler(
+            wedge["loaded_workflow"], wedge["params"], wedge["out_folder"], wedge["filename_prefix"],
+            combinations_to_submit, total_to_submit, len(all_combinations),
+            manifest=wedge["manifest"], timings=wedge["timings"], output_sync=wedge["output_sync"],
+            render_cache=wedge["render_cache"], image_root=wedge["image_root"],
+        )
+        scheduler.slots = self.slots
+        scheduler.priority = job["priority"]
+        scheduler.project = job["project"]
+        scheduler.on_progress = lambda progress, job=job: self.job_progress(job, progress)
+        wedge["server_addresses"] = self.servers or wedge["server_addresses"]
+        if isinstance(wedge["server_addresses"], str):
+            wedge["server_addresses"] = [wedge["server_addresses"]]
+        for address in wedge["server_addresses"]:
+            self.slots.setdefault(address, FairShare(self.max_in_flight))
+
+        # Progress covers the whole wedge, including what rendered before a restart.
+        job["total"] = len(all_combinations)
+        job["already_done"] = len(all_combinations) - total_to_submit
+        job["completed"] = job["already_done"]
+        job["failed"] = 0
+        job["started"] = time.time()
+        job.pop("error", None)
+        self.schedulers[job["id"]] = scheduler
+        self.set_status(job, "running")
+        logging.info(f"Job {job['id']} started - {total_to_submit}/{len(all_combinations)} combinations to render")
+        return scheduler, wedge
+
+    async def run_job(self, job, scheduler, wedge):
+        try:
+            await scheduler.run(wedge["server_addresses"], max_in_flight=self.max_in_flight, stall_timeout=wedge["stall_timeout"])
+            if scheduler.cancelled:
+                status = "cancelled"
+            elif scheduler.remaining > 0:
+                status = "incomplete"
+            else:
+                status = "done"
+        except Exception as e:
+            logging.exception(f"Job {job['id']} failed")
+            job["error"] = str(e)
+            status = "error"
+        close_wedge(wedge)
+        self.schedulers.pop(job["id"], None)
+        self.set_status(job, status)
+        logging.info(f"Job {job['id']} {status} - {job['completed']} rendered, {job['failed']} failed")
+        self.notify()
+
+    def job_progress(self, job, progress):
+        now = time.time()
+        completed = job["already_done"] + progress["completed"]
+        for _ in range(completed - job["completed"]):
+            self.finished_images.append(now)
+        job["completed"] = completed
+        job["failed"] = progress["failed"]
+
+    # --- Metrics ---
+
+    def metrics(self):
+        now = time.time()
+        while self.finished_images and self.finished_images[0] < now - THROUGHPUT_WINDOW:
+            self.finished_images.popleft()
+        window = min(THROUGHPUT_WINDOW, now - self.started_at)
+        jobs = self.store.jobs.values()
+        queued = [job for job in jobs if job["status"] == "queued"]
+        running = [job for job in jobs if job["status"] == "running"]
+        projects = {}
+        for job in running:
+            project = projects.setdefault(job["project"], {"running_jobs": 0, "in_flight": 0, "remaining": 0})
+            project["running_jobs"] += 1
+            project["remaining"] += (job["total"] or 0) - job["completed"] - job["failed"]
+            if job["id"] in self.schedulers:
+                project["in_flight"] += sum(worker.slots_in_use() for worker in self.schedulers[job["id"]].workers)
+        return {
+            "queued_jobs": len(queued),
+            "running_jobs": len(running),
+            # Queued jobs haven't been planned yet, so their remaining images are only known once they start.
+            "running_remaining": sum(project["remaining"] for project in projects.values()),
+            "images_per_minute": len(self.finished_images) / window * 60 if window > 0 else 0,
+            "images_last_window": len(self.finished_images),
+            "window_seconds": THROUGHPUT_WINDOW,
+            "servers": {address: {"in_flight": share.in_use(), "capacity": share.capacity}
+                        for address, share in self.slots.items()},
+            "projects": projects,
+            "uptime": now - self.started_at,
+        }
+
+    # --- HTTP API ---
+
+    def make_app(self):
+        app = web.Application()
+        app.add_routes([
+            web.get("/jobs", self.handle_list),
+            web.post("/jobs", self.handle_add),
+            web.get("/jobs/{id}", self.handle_get),
+            web.post("/jobs/{id}/cancel", self.handle_cancel),
+            web.post("/jobs/{id}/retry", self.handle_retry),
+            web.post("/jobs/{id}/priority", self.handle_priority),
+            web.get("/metrics", self.handle_metrics),
+        ])
+        return app
+
+    def job_action(self, request, action, *args):
+        try:
+            return web.json_response(action(int(request.match_info["id"]), *args))
+        except (KeyError, ValueError) as e:
+            return web.json_response({"error": str(e)}, status=404)
+
+    async def handle_list(self, request):
+        return web.json_response(sorted(self.store.jobs.values(), key=lambda job: job["id"]))
+
+    async def handle_add(self, request):
+        try:
+            body = await request.json()
+            job = await self.add_job(body["folder"], body.get("priority", 0), body.get("project"))
+        except (KeyError, ValueError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response(job, status=201)
+
+    async def handle_get(self, request):
+        return self.job_action(request, self.get_job)
+
+    async def handle_cancel(self, request):
+        return self.job_action(request, self.cancel_job)
+
+    async def handle_retry(self, request):
+        return self.job_action(request, self.retry_job)
+
+    async def handle_priority(self, request):
+        try:
+            body = await request.json()
+            priority = int(body.get("priority", 0))
+        except (ValueError, TypeError, AttributeError) as e:
+            return web.json_response({"error": f"priority must be an integer - {e}"}, status=400)
+        return self.job_action(request, self.set_priority, priority)
+
+    async def handle_metrics(self, request):
+        return web.json_response(self.metrics())
+
+    async def serve(self, host, port):
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logging.info(f"Wedge service listening on http://{host}:{port} - {len(self.store.jobs)} jobs on file")
+        try:
+            await self.dispatch()
+        finally:
+            await runner.cleanup()
+
+
+def call_service(service, method, path, body=None):
+    # JSON request to a running service, for the CLI commands below.
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(f"http://{service}{path}", data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+
+
+def print_jobs(jobs):
+    print(f"{'id':>4}  {'status':<10} {'prio':>4}  {'project':<20} {'progress':>15}  folder")
+    for job in jobs:
+        progress = f"{job['completed']}/{job['total'] if job['total'] is not None else '?'}"
+        if job["failed"]:
+            progress += f" ({job['failed']} failed)"
+        print(f"{job['id']:>4}  {job['status']:<10} {job['priority']:>4}  {job['project']:<20} {progress:>15}  {job['folder']}")
+
+
+# ------------------ MAIN ENTRY ------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless wedge service with a persistent job queue")
+    parser.add_argument("--service", default=DEFAULT_SERVICE, help=f"Address of the service (default {DEFAULT_SERVICE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Run the service")
+    serve.add_argument("--state-folder", default="wedge_service", help="Folder for the job file")
+    serve.add_argument("--servers", nargs="+", help="ComfyUI servers to render on. Defaults to each wedge's own url")
+    serve.add_argument("--max-in-flight", type=int, default=2, help="Prompts kept queued on each server, shared by all jobs")
+    serve.add_argument("--max-active-jobs", type=int, default=4, help="How many jobs run at once")
+
+    submit = commands.add_parser("submit", help="Queue a wedge folder")
+    submit.add_argument("folder", help="Folder containing workflow_api.json and wedge_config.json")
+    submit.add_argument("--priority", type=int, default=0, help="Higher priorities get server slots first")
+    submit.add_argument("--project", help="Project to share slots fairly with. Defaults to the wedge's project_name")
+
+    commands.add_parser("jobs", help="List jobs")
+    commands.add_parser("metrics", help="Print queue depth and throughput")
+    for command in ("cancel", "retry"):
+        commands.add_parser(command, help=f"{command.capitalize()} a job").add_argument("id", type=int)
+    priority = commands.add_parser("priority", help="Change the priority of a job")
+    priority.add_argument("id", type=int)
+    priority.add_argument("priority", type=int)
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.command == "serve":
+        host, port = args.service.rsplit(":", 1)
+        service = WedgeService(args.state_folder, args.servers, args.max_in_flight, args.max_active_jobs)
+        try:
+            asyncio.run(service.serve(host, int(port)))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "submit":
+        print(json.dumps(call_service(args.service, "POST", "/jobs", {
+            "folder": os.path.abspath(args.folder), "priority": args.priority, "project": args.project}), indent=2))
+    elif args.command == "jobs":
+        print_jobs(call_service(args.service, "GET", "/jobs"))
+    elif args.command == "metrics":
+        print(json.dumps(call_service(args.service, "GET", "/metrics"), indent=2))
+    elif args.command == "priority":
+        print(json.dumps(call_service(args.service, "POST", f"/jobs/{args.id}/priority", {"priority": args.priority}), indent=2))
+    else:
+        print(json.dumps(call_service(args.service, "POST", f"/jobs/{args.id}/{args.command}"), indent=2))
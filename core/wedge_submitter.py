@@ -1,21 +1,25 @@
 import argparse
-from datetime import datetime, timedelta
-from itertools import product
+import asyncio
+from datetime import timedelta
+from itertools import islice
 import json
 import logging
 import os
-from pprint import pprint as pp
-import random
 import sys
-import urllib.request
-import urllib.parse
-import uuid
-import websocket
-
-def calc_elapsed_time(start_ts, end_ts):
-    start_seconds = start_ts / 1000
-    end_seconds = end_ts / 1000
-    elapsed = timedelta(seconds=(end_seconds - start_seconds))
+import time
+
+# aiohttp (through comfy_client) and PIL (through wedge_refine) are imported where they are
+# first needed, so planning a wedge or importing this module as a library doesn't pay for them.
+from output_sync import OutputSync
+from render_cache import RenderCache, compile_render_key_plan
+from wedge_combinations import CombinationSpace, get_batch_param, wedge_axes, wedge_inputs
+from wedge_manifest import MANIFEST_FILENAME, RunManifest, workflow_fingerprint
+from wedge_telemetry import TIMINGS_FILENAME, PromptTimeline, TimingLog, TimingSummary, get_node_labels
+from workflow_graph import cache_aware_order, format_order_report
+from workflow_patch import compile_patch_plan, validate_wedge_targets
+
+def calc_elapsed_time(elapsed_seconds):
+    elapsed = timedelta(seconds=elapsed_seconds)
     hours, remainder = divmod(elapsed.total_seconds(), 3600)
     minutes, seconds = divmod(remainder, 60)
     return hours, minutes, seconds, elapsed
@@ -30,24 +34,20 @@ def confirm(prompt="Are you sure? (y/n): "):
         else:
             print("Please enter 'y' or 'n'.")
 
-def estimate_time_remaining(elapsed_times, total_iterations):
+def estimate_time_remaining(elapsed_times, total_iterations, parallel=1):
     logged_count = len(elapsed_times)
     average_time = sum(elapsed_times, timedelta()) / logged_count
     remaining_iterations = total_iterations - logged_count
-    remaining_time = average_time * remaining_iterations
+    remaining_time = average_time * remaining_iterations / max(1, parallel)
     return remaining_time
 
-def get_history(prompt_id):
-    with urllib.request.urlopen("http://{}/history/{}".format(SERVER_ADDRESS, prompt_id)) as response:
-        return json.loads(response.read())
-    
 def get_node_number(loaded_workflow, name_search, print_if_not_exist=True):
     for node in loaded_workflow:
         if loaded_workflow[node]['_meta']['title'] == name_search:
             return node
     if print_if_not_exist == True:
         print(f"No node with title: {name_search}")
-        print(f"Operation cancelled.")
+        print("Operation cancelled.")
         sys.exit(0)
 
 def get_highest_node_number(loaded_workflow):
@@ -58,15 +58,12 @@ def get_highest_node_number(loaded_workflow):
     highest_node_number = node_numbers[-1]
     return highest_node_number
 
-def get_out_img_path(prompt_id):
-    history = get_history(prompt_id)[prompt_id]
-    image_outs = []
-    for node_id in history['outputs']:
-        node_output = history['outputs'][node_id]
-        if 'images' in node_output:
-            image_outs.append(node_output)
-    out_img_data = image_outs[-1]["images"][0]
-    return os.path.join(out_img_data["subfolder"], out_img_data["filename"])
+def get_out_img_paths(history):
+    # Every image of the last output node, in batch order.
+    image_outs = [node_output for node_output in history['outputs'].values() if 'images' in node_output]
+    if not image_outs:
+        return []
+    return [os.path.join(image["subfolder"], image["filename"]) for image in image_outs[-1]["images"]]
 
 def get_parameter_value(loaded_workflow, node_title, parameter):
     node_number = get_node_number(loaded_workflow, node_title)
@@ -76,12 +73,6 @@ def load_json(json_file=str):
     with open(json_file, "r", encoding="utf-8") as f:
         return json.loads(f.read())
 
-def queue_prompt(prompt):
-    p = {"prompt": prompt, "client_id": CLIENT_ID}
-    data = json.dumps(p).encode('utf-8')
-    req = urllib.request.Request("http://{}/prompt".format(SERVER_ADDRESS), data=data)
-    return json.loads(urllib.request.urlopen(req).read())
-
 def set_parameter(loaded_workflow, node_title, parameter, value):
     node_number = get_node_number(loaded_workflow, node_title)
     loaded_workflow[node_number]["inputs"][parameter] = value
@@ -110,33 +101,676 @@ def get_wedge_config_from_loaded_workflow_metadata(loaded_workflow):
             value_dict = json.loads(value)
     return value_dict
 
-def frange(start, stop, step):
-    values = []
-    while start <= stop:
-        values.append(round(start, 10))
-        start += step
-    return values
-
-def generate_combinations(params_dict):
-    param_names = list(params_dict.keys())
-    param_values = []
-    for param in param_names:
-        node_name, values_config, mode = params_dict[param]
-        if mode == "minmax":
-            min_val, max_val, step = values_config
-            values = frange(min_val, max_val, step)
-        elif mode == "explicit":
-            values = values_config
+def generate_combinations(params_dict, order=None, constraints=None):
+    return CombinationSpace(params_dict, order, constraints)
+
+def build_filename(combo, params, filename_prefix):
+    # Always in param_wedges order, whatever order the combinations are rendered in.
+    filename = filename_prefix
+    for key, _, _ in wedge_inputs(params):
+        filename += f"__{key}-{str(combo[key]).replace(' ', '_')}"
+    return filename
+
+def get_job_filename(combo, params, filename_prefix, batch_param=None):
+    # Output filename of a job. A batch is one prompt, SaveImage replaces %batch_num% with
+    # each image's index.
+    if batch_param is not None:
+        combo = dict(combo, **{batch_param: "%batch_num%"})
+    return build_filename(combo, params, filename_prefix)
+
+def fold_batches(combinations, batch_param=None):
+    # Jobs of (number, combination, members). Without a batch axis every combination is its own
+    # job, otherwise consecutive combinations that only differ in batch_param share one.
+    if batch_param is None:
+        for i, combo in combinations:
+            yield i, combo, [(i, combo)]
+        return
+    members = []
+    for i, combo in combinations:
+        if members and any(combo[k] != v for k, v in members[0][1].items() if k != batch_param):
+            yield members[0][0], members[0][1], members
+            members = []
+        members.append((i, combo))
+    if members:
+        yield members[0][0], members[0][1], members
+
+
+class WedgeScheduler:
+    # Shares one queue of combinations between every server. Each server pulls a new
+    # job whenever it has a free slot, so faster servers naturally take more of the wedge.
+
+    def __init__(self, loaded_workflow, params, out_folder, filename_prefix, combinations, total_to_submit, total_combinations, manifest=None, timings=None, output_sync=None, render_cache=None, image_root=None):
+        self.loaded_workflow = loaded_workflow
+        self.manifest = manifest
+        self.timings = timings
+        self.output_sync = output_sync
+        self.render_cache = render_cache
+        self.cache_hits = 0
+        # Local folder the renders end up in, when there is one (sync_folder or output_folder).
+        self.image_root = image_root
+        self.timing_summary = TimingSummary()
+        self.node_labels = get_node_labels(loaded_workflow)
+        self.params = params
+        # Node inputs set per combination, in patch plan slot order.
+        self.inputs = [name for name, _, _ in wedge_inputs(params)]
+        self.out_folder = out_folder
+        self.filename_prefix = filename_prefix
+        self.total_combinations = total_combinations
+        self.total_to_submit = total_to_submit
+        # Combinations are pulled lazily, only requeued jobs are held in the queue.
+        self.batch_param = get_batch_param(params)
+        # Adaptive wedges decide what to render next from the renders so far.
+        from wedge_refine import AdaptiveRefiner
+        self.refiner = combinations if isinstance(combinations, AdaptiveRefiner) else None
+        self.skipped = 0
+        if self.refiner is not None:
+            self.refiner.on_skip = self.skip_combination
         else:
-            raise ValueError(f"Unknown mode '{mode}' for parameter '{param}'")
-        param_values.append(values)
-    return [dict(zip(param_names, combo)) for combo in product(*param_values)]
+            self.combinations = fold_batches(combinations, self.batch_param)
+        self.jobs = None
+        # Combinations not settled yet. Failed and cancelled ones are settled without rendering.
+        self.remaining = self.total_to_submit
+        self.failed_images = 0
+        self.cancelled_images = 0
+        self.elapsed_times = []
+        self.workers = []
+        # Set once every combination has been handed to a server.
+        self.exhausted = False
+        self.paused = False
+        self.cancelled = False
+        # Called with progress() after every finished job, from the thread running the wedge.
+        self.on_progress = None
+        self.started_at = time.time()
+        # {server address: slot arbiter} when several wedges share the same servers, see
+        # wedge_service.FairShare. Priority and project decide who gets the next free slot.
+        self.slots = None
+        self.priority = 0
+        self.project = None
+
+        # --- Resolve every target node once, before anything is submitted ---
+        self.out_node_number = get_out_node_number(loaded_workflow, "OUT_image")
+        if self.out_node_number is None:
+            print("Could not identify OUT node. Please specify which to use by naming it 'OUT_image'")
+        self.plan = compile_patch_plan(loaded_workflow, params, self.out_node_number)
+        if render_cache is not None:
+            self.render_key_plan = compile_render_key_plan(loaded_workflow, params, self.out_node_number)
+
+    def job_values(self, job):
+        # (slot values without the filename prefix, filename) of a job.
+        i, combo, members = job
+        values = [combo[key] for key in self.inputs]
+        if self.batch_param is not None:
+            # The whole batch is always rendered, so every image keeps its place in the batch.
+            values[self.inputs.index(self.batch_param)] = self.params[self.batch_param][1]
+        return values, get_job_filename(combo, self.params, self.filename_prefix, self.batch_param)
+
+    def encode_job(self, job, client):
+        values, filename = self.job_values(job)
+        if self.out_node_number is not None:
+            values.append(os.path.join(self.out_folder, filename))
+        return filename, self.plan.encode(values, client.client_id)
+
+    def render_key(self, job):
+        return self.render_cache.render_key(self.render_key_plan.encode_workflow(self.job_values(job)[0]))
+
+    async def use_cached_render(self, job):
+        # Copies an earlier render of the same prompt instead of queueing the job. False on a miss.
+        sources = self.render_cache.lookup(self.render_key(job))
+        if sources is None:
+            return False
+        values, filename = self.job_values(job)
+        if self.out_node_number is not None:
+            values.append(os.path.join(self.out_folder, filename))
+        # The copies carry the prompt this wedge would have rendered, so the viewer finds them.
+        prompt = self.plan.encode_workflow(values).decode("utf-8")
+        copies = []
+        for _, combo in job[2]:
+            name = filename
+            if self.batch_param is not None:
+                name = filename.replace("%batch_num%", str(combo[self.batch_param]))
+            copies.append((combo, self.output_path(combo, sources), os.path.join(self.out_folder, name)))
+        if any(source is None for _, source, _ in copies):
+            return False
+
+        loop = asyncio.get_running_loop()
+        outputs = []
+        try:
+            for _, source, out_name in copies:
+                outputs.append(await loop.run_in_executor(None, self.render_cache.copy_render, source, out_name, prompt))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not copy cached render {source}, rendering it instead - {e}")
+            return False
+
+        count = len(job[2])
+        self.cache_hits += count
+        remaining_time = self.job_finished(count=count)
+        for (combo, source, _), output in zip(copies, outputs):
+            if self.refiner is not None:
+                self.refiner.add_result(combo, self.render_cache.local_path(output))
+            if self.manifest is not None:
+                self.manifest.record(combo, "done", output=output, cached_from=source,
+                                     local={"path": self.render_cache.local_path(output)})
+            logging.info(f"{job[0]}/{self.total_combinations} ==== CACHED - {output}")
+        self.report_progress(remaining_time, ", ".join(outputs))
+        return True
+
+    async def next_job(self, block):
+        if self.cancelled:
+            return None
+        try:
+            return self.jobs.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        job = await self.next_new_job()
+        if job is None:
+            self.exhausted = self.refiner is None or self.refiner.finished
+        if job is not None or not block:
+            return job
+        try:
+            return await asyncio.wait_for(self.jobs.get(), 0.5)
+        except asyncio.TimeoutError:
+            return None
+
+    async def next_new_job(self):
+        # The next job that isn't requeued. Requeued jobs have already missed the render cache,
+        # new ones are looked up first.
+        while True:
+            if self.refiner is not None:
+                job = await self.refiner.next_job()
+            else:
+                job = next(self.combinations, None)
+            if job is None or self.render_cache is None or self.cancelled or not await self.use_cached_render(job):
+                return job
+
+    def skip_combination(self, combo):
+        # An adaptive wedge decided combo isn't worth rendering.
+        self.skipped += 1
+        self.remaining -= 1
+        if self.manifest is not None:
+            self.manifest.record(combo, "skipped")
+
+    def record(self, job, status, **fields):
+        if self.refiner is not None and status in ("failed", "cancelled"):
+            for _, combo in job[2]:
+                self.refiner.add_result(combo, None)
+        if self.manifest is not None:
+            for _, combo in job[2]:
+                self.manifest.record(combo, status, **fields)
+
+    def output_path(self, combo, out_img_paths):
+        i = combo[self.batch_param] if self.batch_param is not None else 0
+        return out_img_paths[i] if i < len(out_img_paths) else None
+
+    def record_done(self, job, out_img_paths, local=None, **fields):
+        # One record per image, with its own output path and local copy.
+        local_by_name = {os.path.basename(entry["path"]): entry for entry in local or []}
+        if self.output_sync is not None:
+            paths = [local_by_name.get(os.path.basename(path), {}).get("path") for path in out_img_paths]
+        else:
+            paths = [os.path.join(self.image_root, path) if self.image_root else None for path in out_img_paths]
+        if self.render_cache is not None:
+            self.render_cache.add(self.render_key(job), paths)
+        if self.refiner is not None:
+            for _, combo in job[2]:
+                self.refiner.add_result(combo, self.output_path(combo, paths))
+        if self.manifest is None:
+            return
+        for _, combo in job[2]:
+            output = self.output_path(combo, out_img_paths)
+            if local is not None:
+                fields["local"] = local_by_name.get(os.path.basename(output)) if output else None
+            self.manifest.record(combo, "done", output=output, **fields)
+
+    def record_timing(self, job, timeline, history, **fields):
+        if self.timings is None:
+            return
+        record = timeline.record(history, self.node_labels)
+        record["combination"] = {k: v for k, v in job[1].items() if k != self.batch_param}
+        record.update(fields)
+        self.timings.write(record)
+        self.timing_summary.add(record)
+
+    def requeue(self, jobs):
+        for job in jobs:
+            self.jobs.put_nowait(job)
+
+    def job_finished(self, elapsed=None, count=1, status="done"):
+        self.remaining -= count
+        if status == "failed":
+            self.failed_images += count
+        elif status == "cancelled":
+            self.cancelled_images += count
+        if elapsed is not None:
+            self.elapsed_times.extend([elapsed / count] * count)
+            active_servers = len([w for w in self.workers if w.alive])
+            return estimate_time_remaining(self.elapsed_times, self.total_to_submit, parallel=active_servers)
+
+    def report_progress(self, remaining_time=None, output=None):
+        if self.on_progress is not None:
+            self.on_progress(self.progress(remaining_time, output))
+
+    def not_rendered(self):
+        # Combinations this run was meant to render but didn't. Adaptive skips aren't counted.
+        return self.remaining + self.failed_images + self.cancelled_images
+
+    def progress(self, remaining_time=None, output=None):
+        completed = sum(w.completed for w in self.workers) + self.cache_hits
+        wall_minutes = (time.time() - self.started_at) / 60
+        return {
+            "completed": completed,
+            "failed": self.failed_images,
+            "cancelled_images": self.cancelled_images,
+            "cached": self.cache_hits,
+            "skipped": self.skipped,
+            "total": self.total_to_submit,
+            "remaining": self.remaining,
+            "images_per_minute": completed / wall_minutes if wall_minutes > 0 else 0,
+            "eta": remaining_time,
+            "output": output,
+            "paused": self.paused,
+            "cancelled": self.cancelled,
+        }
+
+    # --- Controls, safe to call from another thread while the wedge runs ---
+
+    def pause(self):
+        # Stops submitting new prompts, prompts already queued on the servers still finish.
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def cancel(self):
+        # Stops submitting and removes prompts that haven't started from the server queues.
+        self.cancelled = True
+
+    def is_finished(self):
+        if self.remaining <= 0 or not any(w.alive for w in self.workers):
+            return True
+        # Nothing left to submit and nothing left to wait for.
+        idle = not any(w.in_flight or w.submitting for w in self.workers)
+        return idle and (self.cancelled or (self.exhausted and self.jobs.empty()))
+
+    async def run(self, server_addresses, max_in_flight=1, stall_timeout=600):
+        if isinstance(server_addresses, str):
+            server_addresses = [server_addresses]
+        self.jobs = asyncio.Queue()
+        self.started_at = time.time()
+        self.workers = [ServerWorker(self, address, max_in_flight, stall_timeout) for address in server_addresses]
+        await asyncio.gather(*(worker.run() for worker in self.workers))
+        self.exhausted = True
+
+        # --- Per-server throughput stats ---
+        for worker in self.workers:
+            logging.info(worker.stats())
+        if self.cancelled:
+            logging.info(f"Cancelled - {self.not_rendered()} combinations were not rendered.")
+        elif self.remaining > 0:
+            logging.error(f"{self.not_rendered()} combinations were not rendered, no servers left.")
+        elif self.failed_images:
+            logging.error(f"{self.failed_images} combinations failed to render.")
+        if self.output_sync is not None:
+            logging.info(self.output_sync.stats())
+        if self.render_cache is not None:
+            logging.info(self.render_cache.stats())
+        if self.timings is not None and self.timing_summary.count:
+            logging.info(f"Timing log: {self.timings.path}\n{self.timing_summary.format()}")
+
+
+class ServerWorker:
+    # Drives a single ComfyUI server through its own client and websocket. Jobs that were
+    # queued on this server are handed back to the scheduler if it disconnects or stalls.
+
+    def __init__(self, scheduler, server_address, max_in_flight=1, stall_timeout=600):
+        self.scheduler = scheduler
+        self.server_address = server_address
+        self.client = None
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.stall_timeout = stall_timeout
+        self.in_flight = {}
+        self.submitting = None
+        # Set while a shared slot is granted but the job hasn't been submitted yet.
+        self.slot_reserved = False
+        self.share = None
+        self.timelines = {}
+        self.downloads = set()
+        self.alive = True
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self.busy_time = timedelta()
+        self.started_at = time.time()
+
+    def stats(self):
+        wall_minutes = (time.time() - self.started_at) / 60
+        images_per_minute = self.completed / wall_minutes if wall_minutes > 0 else 0
+        average_time = self.busy_time / self.completed if self.completed else timedelta()
+        state = "ok" if self.alive else "dropped"
+        return (f"[{self.server_address}] {state} - completed: {self.completed}, failed: {self.failed}, "
+                f"requeued: {self.requeued}, {images_per_minute:.2f} images/min, avg render: {average_time}")
+
+    async def retire(self, reason):
+        # Hands every job still queued on this server back to the other servers.
+        logging.error(f"[{self.server_address}] {reason} - requeueing {len(self.in_flight)} jobs")
+        self.alive = False
+        self.requeued += len(self.in_flight)
+        self.scheduler.requeue([job for job, _ in self.in_flight.values()])
+        prompt_ids = list(self.in_flight.keys())
+        self.in_flight.clear()
+        self.timelines.clear()
+        try:
+            await self.client.delete_queued(prompt_ids)
+        except Exception:
+            pass
+
+    async def cancel_queued(self):
+        # Prompts that haven't started yet are removed from the server queue, running ones finish.
+        queued = [prompt_id for prompt_id, timeline in self.timelines.items() if timeline.started_at is None]
+        if not queued:
+            return
+        try:
+            await self.client.delete_queued(queued)
+        except Exception:
+            pass
+        for prompt_id in queued:
+            job, i_of_all = self.in_flight.pop(prompt_id)
+            del self.timelines[prompt_id]
+            self.scheduler.job_finished(count=len(job[2]), status="cancelled")
+            self.scheduler.record(job, "cancelled", prompt_id=prompt_id, server=self.server_address)
+            logging.info(f"{i_of_all} CANCELLED [{self.server_address}]")
+
+    def slots_in_use(self):
+        return len(self.in_flight) + (self.slot_reserved or self.submitting is not None)
+
+    def wants_slot(self):
+        scheduler = self.scheduler
+        if not self.alive or scheduler.paused or scheduler.cancelled or len(self.in_flight) >= self.max_in_flight:
+            return False
+        return not (scheduler.exhausted and scheduler.jobs.empty())
+
+    async def run(self):
+        if self.scheduler.slots is not None:
+            self.share = self.scheduler.slots.get(self.server_address)
+        if self.share is not None:
+            self.share.join(self)
+        try:
+            await self.connect_and_process()
+        finally:
+            if self.share is not None:
+                self.share.leave(self)
+
+    async def connect_and_process(self):
+        import aiohttp
+        from comfy_client import ComfyClient
+
+        self.client = ComfyClient(self.server_address)
+        try:
+            await self.client.open()
+        except (aiohttp.ClientError, OSError) as e:
+            await self.client.close()
+            self.alive = False
+            logging.error(f"[{self.server_address}] Could not connect: {e}")
+            return
+
+        try:
+            await self.process()
+        except (aiohttp.ClientError, OSError) as e:
+            await self.retire(f"Disconnected: {e}")
+        finally:
+            if self.downloads:
+                await asyncio.gather(*self.downloads, return_exceptions=True)
+            await self.client.close()
+
+    async def sync_outputs(self, job, history, out_img_paths, fields, i_of_all):
+        # Records the job as done once its images are on local disk, or failed to download.
+        import aiohttp
+
+        local = []
+        try:
+            local = await self.scheduler.output_sync.sync_outputs(self.client, history)
+        except (aiohttp.ClientError, OSError, ValueError) as e:
+            fields["sync_error"] = str(e)
+            logging.error(f"{i_of_all} Download failed [{self.server_address}] - {e}")
+        self.scheduler.record_done(job, out_img_paths, local, **fields)
+
+    def start_sync(self, job, history, out_img_paths, fields, i_of_all):
+        task = asyncio.ensure_future(self.sync_outputs(job, history, out_img_paths, fields, i_of_all))
+        self.downloads.add(task)
+        task.add_done_callback(self.downloads.discard)
+
+    async def process(self):
+        from comfy_client import PromptRejectedError
+
+        scheduler = self.scheduler
+        client = self.client
+        last_activity = time.time()
+        last_queue_remaining = None
+
+        while not scheduler.is_finished():
+
+            if scheduler.cancelled:
+                await self.cancel_queued()
+
+            # --- Top up the server queue before waiting on any results ---
+            waiting_for_slot = False
+            while len(self.in_flight) < self.max_in_flight and not scheduler.paused:
+                if self.share is not None:
+                    if not self.share.try_acquire(self):
+                        waiting_for_slot = True
+                        break
+                    self.slot_reserved = True
+                job = await scheduler.next_job(block=not self.in_flight)
+                if job is None:
+                    self.slot_reserved = False
+                    break
+                self.submitting = job
+                i, combo, members = job
+                i_of_all = f"{i}/{scheduler.total_combinations} ==== "
+                if len(members) > 1:
+                    i_of_all = f"{i}-{members[-1][0]}/{scheduler.total_combinations} ==== "
+                filename, data = scheduler.encode_job(job, client)
+                submitted_at = time.time()
+                try:
+                    prompt_id = (await client.queue_prompt(data))["prompt_id"]
+                except PromptRejectedError as e:
+                    # The server rejected this prompt, so another server would too.
+                    self.submitting = None
+                    self.slot_reserved = False
+                    self.failed += len(members)
+                    scheduler.job_finished(count=len(members), status="failed")
+                    scheduler.record(job, "failed", filename=filename, server=self.server_address, error=str(e))
+                    scheduler.report_progress()
+                    logging.error(f"{i_of_all} FAILED - {e}")
+                    continue
+                except Exception:
+                    self.submitting = None
+                    self.slot_reserved = False
+                    scheduler.requeue([job])
+                    raise
+                logging.info(f"{i_of_all} SUBMITTING [{self.server_address}]")
+                scheduler.record(job, "submitted", filename=filename, prompt_id=prompt_id, server=self.server_address)
+                self.in_flight[prompt_id] = (job, i_of_all)
+                self.timelines[prompt_id] = PromptTimeline(prompt_id, submitted_at)
+                self.submitting = None
+                self.slot_reserved = False
+                last_activity = time.time()
+
+            if not self.in_flight:
+                if scheduler.paused or waiting_for_slot:
+                    await asyncio.sleep(0.2)
+                continue
+
+            # --- For Terminal printing ------------------------------------------
+            # --- Waits for whichever queued prompt finishes next ---
+            message = await client.receive(timeout=0.2 if waiting_for_slot else 1)
+            data = message.get('data', {}) if message is not None else {}
+            prompt_id = data.get('prompt_id')
+            if message is not None and message['type'] == 'status':
+                # The server queue draining counts as progress, another client may be ahead of us.
+                queue_remaining = data.get('status', {}).get('exec_info', {}).get('queue_remaining')
+                if queue_remaining != last_queue_remaining:
+                    last_queue_remaining = queue_remaining
+                    last_activity = time.time()
+            if prompt_id not in self.in_flight:
+                if self.stall_timeout and time.time() - last_activity > self.stall_timeout:
+                    if not any(worker.alive for worker in scheduler.workers if worker is not self):
+                        # Nothing to hand the jobs to, so keep waiting on this server.
+                        logging.warning(f"[{self.server_address}] No progress for {self.stall_timeout}s - still waiting, it is the last server")
+                        last_activity = time.time()
+                        continue
+                    await self.retire(f"No progress for {self.stall_timeout}s")
+                    return
+                continue
+            last_activity = time.time()
+            job, i_of_all = self.in_flight[prompt_id]
+            timeline = self.timelines[prompt_id]
+            timeline.observe(message['type'], data, last_activity)
+            logging.debug(f"{i_of_all} {message}")
+
+            if message['type'] in ('execution_error', 'execution_interrupted'):
+                del self.in_flight[prompt_id]
+                del self.timelines[prompt_id]
+                self.failed += len(job[2])
+                scheduler.job_finished(count=len(job[2]), status="failed")
+                scheduler.record(job, "failed", prompt_id=prompt_id, server=self.server_address, error=message['type'])
+                scheduler.report_progress()
+                logging.error(f"{i_of_all} FAILED - {message['type']}: {data.get('exception_message', '')}")
+                continue
+            if message['type'] != 'executing' or data['node'] is not None:
+                continue
+
+            # --- Calc elapsed time and print confirmation logging ---
+            history = await client.get_history(prompt_id)
+            hrs, mins, secs, elapsed = calc_elapsed_time(timeline.elapsed(history))
+            out_img_paths = get_out_img_paths(history)
+            out_img_path = ", ".join(filter(None, (scheduler.output_path(combo, out_img_paths) for _, combo in job[2])))
+            client.forget(prompt_id)
+            del self.in_flight[prompt_id]
+            del self.timelines[prompt_id]
+            self.completed += len(job[2])
+            self.busy_time += elapsed
+            remaining_time = scheduler.job_finished(elapsed, len(job[2]))
+            fields = dict(prompt_id=prompt_id, server=self.server_address, elapsed=elapsed.total_seconds())
+            if scheduler.output_sync is not None:
+                self.start_sync(job, history, out_img_paths, fields, i_of_all)
+            else:
+                scheduler.record_done(job, out_img_paths, **fields)
+            scheduler.record_timing(job, timeline, history, server=self.server_address, output=out_img_path, images=len(job[2]))
+            logging.info(f"{i_of_all} DONE [{self.server_address}] - Elapsed time: {int(hrs)}h {int(mins)}m {secs:.3f}s")
+            logging.info(f"{i_of_all} Path: {out_img_path}")
+            logging.info(f"Estimated time remaining: {remaining_time}")
+            scheduler.report_progress(remaining_time, out_img_path)
+
+
+def get_run_fingerprint(loaded_workflow, params, wedge_node_title="WEDGE_string", out_node_title="OUT_image"):
+    # Everything that is set per combination is left out of the fingerprint.
+    ignored_inputs = [(get_node_number(loaded_workflow, node_name), key) for key, node_name, _ in wedge_inputs(params)]
+    out_node_number = get_out_node_number(loaded_workflow, out_node_title)
+    if out_node_number is not None:
+        ignored_inputs.append((out_node_number, "filename_prefix"))
+    wedge_node_number = get_node_number(loaded_workflow, wedge_node_title, print_if_not_exist=False)
+    return workflow_fingerprint(loaded_workflow, ignored_inputs, [wedge_node_number])
+
+
+def get_axis_order(loaded_workflow, params, order="cache"):
+    if order == "config":
+        axis_order = wedge_axes(params)
+    elif order in ("cache", "progressive", "adaptive"):
+        # Coarse to fine orders keep the cache friendly order within each level.
+        axis_order = cache_aware_order(loaded_workflow, params)
+    else:
+        raise ValueError(f"Unknown order '{order}'")
+    # The batch axis varies fastest, so each batch is a run of consecutive combinations.
+    batch_param = get_batch_param(params)
+    if batch_param is not None:
+        axis_order.remove(batch_param)
+        axis_order.append(batch_param)
+    return axis_order
 
 
-def submit_iterations(loaded_workflow, params, out_folder, filename_prefix, _confirmation=True, _for_testing=False, _print_combinations=False):
+def plan_iterations(loaded_workflow, params, manifest=None, resume=False, order="cache", _for_testing=False, image_root=None, adaptive_threshold=0.02, constraints=None):
+    # Returns (all combinations, (number, combination) pairs to submit, how many to submit).
+    # Adaptive wedges return an AdaptiveRefiner instead of the pairs, and at most how many to submit.
 
     # --- Generate all wedge parameter combinations ---
-    all_combinations = generate_combinations(params)
+    # Axes that invalidate the most of the graph vary slowest, so the server can reuse cached results.
+    # Combinations the constraints exclude are skipped without being generated.
+    axis_order = get_axis_order(loaded_workflow, params, order)
+    all_combinations = generate_combinations(params, axis_order, constraints)
+    if order == "adaptive" and not _for_testing:
+        if get_batch_param(params) is not None:
+            raise ValueError("order 'adaptive' can't be used with a batch mode parameter")
+        if not image_root:
+            raise ValueError("order 'adaptive' needs sync_folder or output_folder, renders are compared on local disk")
+
+    # --- Skip combinations the manifest already has finished renders for ---
+    if order in ("progressive", "adaptive"):
+        combinations_to_submit = all_combinations.progressive()
+    else:
+        combinations_to_submit = all_combinations.enumerate()
+    total_to_submit = len(all_combinations)
+    rendered = {}
+    if resume and manifest is not None:
+        combinations_to_submit = manifest.pending(combinations_to_submit)
+        already_done = manifest.done_count(all_combinations)
+        total_to_submit -= already_done
+        logging.info(f"Resuming - {already_done}/{len(all_combinations)} combinations already rendered")
+        if order == "adaptive":
+            rendered = {key: get_local_render_path(record, image_root) for key, record in manifest.records.items()
+                        if manifest.is_done(record["combination"])}
+    if _for_testing:
+        combinations_to_submit = islice(combinations_to_submit, 1)
+        total_to_submit = min(total_to_submit, 1)
+    elif order == "adaptive":
+        from wedge_refine import AdaptiveRefiner
+        combinations_to_submit = AdaptiveRefiner(all_combinations, adaptive_threshold, rendered)
+    return all_combinations, combinations_to_submit, total_to_submit
+
+
+def get_local_render_path(record, image_root):
+    # Local file of a manifest record's render.
+    if record.get("local"):
+        return record["local"]["path"]
+    return os.path.join(image_root, record["output"]) if record.get("output") else None
+
+
+def submit_iterations(loaded_workflow, params, out_folder, filename_prefix, server_addresses, max_in_flight=1, stall_timeout=600, manifest=None, timings=None, output_sync=None, render_cache=None, image_root=None, adaptive_threshold=0.02, constraints=None, resume=False, order="cache", dry_run=False, dry_run_sample=5, _confirmation=True, _for_testing=False, _print_combinations=False):
+    # Returns the WedgeScheduler once the wedge has run, None if nothing was submitted.
+
+    all_combinations, combinations_to_submit, total_to_submit = plan_iterations(
+        loaded_workflow, params, manifest, resume, order, _for_testing and not dry_run,
+        image_root=image_root, adaptive_threshold=adaptive_threshold, constraints=constraints,
+    )
+    axis_order = all_combinations.names
+
+    # --- Prints the plan, axis order and estimated cache hits without contacting a server ---
+    if dry_run:
+        out_node_number = get_out_node_number(loaded_workflow)
+        always_changed = [out_node_number] if out_node_number is not None else []
+        print(f"Total combinations = {len(all_combinations)}")
+        if len(all_combinations) != all_combinations.size:
+            print(f"  {all_combinations.size - len(all_combinations)} of the {all_combinations.size} in the full product excluded by constraints")
+        batch_param = get_batch_param(params)
+        if batch_param is not None:
+            batch_size = all_combinations.axis_sizes()[batch_param]
+            print(f"Batched into {len(all_combinations) // max(1, batch_size)} prompts of {batch_size} images ({batch_param})")
+        print(format_order_report(loaded_workflow, params, all_combinations.axis_sizes(), wedge_axes(params), axis_order, always_changed))
+        if order in ("progressive", "adaptive"):
+            covered = 0
+            print("Coarse to fine levels:")
+            for level, size in enumerate(all_combinations.level_sizes(), 1):
+                covered += size
+                print(f"  level {level}: {size} combinations, {covered} ({covered / len(all_combinations):.0%}) rendered by its end")
+        if total_to_submit != len(all_combinations):
+            print(f"To submit = {total_to_submit}" + (" at most, similar neighbours are skipped" if order == "adaptive" else ""))
+        if dry_run_sample:
+            # Adaptive wedges start with the coarsest level, what comes after depends on the renders.
+            pairs = all_combinations.progressive() if order == "adaptive" else combinations_to_submit
+            jobs = list(islice(fold_batches(pairs, batch_param), dry_run_sample))
+            print(f"First {len(jobs)} prompts:")
+            for i, combo, members in jobs:
+                print(f"  {i:>6}  {os.path.join(out_folder, get_job_filename(combo, params, filename_prefix, batch_param))}")
+        return
 
     # --- Prints all combinations to the terminal ---
     if _print_combinations:
@@ -145,102 +779,38 @@ def submit_iterations(loaded_workflow, params, out_folder, filename_prefix, _con
 
     # --- Yes/No Confirmation before submitting ---
     if _confirmation:
-        total_to_submit = len(all_combinations) if not _for_testing else 1
         if not confirm(f"Total submissions = {total_to_submit}\nSubmit all? (y/n): "):
             print("Operation cancelled.")
             sys.exit(0)
+    if total_to_submit == 0:
+        logging.info("Nothing to submit.")
+        return None
 
-    # --- Open the websocket ---
-    ws = websocket.WebSocket()
-    ws.connect("ws://{}/ws?clientId={}".format(SERVER_ADDRESS, CLIENT_ID))
-
-    # --- Set wedge param values and submit ---
-    elapsed_times = []
-    for i, combo in enumerate(all_combinations, 1):
-
-        # --- set iteration of total (for logging) ---
-        i_of_all = f"{i}/{len(all_combinations)} ==== "
-
-        # --- set values, build the file name, and queue the prompt ---
-        filename = filename_prefix
-        for key, value in combo.items():
-            node_name = params[key][0]
-            set_parameter(loaded_workflow, node_name, key, value)
-            filename += f"__{key}-{str(value).replace(' ', '_')}"
-        
-        out_path = os.path.join(out_folder, filename)
-        set_out_path(loaded_workflow, out_path, node_title="OUT_image")
-
-        logging.info(f"{i_of_all} SUBMITTING")
-        prompt_id = queue_prompt(loaded_workflow)["prompt_id"]
-
-        # --- For Terminal printing ------------------------------------------
-        # --- Doesn't continue the loop until the image is done generating ---
-        while True:
-            out = ws.recv()
-            if isinstance(out, str):
-                logging.debug(f"{i_of_all} {out}")
-                message = json.loads(out)
-                if message['type'] == 'executing':
-                    data = message['data']
-                    if data['node'] is None and data['prompt_id'] == prompt_id:
-                        break
-            else:
-                continue
+    # --- Share the combinations between all servers ---
+    scheduler = WedgeScheduler(loaded_workflow, params, out_folder, filename_prefix, combinations_to_submit, total_to_submit, len(all_combinations), manifest=manifest, timings=timings, output_sync=output_sync, render_cache=render_cache, image_root=image_root)
+    asyncio.run(scheduler.run(server_addresses, max_in_flight=max_in_flight, stall_timeout=stall_timeout))
+    return scheduler
 
-        # --- Calc elapsed time and print confirmation logging ---
-        hrs, mins, secs, elapsed = calc_elapsed_time(
-            get_history(prompt_id)[prompt_id]["status"]["messages"][0][1]["timestamp"],
-            get_history(prompt_id)[prompt_id]["status"]["messages"][2][1]["timestamp"]
-            )
-        elapsed_times.append(elapsed)
-        logging.info(f"{i_of_all} DONE - Elapsed time: {int(hrs)}h {int(mins)}m {secs:.3f}s")
-        logging.info(f"{i_of_all} Path: {get_out_img_path(prompt_id)}")
-        logging.info(f"Estimated time remaining: {estimate_time_remaining(elapsed_times, len(all_combinations))}")
-
-        # --- Stops the script after the first loop if _for_testing is True ---
-        if _for_testing:
-            ws.close()
-            break
-
-    # --- close the websocket after all images are generated ---
-    ws.close()
+def get_out_node_number(loaded_workflow, node_title="OUT_image"):
+    named_out_node_number = get_node_number(loaded_workflow, node_title, print_if_not_exist=False)
+    if named_out_node_number != None:
+        return named_out_node_number
+    save_image_nodes = [k for k, v in loaded_workflow.items() if v["class_type"] == "SaveImage"]
+    if len(save_image_nodes) == 1:
+        return save_image_nodes[0]
+    return None
 
 def set_out_path(loaded_workflow, out_path, node_title="OUT_image"):
 
-    named_out_node_number = get_node_number(loaded_workflow, node_title,print_if_not_exist=False)
-    if named_out_node_number != None:
-        set_parameter(loaded_workflow, node_title,"filename_prefix",out_path)   
+    out_node_number = get_out_node_number(loaded_workflow, node_title)
+    if out_node_number != None:
+        loaded_workflow[out_node_number]["inputs"]["filename_prefix"] = out_path
     else:
-        save_image_nodes = {k: v for k, v in loaded_workflow.items() if v["class_type"] == "SaveImage"}
-        if len(save_image_nodes) == 1:
-            node_title = save_image_nodes[list(save_image_nodes.keys())[0]].get('_meta').get('title')
-            set_parameter(loaded_workflow, node_title,"filename_prefix",out_path)
-        else:
-            print(f"Could not identify OUT node. Please specify which to use by naming it '{node_title}'")
-
-#########################################################################################################
-#########################################################################################################
-#########################################################################################################
-
-# ------------------ LOGGING CONFIG ------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s ==== %(message)s',
-    handlers=[
-        #logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
-
-# ------------------ MAIN ENTRY ------------------
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Run wedge parameter sweep")
-    parser.add_argument("--json-folder", required=True, help="Path to folder containing workflow_api.json and wedge_config.json")
-    args = parser.parse_args()
+        print(f"Could not identify OUT node. Please specify which to use by naming it '{node_title}'")
 
+def load_wedge(json_folder):
+    # Reads and validates a wedge folder. Returns the arguments for submit_iterations.
     # Load workflow_api.json and wedge_config.json
-    json_folder = args.json_folder
     workflow_api_filename = "workflow_api.json"
     wedge_config_filename = "wedge_config.json"
     workflow_api_path = os.path.join(json_folder, workflow_api_filename)
@@ -248,12 +818,23 @@ if __name__ == "__main__":
     loaded_workflow = load_json(workflow_api_path)
     wedge_config = load_json(wedge_config_path)
 
-    SERVER_ADDRESS = wedge_config['url']
-    CLIENT_ID = str(uuid.uuid4())
+    server_addresses = wedge_config['url']
     project_name = wedge_config['project_name']
     out_filename_prefix = wedge_config['filename_prefix']
     for_testing = wedge_config['for_testing']
     show_confirmation = wedge_config['show_confirmation']
+    max_in_flight = wedge_config.get('max_in_flight', 1)
+    stall_timeout = wedge_config.get('stall_timeout', 600)
+    resume = wedge_config.get('resume', False)
+    sync_folder = wedge_config.get('sync_folder')
+    max_downloads = wedge_config.get('max_downloads', 4)
+    render_cache_path = wedge_config.get('render_cache')
+    output_folder = wedge_config.get('output_folder')
+    adaptive_threshold = wedge_config.get('adaptive_threshold', 0.02)
+    order = wedge_config.get('order', 'cache')
+    constraints = wedge_config.get('constraints', [])
+
+    validate_wedge_targets(loaded_workflow, wedge_config)
 
     for param_override in wedge_config["param_overrides"]:
         node_name, input_param, value = param_override
@@ -267,5 +848,53 @@ if __name__ == "__main__":
 
     out_folder = os.path.join(project_name, "images")
 
-    submit_iterations(loaded_workflow, wedge_params, out_folder, out_filename_prefix, _confirmation=show_confirmation, _for_testing=for_testing, _print_combinations=False)
+    # Journal of every submission, used to resume interrupted or extended wedges.
+    manifest_path = os.path.join(json_folder, MANIFEST_FILENAME)
+    manifest = RunManifest(manifest_path, get_run_fingerprint(loaded_workflow, wedge_params))
+    # Per-node timings of every prompt, summarised with core/wedge_telemetry.py.
+    timings = TimingLog(os.path.join(json_folder, TIMINGS_FILENAME))
+    # Local copies of the renders, for servers on another machine.
+    output_sync = OutputSync(sync_folder, max_downloads) if sync_folder else None
+    # Where the renders can be read on this machine, if anywhere.
+    image_root = sync_folder or output_folder
+    # Earlier renders of identical prompts, from this or any other wedge, copied instead of rendered.
+    render_cache = None
+    if render_cache_path:
+        if not image_root:
+            raise ValueError("render_cache needs sync_folder or output_folder, cached renders are copied on local disk")
+        render_cache = RenderCache(render_cache_path, image_root)
+
+    return dict(
+        loaded_workflow=loaded_workflow, params=wedge_params, out_folder=out_folder, filename_prefix=out_filename_prefix,
+        server_addresses=server_addresses, max_in_flight=max_in_flight, stall_timeout=stall_timeout, manifest=manifest,
+        timings=timings, output_sync=output_sync, render_cache=render_cache, image_root=image_root,
+        adaptive_threshold=adaptive_threshold, constraints=constraints, resume=resume, order=order,
+        _confirmation=show_confirmation, _for_testing=for_testing,
+    )
+
+#########################################################################################################
+#########################################################################################################
+#########################################################################################################
+
+# ------------------ LOGGING CONFIG ------------------
+# Set up by whichever program runs the wedge, not on import.
+def setup_logging(level=logging.INFO):
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(levelname)s ==== %(message)s',
+        handlers=[
+            #logging.FileHandler("app.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+# ------------------ MAIN ENTRY ------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run wedge parameter sweep")
+    parser.add_argument("--json-folder", required=True, help="Path to folder containing workflow_api.json and wedge_config.json")
+    parser.add_argument("--dry-run", action="store_true", help="Print the combination order and estimated cache hits without submitting")
+    args = parser.parse_args()
 
+    setup_logging()
+    wedge = load_wedge(args.json_folder)
+    submit_iterations(**wedge, dry_run=args.dry_run, _print_combinations=False)
@@ -1,13 +1,193 @@
 import sys
 import os
-import subprocess
+import asyncio
 import json
+import logging
+import queue
+import threading
 import qdarkstyle
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QPushButton, QFileDialog, QVBoxLayout,
-    QLabel, QTextEdit, QMessageBox
+    QApplication, QWidget, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout,
+    QLabel, QTextEdit, QMessageBox, QListWidget, QProgressBar, QPlainTextEdit
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal
+
+from wedge_service import FairShare, close_wedge, load_and_plan
+from wedge_submitter import WedgeScheduler, setup_logging
+
+
+class WedgeQueue(QThread):
+    # Runs queued wedges one after another on its own event loop. The next wedge starts as soon
+    # as the previous one has handed its last combination to a server, so the servers don't sit
+    # idle while the last images of a wedge render. Overlapping wedges share each server's
+    # max_in_flight slots, the earlier wedge first. A wedge is planned when it starts, and one
+    # of the same folder as a running wedge waits for it to finish, so it skips what that one
+    # rendered.
+
+    # (folder, images to submit, show confirmation, error or "") of a check().
+    wedge_checked = pyqtSignal(str, int, bool, str)
+    wedge_started = pyqtSignal(int, int)
+    wedge_progress = pyqtSignal(int, object)
+    wedge_finished = pyqtSignal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pending = queue.Queue()
+        self.running = {}
+        # Folder of each running wedge.
+        self.running_folders = {}
+        # {server address: FairShare} shared by the running wedges.
+        self.slots = {}
+        # The wedge taken from the queue that is waiting for the previous one to finish submitting.
+        self.waiting_id = None
+        self.cancelled_ids = set()
+        self.paused = False
+        self.lock = threading.Lock()
+
+    def check(self, folder):
+        # Loads and plans the wedge in a background thread, so a large wedge or manifest doesn't
+        # freeze the window, and reports it through wedge_checked.
+        threading.Thread(target=self.check_wedge, args=(folder,), daemon=True).start()
+
+    def check_wedge(self, folder):
+        try:
+            wedge, plan = load_and_plan(folder, None)
+        except Exception as e:
+            self.wedge_checked.emit(folder, 0, False, str(e))
+            return
+        close_wedge(wedge)
+        self.wedge_checked.emit(folder, plan[2], wedge["_confirmation"], "")
+
+    def add(self, entry_id, folder):
+        self.pending.put((entry_id, folder))
+
+    def stop(self):
+        self.pending.put(None)
+
+    def set_paused(self, paused):
+        self.paused = paused
+        for scheduler in list(self.running.values()):
+            if paused:
+                scheduler.pause()
+            else:
+                scheduler.resume()
+
+    def cancel_all(self):
+        # Cancels the running wedges and drops everything still waiting in the queue.
+        with self.lock:
+            if self.waiting_id is not None:
+                self.cancelled_ids.add(self.waiting_id)
+                self.wedge_finished.emit(self.waiting_id, "cancelled")
+                self.waiting_id = None
+            for entry_id, scheduler in list(self.running.items()):
+                self.cancelled_ids.add(entry_id)
+                scheduler.cancel()
+        while True:
+            try:
+                item = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.pending.put(None)
+                break
+            self.cancelled_ids.add(item[0])
+            self.wedge_finished.emit(item[0], "cancelled")
+
+    def run(self):
+        asyncio.run(self.run_queue())
+
+    async def run_queue(self):
+        loop = asyncio.get_running_loop()
+        tasks = set()
+        previous = None
+        while True:
+            item = await loop.run_in_executor(None, self.pending.get)
+            if item is None:
+                break
+            entry_id, folder = item
+            with self.lock:
+                if entry_id in self.cancelled_ids:
+                    continue
+                self.waiting_id = entry_id
+            while self.waiting_id == entry_id and (
+                    (previous is not None and not previous.exhausted) or folder in self.running_folders.values()):
+                await asyncio.sleep(0.2)
+            if self.waiting_id != entry_id:
+                continue
+
+            try:
+                wedge, plan = await loop.run_in_executor(None, load_and_plan, folder, None)
+            except Exception as e:
+                logging.exception("Could not load the wedge")
+                with self.lock:
+                    self.waiting_id = None
+                self.wedge_finished.emit(entry_id, f"error: {e}")
+                continue
+            all_combinations, combinations_to_submit, total_to_submit = plan
+            scheduler = WedgeScheduler(
+                wedge["loaded_workflow"], wedge["params"], wedge["out_folder"], wedge["filename_prefix"],
+                combinations_to_submit, total_to_submit, len(all_combinations),
+                manifest=wedge["manifest"], timings=wedge["timings"], output_sync=wedge["output_sync"],
+                render_cache=wedge["render_cache"], image_root=wedge["image_root"],
+            )
+            scheduler.slots = self.slots
+            server_addresses = wedge["server_addresses"]
+            for address in [server_addresses] if isinstance(server_addresses, str) else server_addresses:
+                self.slots.setdefault(address, FairShare(wedge["max_in_flight"]))
+            scheduler.on_progress = lambda progress, entry_id=entry_id: self.wedge_progress.emit(entry_id, progress)
+            if self.paused:
+                scheduler.pause()
+            with self.lock:
+                if entry_id in self.cancelled_ids:
+                    close_wedge(wedge)
+                    continue
+                self.waiting_id = None
+                self.running[entry_id] = scheduler
+                self.running_folders[entry_id] = folder
+            if total_to_submit == 0:
+                logging.info(f"{folder} - every combination has already been rendered")
+            task = asyncio.ensure_future(self.run_wedge(entry_id, scheduler, wedge, total_to_submit))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            previous = scheduler
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run_wedge(self, entry_id, scheduler, wedge, total_to_submit):
+        self.wedge_started.emit(entry_id, total_to_submit)
+        try:
+            await scheduler.run(wedge["server_addresses"], max_in_flight=wedge["max_in_flight"], stall_timeout=wedge["stall_timeout"])
+            if scheduler.cancelled:
+                status = "cancelled"
+            elif scheduler.remaining > 0 or scheduler.failed_images:
+                status = "incomplete"
+            else:
+                status = "done"
+            if status != "done":
+                status += f" - {scheduler.progress()['completed']} rendered, {scheduler.not_rendered()} not rendered"
+        except Exception as e:
+            logging.exception("Wedge failed")
+            status = f"error: {e}"
+        close_wedge(wedge)
+        self.running.pop(entry_id, None)
+        self.running_folders.pop(entry_id, None)
+        self.wedge_finished.emit(entry_id, status)
+
+
+class LogSignals(QObject):
+    message = pyqtSignal(str)
+
+
+class QtLogHandler(logging.Handler):
+    # Forwards log records from any thread to the log view.
+
+    def __init__(self):
+        super().__init__()
+        self.signals = LogSignals()
+        self.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s ==== %(message)s'))
+
+    def emit(self, record):
+        self.signals.message.emit(self.format(record))
 
 
 class WedgeRunner(QWidget):
@@ -15,8 +195,21 @@ class WedgeRunner(QWidget):
         super().__init__()
         self.selected_folder = None
         self.wedge_config_path = None
+        self.next_entry_id = 0
+        self.entries = {}
         self.initUI()
 
+        self.log_handler = QtLogHandler()
+        self.log_handler.signals.message.connect(self.log_view.appendPlainText)
+        logging.getLogger().addHandler(self.log_handler)
+
+        self.wedge_queue = WedgeQueue(self)
+        self.wedge_queue.wedge_checked.connect(self.on_wedge_checked)
+        self.wedge_queue.wedge_started.connect(self.on_wedge_started)
+        self.wedge_queue.wedge_progress.connect(self.on_wedge_progress)
+        self.wedge_queue.wedge_finished.connect(self.on_wedge_finished)
+        self.wedge_queue.start()
+
     def initUI(self):
         self.setWindowTitle("Wedge Config UI")
         self.setGeometry(100, 100, 700, 600)
@@ -39,11 +232,36 @@ class WedgeRunner(QWidget):
         self.save_button.setEnabled(False)
         layout.addWidget(self.save_button)
 
-        self.run_button = QPushButton("2. Submit Wedges", self)
+        self.run_button = QPushButton("2. Add Wedges to Queue", self)
         self.run_button.clicked.connect(self.run_script)
         self.run_button.setEnabled(False)
         layout.addWidget(self.run_button)
 
+        # --- Queue and progress ---
+        self.queue_list = QListWidget(self)
+        self.queue_list.setMaximumHeight(120)
+        layout.addWidget(self.queue_list)
+
+        self.progress_bar = QProgressBar(self)
+        layout.addWidget(self.progress_bar)
+        self.progress_label = QLabel("Idle", self)
+        layout.addWidget(self.progress_label)
+
+        control_layout = QHBoxLayout()
+        self.pause_button = QPushButton("Pause", self)
+        self.pause_button.setCheckable(True)
+        self.pause_button.toggled.connect(self.toggle_pause)
+        control_layout.addWidget(self.pause_button)
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.clicked.connect(self.cancel_wedges)
+        control_layout.addWidget(self.cancel_button)
+        layout.addLayout(control_layout)
+
+        self.log_view = QPlainTextEdit(self)
+        self.log_view.setReadOnly(True)
+        self.log_view.setMaximumBlockCount(5000)
+        layout.addWidget(self.log_view)
+
         self.setLayout(layout)
 
     def pick_folder(self):
@@ -91,23 +309,86 @@ class WedgeRunner(QWidget):
             QMessageBox.warning(self, "No Folder Selected", "Please select a folder first.")
             return
 
-        try:
-            # Get the absolute path to wedge_submitter.py next to this script
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            wedge_submitter_path = os.path.join(script_dir, "wedge_submitter.py")
+        self.run_button.setEnabled(False)
+        self.run_button.setText("Checking wedge...")
+        self.wedge_queue.check(self.selected_folder)
 
-            if not os.path.exists(wedge_submitter_path):
-                QMessageBox.critical(self, "Script Not Found", f"Could not find wedge_submitter.py at:\n{wedge_submitter_path}")
+    def on_wedge_checked(self, folder, total_to_submit, confirmation, error):
+        self.run_button.setText("2. Add Wedges to Queue")
+        self.run_button.setEnabled(self.selected_folder is not None)
+        if error:
+            QMessageBox.critical(self, "Error", f"Could not load the wedge:\n{error}")
+            return
+        if total_to_submit == 0:
+            QMessageBox.information(self, "Nothing to Submit", "Every combination has already been rendered.")
+            return
+        if confirmation:
+            answer = QMessageBox.question(self, "Submit Wedges", f"Total submissions = {total_to_submit}\nSubmit all?")
+            if answer != QMessageBox.Yes:
                 return
 
-            # Run the script with subprocess
-            subprocess.Popen(["python", wedge_submitter_path, "--json-folder", self.selected_folder])
-            QMessageBox.information(self, "Submitted", "Wedge submission started!")
+        # The queue loads and plans the wedge again when it starts.
+        entry_id = self.next_entry_id
+        self.next_entry_id += 1
+        self.entries[entry_id] = {"folder": folder, "total": total_to_submit, "item": None}
+        self.queue_list.addItem(f"{folder} - {total_to_submit} images - queued")
+        self.entries[entry_id]["item"] = self.queue_list.item(self.queue_list.count() - 1)
+        self.wedge_queue.add(entry_id, folder)
 
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Could not run the script:\n{str(e)}")
+    def set_entry_status(self, entry_id, status):
+        entry = self.entries[entry_id]
+        entry["item"].setText(f"{entry['folder']} - {entry['total']} images - {status}")
+
+    def on_wedge_started(self, entry_id, total_to_submit):
+        self.entries[entry_id]["total"] = total_to_submit
+        self.set_entry_status(entry_id, "running")
+        self.progress_bar.setRange(0, self.entries[entry_id]["total"])
+        self.progress_bar.setValue(0)
+
+    def on_wedge_progress(self, entry_id, progress):
+        # Combinations rendered or skipped by an adaptive wedge. Failed and cancelled ones aren't done.
+        done = progress["completed"] + progress["skipped"]
+        self.set_entry_status(entry_id, f"{done}/{progress['total']}")
+        self.progress_bar.setRange(0, progress["total"])
+        self.progress_bar.setValue(done)
+        eta = str(progress["eta"]).split(".")[0] if progress["eta"] is not None else "-"
+        state = " (paused)" if progress["paused"] else " (cancelling)" if progress["cancelled"] else ""
+        self.progress_label.setText(
+            f"{os.path.basename(self.entries[entry_id]['folder'])}: {done}/{progress['total']} images, "
+            f"{progress['failed']} failed, {progress['cancelled_images']} cancelled, "
+            f"{progress['images_per_minute']:.1f} images/min, ETA {eta}{state}"
+        )
+
+    def on_wedge_finished(self, entry_id, status):
+        self.set_entry_status(entry_id, status)
+        if not self.wedge_queue.running:
+            self.progress_label.setText(f"Idle - last wedge {status}")
+
+    def toggle_pause(self, paused):
+        self.pause_button.setText("Resume" if paused else "Pause")
+        self.wedge_queue.set_paused(paused)
+
+    def cancel_wedges(self):
+        answer = QMessageBox.question(self, "Cancel Wedges",
+                                      "Cancel the running wedges and everything still queued?\n"
+                                      "Prompts that haven't started are removed from the ComfyUI queue.")
+        if answer == QMessageBox.Yes:
+            self.wedge_queue.cancel_all()
+
+    def closeEvent(self, event):
+        if self.wedge_queue.running or not self.wedge_queue.pending.empty():
+            answer = QMessageBox.question(self, "Wedges Running", "Wedges are still running. Cancel them and quit?")
+            if answer != QMessageBox.Yes:
+                event.ignore()
+                return
+            self.wedge_queue.cancel_all()
+        self.wedge_queue.stop()
+        self.wedge_queue.wait()
+        logging.getLogger().removeHandler(self.log_handler)
+        super().closeEvent(event)
 
 if __name__ == "__main__":
+    setup_logging()
     app = QApplication(sys.argv)
     app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
     window = WedgeRunner()
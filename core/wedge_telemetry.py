@@ -0,0 +1,201 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+# Per-prompt timings built from the websocket messages ComfyUI sends while it runs a prompt:
+# how long the prompt waited in the server queue, how long each node ran, which nodes came
+# from the cache and how fast samplers stepped. One JSON line per finished prompt is appended
+# to wedge_timings.jsonl next to the wedge config.
+
+TIMINGS_FILENAME = "wedge_timings.jsonl"
+
+
+def get_node_labels(loaded_workflow):
+    return {node_id: node.get("_meta", {}).get("title") or node.get("class_type", node_id)
+            for node_id, node in loaded_workflow.items()}
+
+
+def history_timestamps(history):
+    # {message type: timestamp in seconds} from the status messages of a history entry.
+    timestamps = {}
+    for message_type, data in history.get("status", {}).get("messages", []):
+        if "timestamp" in data:
+            timestamps[message_type] = data["timestamp"] / 1000
+    return timestamps
+
+
+class PromptTimeline:
+    # Follows the messages of one prompt. ComfyUI only timestamps the start and end of a
+    # whole prompt, so node boundaries use the time each message arrived.
+
+    def __init__(self, prompt_id, submitted_at=None):
+        self.prompt_id = prompt_id
+        self.submitted_at = submitted_at or time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cached = []
+        self.nodes = {}
+        self.current_node = None
+        # node id -> [first progress time, first value, last progress time, last value]
+        self.progress = {}
+
+    def observe(self, message_type, data, received_at=None):
+        now = received_at or time.time()
+        if message_type == "execution_start":
+            self.started_at = now
+        elif message_type == "execution_cached":
+            self.cached.extend(data.get("nodes", []))
+        elif message_type == "executing":
+            if self.started_at is None:
+                self.started_at = now
+            self.end_current_node(now)
+            node = data.get("node")
+            if node is None:
+                self.finished_at = now
+            else:
+                self.current_node = node
+                self.nodes[node] = [now, None]
+        elif message_type == "progress":
+            node = data.get("node") or self.current_node
+            value = data.get("value", 0)
+            if node in self.progress:
+                self.progress[node][2:] = [now, value]
+            else:
+                self.progress[node] = [now, value, now, value]
+        elif message_type in ("execution_error", "execution_interrupted"):
+            self.end_current_node(now)
+            self.finished_at = now
+
+    def end_current_node(self, now):
+        if self.current_node is not None:
+            self.nodes[self.current_node][1] = now
+            self.current_node = None
+
+    def elapsed(self, history=None):
+        # Execute time in seconds. Prefers the server's own timestamps, found by message type.
+        server = history_timestamps(history or {})
+        if "execution_start" in server and "execution_success" in server:
+            return server["execution_success"] - server["execution_start"]
+        started_at = self.started_at or self.submitted_at
+        return (self.finished_at or time.time()) - started_at
+
+    def record(self, history=None, node_labels=None):
+        node_labels = node_labels or {}
+        started_at = self.started_at or self.submitted_at
+        finished_at = self.finished_at or time.time()
+        nodes = {}
+        for node, (start, end) in self.nodes.items():
+            nodes[node] = {"label": node_labels.get(node, node), "seconds": round((end or finished_at) - start, 4)}
+        for node in self.cached:
+            nodes[node] = {"label": node_labels.get(node, node), "seconds": 0.0, "cached": True}
+        for node, (first_time, first_value, last_time, last_value) in self.progress.items():
+            if node in nodes and last_time > first_time and last_value > first_value:
+                nodes[node]["steps_per_s"] = round((last_value - first_value) / (last_time - first_time), 3)
+        return {
+            "prompt_id": self.prompt_id,
+            "submitted": round(self.submitted_at, 3),
+            "queue_wait": round(started_at - self.submitted_at, 4),
+            "execute": round(self.elapsed(history), 4),
+            "cached_nodes": len(self.cached),
+            "nodes": nodes,
+        }
+
+
+class TimingLog:
+    # Append-only JSONL of timing records, one line per finished prompt.
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, record):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def load_timings(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+class TimingSummary:
+    # Running totals per wedge parameter value, so a summary of a huge wedge doesn't need
+    # every record in memory.
+
+    def __init__(self):
+        self.count = 0
+        self.images = 0
+        self.queue_wait = 0.0
+        self.execute = 0.0
+        self.cached_nodes = 0
+        self.total_nodes = 0
+        self.values = {}
+
+    def add(self, record):
+        self.count += 1
+        self.images += record.get("images", 1)
+        self.queue_wait += record["queue_wait"]
+        self.execute += record["execute"]
+        self.cached_nodes += record["cached_nodes"]
+        self.total_nodes += len(record["nodes"])
+        for param, value in record.get("combination", {}).items():
+            totals = self.values.setdefault(param, {}).setdefault(str(value), {"count": 0, "queue_wait": 0.0, "execute": 0.0, "nodes": {}})
+            totals["count"] += 1
+            totals["queue_wait"] += record["queue_wait"]
+            totals["execute"] += record["execute"]
+            for node in record["nodes"].values():
+                totals["nodes"][node["label"]] = totals["nodes"].get(node["label"], 0.0) + node["seconds"]
+
+    def format(self, top_nodes=3):
+        if not self.count:
+            return "No timings recorded."
+        cached_share = self.cached_nodes / self.total_nodes if self.total_nodes else 0
+        lines = [f"Timings for {self.count} prompts ({self.images} images) - avg queue wait {self.queue_wait / self.count:.2f}s, "
+                 f"avg execute {self.execute / self.count:.2f}s, {cached_share:.0%} of nodes cached"]
+        for param, values in self.values.items():
+            lines.append(f"  {param}")
+            for value, totals in values.items():
+                node_total = sum(totals["nodes"].values())
+                slowest = sorted(totals["nodes"].items(), key=lambda item: item[1], reverse=True)[:top_nodes]
+                shares = ", ".join(f"{label} {seconds / node_total:.0%}" for label, seconds in slowest if node_total)
+                lines.append(f"    {value:<16} execute {totals['execute'] / totals['count']:8.2f}s  "
+                             f"queue {totals['queue_wait'] / totals['count']:8.2f}s  {shares}")
+        return "\n".join(lines)
+
+
+def write_csv(records, path):
+    # One row per node per prompt, for spreadsheets.
+    columns = ["prompt_id", "server", "combination", "queue_wait", "execute", "node", "label", "seconds", "cached", "steps_per_s"]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for record in records:
+            for node_id, node in record["nodes"].items():
+                writer.writerow([record["prompt_id"], record.get("server", ""), json.dumps(record.get("combination", {})),
+                                 record["queue_wait"], record["execute"], node_id, node["label"], node["seconds"],
+                                 int(node.get("cached", False)), node.get("steps_per_s", "")])
+
+
+# ------------------ MAIN ENTRY ------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the timing log of a wedge run")
+    parser.add_argument("--json-folder", required=True, help="Wedge folder containing wedge_timings.jsonl")
+    parser.add_argument("--csv", help="Also write one row per node per prompt to this CSV file")
+    args = parser.parse_args()
+
+    timings_path = os.path.join(args.json_folder, TIMINGS_FILENAME)
+    summary = TimingSummary()
+    for record in load_timings(timings_path):
+        summary.add(record)
+    print(summary.format())
+    if args.csv:
+        write_csv(load_timings(timings_path), args.csv)
+        print(f"Wrote {args.csv}")
@@ -0,0 +1,120 @@
+from math import prod
+
+from wedge_combinations import axis_node_titles
+from workflow_patch import build_node_index
+
+# Rough relative cost of re-executing a node, matched against its class_type. Anything that
+# loads weights from disk is far more expensive than the sampler, which is more expensive
+# than everything else.
+NODE_COSTS = [
+    ("Loader", 20),
+    ("Sampler", 10),
+    ("Upscale", 5),
+    ("VAEDecode", 2),
+    ("VAEEncode", 2),
+]
+DEFAULT_NODE_COST = 1
+
+
+def node_cost(node):
+    class_type = node.get("class_type", "")
+    for pattern, cost in NODE_COSTS:
+        if pattern in class_type:
+            return cost
+    return DEFAULT_NODE_COST
+
+
+def get_children(loaded_workflow):
+    # node id -> ids of the nodes that take one of its outputs as an input.
+    children = {node_id: set() for node_id in loaded_workflow}
+    for node_id, node in loaded_workflow.items():
+        for value in node["inputs"].values():
+            if isinstance(value, list) and len(value) == 2 and str(value[0]) in children:
+                children[str(value[0])].add(node_id)
+    return children
+
+
+def downstream_cone(children, node_id):
+    # The node and everything downstream of it, i.e. everything ComfyUI re-executes when
+    # one of its inputs changes.
+    cone = {node_id}
+    stack = [node_id]
+    while stack:
+        for child in children[stack.pop()]:
+            if child not in cone:
+                cone.add(child)
+                stack.append(child)
+    return cone
+
+
+def axis_cones(loaded_workflow, params):
+    # Nodes each axis invalidates, including through the parameters zipped to it.
+    node_index = build_node_index(loaded_workflow)
+    children = get_children(loaded_workflow)
+    cones = {}
+    for axis, node_titles in axis_node_titles(params).items():
+        cones[axis] = set().union(*(downstream_cone(children, node_index[title]) for title in node_titles))
+    return cones
+
+
+def cone_cost(loaded_workflow, cone):
+    return sum(node_cost(loaded_workflow[node_id]) for node_id in cone)
+
+
+def cache_aware_order(loaded_workflow, params):
+    # Most expensive axes vary slowest. Ties keep their param_wedges order.
+    cones = axis_cones(loaded_workflow, params)
+    names = list(cones)
+    return sorted(names, key=lambda name: (-cone_cost(loaded_workflow, cones[name]), names.index(name)))
+
+
+def estimate_executions(loaded_workflow, params, order, axis_sizes, always_changed=()):
+    # Estimated node executions for rendering the whole product in the given axis order, assuming
+    # the server keeps the previous prompt's outputs cached. When axis k is the slowest axis that
+    # changes between two combinations, every faster axis changes too, so the nodes executed are
+    # the union of the cones of axes k..n. That happens prod(sizes[:k+1]) - prod(sizes[:k]) times.
+    cones = axis_cones(loaded_workflow, params)
+    always_changed = set(always_changed)
+    sizes = [axis_sizes[name] for name in order]
+    renders = prod(sizes)
+    all_nodes = set(loaded_workflow)
+
+    executed_nodes = len(all_nodes)
+    executed_cost = cone_cost(loaded_workflow, all_nodes)
+    for k, name in enumerate(order):
+        transitions = prod(sizes[:k + 1]) - prod(sizes[:k])
+        if not transitions:
+            continue
+        changed = set(always_changed)
+        for faster in order[k:]:
+            if axis_sizes[faster] > 1:
+                changed |= cones[faster]
+        executed_nodes += transitions * len(changed)
+        executed_cost += transitions * cone_cost(loaded_workflow, changed)
+
+    total_nodes = renders * len(all_nodes)
+    return {
+        "renders": renders,
+        "executed_nodes": executed_nodes,
+        "total_nodes": total_nodes,
+        "cache_hit_rate": 1 - executed_nodes / total_nodes if total_nodes else 0,
+        "executed_cost": executed_cost,
+        "total_cost": renders * cone_cost(loaded_workflow, all_nodes),
+    }
+
+
+def format_order_report(loaded_workflow, params, axis_sizes, config_order, chosen_order, always_changed=()):
+    cones = axis_cones(loaded_workflow, params)
+    lines = ["Axis order (slowest first):"]
+    for name in chosen_order:
+        cone = cones[name]
+        lines.append(f"  {name:<20} values: {axis_sizes[name]:<6} invalidates {len(cone)} nodes, cost {cone_cost(loaded_workflow, cone)}")
+    for label, order in (("config order", config_order), ("chosen order", chosen_order)):
+        estimate = estimate_executions(loaded_workflow, params, order, axis_sizes, always_changed)
+        lines.append(
+            f"{label:>13}: {estimate['executed_nodes']}/{estimate['total_nodes']} node executions, "
+            f"estimated cache hits {estimate['cache_hit_rate']:.1%}, "
+            f"relative cost {estimate['executed_cost']}/{estimate['total_cost']}"
+        )
+    lines.append("Estimates assume one server rendering the combinations in order.")
+    return "\n".join(lines)
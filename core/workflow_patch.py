@@ -0,0 +1,89 @@
+import json
+import uuid
+
+from wedge_combinations import wedge_inputs
+
+
+def build_node_index(loaded_workflow):
+    # title -> node id, keeping the first node for duplicate titles like get_node_number does.
+    index = {}
+    for node_id, node in loaded_workflow.items():
+        index.setdefault(node["_meta"]["title"], node_id)
+    return index
+
+
+def find_target_errors(loaded_workflow, targets, node_index=None):
+    # targets are (node title, input name) pairs. Returns a readable message per bad target.
+    node_index = node_index if node_index is not None else build_node_index(loaded_workflow)
+    errors = []
+    for node_title, input_name in targets:
+        node_id = node_index.get(node_title)
+        if node_id is None:
+            errors.append(f"No node with title: {node_title}")
+        elif input_name not in loaded_workflow[node_id]["inputs"]:
+            errors.append(f"Node '{node_title}' has no input '{input_name}'")
+        elif isinstance(loaded_workflow[node_id]["inputs"][input_name], list):
+            errors.append(f"Input '{input_name}' of node '{node_title}' is a link, not a value")
+    return errors
+
+
+def validate_wedge_targets(loaded_workflow, wedge_config):
+    # Checks every param_overrides and param_wedges target before anything is submitted.
+    targets = [(node_title, input_name) for node_title, input_name, _ in wedge_config.get("param_overrides", [])]
+    targets += [(node_title, name) for name, node_title, _ in wedge_inputs(wedge_config.get("param_wedges", {}))]
+    errors = find_target_errors(loaded_workflow, targets)
+    if errors:
+        raise ValueError("Invalid wedge targets:\n  " + "\n  ".join(errors))
+
+
+class PatchPlan:
+    # A workflow compiled once into pre-encoded JSON with a slot for each input that changes
+    # per combination. encode() only serializes the slot values and joins the pieces, instead
+    # of patching the workflow dict and re-serializing all of it for every submission.
+
+    def __init__(self, loaded_workflow, slots, sort_keys=False):
+        # slots are (node id, input name) pairs, filled in that order by encode().
+        self.slots = list(slots)
+        marker = uuid.uuid4().hex
+        placeholders = [f"__wedge_slot_{i}_{marker}__" for i in range(len(self.slots))]
+
+        template = {node_id: dict(node, inputs=dict(node["inputs"])) for node_id, node in loaded_workflow.items()}
+        for (node_id, input_name), placeholder in zip(self.slots, placeholders):
+            template[node_id]["inputs"][input_name] = placeholder
+        encoded = json.dumps(template, sort_keys=sort_keys)
+
+        # Slots are cut out in the order they appear in the JSON, which needn't be slot order.
+        quoted = [json.dumps(placeholder) for placeholder in placeholders]
+        self.order = sorted(range(len(self.slots)), key=lambda i: encoded.index(quoted[i]))
+        self.segments = []
+        for i in self.order:
+            before, encoded = encoded.split(quoted[i], 1)
+            self.segments.append(before.encode("utf-8"))
+        self.segments.append(encoded.encode("utf-8"))
+
+    def encode_workflow(self, values):
+        parts = [self.segments[0]]
+        for i, segment in zip(self.order, self.segments[1:]):
+            parts.append(json.dumps(values[i]).encode("utf-8"))
+            parts.append(segment)
+        return b"".join(parts)
+
+    def encode(self, values, client_id):
+        # Complete /prompt request body.
+        return b"".join([
+            b'{"prompt": ', self.encode_workflow(values),
+            b', "client_id": ', json.dumps(client_id).encode("utf-8"), b"}",
+        ])
+
+
+def compile_patch_plan(loaded_workflow, params, out_node_number=None):
+    # One slot per wedge input in config order (see wedge_inputs), then the output filename_prefix.
+    node_index = build_node_index(loaded_workflow)
+    targets = [(node_title, name) for name, node_title, _ in wedge_inputs(params)]
+    errors = find_target_errors(loaded_workflow, targets, node_index)
+    if errors:
+        raise ValueError("Invalid wedge targets:\n  " + "\n  ".join(errors))
+    slots = [(node_index[node_title], input_name) for node_title, input_name in targets]
+    if out_node_number is not None:
+        slots.append((out_node_number, "filename_prefix"))
+    return PatchPlan(loaded_workflow, slots)
@@ -0,0 +1,211 @@
+import math
+import os
+
+from PyQt5.QtCore import QObject, QPointF, QRectF, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter
+from PyQt5.QtWidgets import QWidget
+
+from tile_cache import tile_filename
+
+# Zoom and pan over a render's tile pyramid (see TileCache). Only the tiles in the window are
+# loaded, at the pyramid level closest to the zoom, through the viewer's ImageCache and
+# ImageLoader, so zoomed images share the viewer's memory budget. The zoom and the centre of
+# the view are kept when the image changes, so moving a slider compares the same detail.
+
+MIN_ZOOM = 1 / 64
+MAX_ZOOM = 32
+WHEEL_STEP = 1.25
+
+
+class ZoomSignals(QObject):
+    # Bridges TileCache callbacks from worker threads back to the GUI thread.
+    pyramid_ready = pyqtSignal(str)
+
+
+class ZoomView(QWidget):
+
+    def __init__(self, image_cache, image_loader, parent=None):
+        super().__init__(parent)
+        self.image_cache = image_cache
+        self.image_loader = image_loader
+        self.tile_cache = None
+        self.src_path = None
+        self.pyramid = None
+        # Screen pixels per image pixel, None to fit the window.
+        self.zoom = None
+        # Centre of the view as a fraction of the image's width and height.
+        self.center = QPointF(0.5, 0.5)
+        self.drag_start = None
+        self.message = "Load a PNG to start"
+        self.signals = ZoomSignals()
+        self.signals.pyramid_ready.connect(self.on_pyramid_ready)
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.setMinimumSize(64, 64)
+
+    def set_tile_cache(self, tile_cache):
+        self.tile_cache = tile_cache
+        self.set_image(None)
+
+    def set_image(self, src_path, message=""):
+        # Shows src_path, or message if it's None.
+        self.src_path = src_path
+        self.message = message
+        self.pyramid = None
+        if src_path is not None and self.tile_cache is not None:
+            self.pyramid = self.tile_cache.get(src_path)
+            if self.pyramid is None:
+                self.message = "Building zoom tiles..."
+                self.tile_cache.request(src_path, self.on_pyramid_done)
+        self.update()
+
+    def prefetch(self, src_paths):
+        # Builds the pyramids of images the user might look at next and loads the tiles they
+        # would show at the current zoom.
+        if self.tile_cache is None:
+            return
+        for src_path in src_paths:
+            pyramid = self.tile_cache.get(src_path)
+            if pyramid is None:
+                self.tile_cache.request(src_path)
+            else:
+                self.image_loader.prefetch(key for key, _, _ in self.visible_tiles(pyramid))
+
+    def on_pyramid_done(self, src_path, pyramid_dir):
+        # Worker thread.
+        if pyramid_dir is not None:
+            self.signals.pyramid_ready.emit(src_path)
+
+    def on_pyramid_ready(self, src_path):
+        if src_path == self.src_path:
+            self.set_image(src_path)
+
+    # --- Mapping between image and screen coordinates ---
+
+    def fit_zoom(self, pyramid):
+        return min(self.width() / pyramid["width"], self.height() / pyramid["height"])
+
+    def current_zoom(self, pyramid):
+        return self.zoom if self.zoom is not None else self.fit_zoom(pyramid)
+
+    def image_origin(self, pyramid, zoom):
+        # Screen position of the image's top left corner.
+        return QPointF(self.width() / 2 - self.center.x() * pyramid["width"] * zoom,
+                       self.height() / 2 - self.center.y() * pyramid["height"] * zoom)
+
+    def to_image(self, pos, pyramid, zoom):
+        origin = self.image_origin(pyramid, zoom)
+        return QPointF((pos.x() - origin.x()) / zoom, (pos.y() - origin.y()) / zoom)
+
+    def level_for(self, pyramid, zoom):
+        # Coarsest level that still has at least one tile pixel per screen pixel.
+        if zoom >= 1:
+            return 0
+        return min(pyramid["levels"] - 1, int(math.floor(math.log2(1 / zoom))))
+
+    def tile_rect(self, pyramid, level, x, y):
+        # Area of tile (x, y) of level in full resolution image pixels.
+        span = pyramid["tile_size"] * 2 ** level
+        return QRectF(x * span, y * span, span, span).intersected(QRectF(0, 0, pyramid["width"], pyramid["height"]))
+
+    def visible_tiles(self, pyramid):
+        # (cache key, level, (x, y)) of every tile in the window at the current zoom.
+        zoom = self.current_zoom(pyramid)
+        level = self.level_for(pyramid, zoom)
+        span = pyramid["tile_size"] * 2 ** level
+        top_left = self.to_image(QPointF(0, 0), pyramid, zoom)
+        bottom_right = self.to_image(QPointF(self.width(), self.height()), pyramid, zoom)
+        columns = math.ceil(pyramid["width"] / span)
+        rows = math.ceil(pyramid["height"] / span)
+        for y in range(max(0, int(top_left.y() // span)), min(rows, int(bottom_right.y() // span) + 1)):
+            for x in range(max(0, int(top_left.x() // span)), min(columns, int(bottom_right.x() // span) + 1)):
+                yield self.tile_key(pyramid, level, x, y), level, (x, y)
+
+    @staticmethod
+    def tile_key(pyramid, level, x, y):
+        # ImageLoader key: a size of 0 x 0 loads the tile as it is.
+        return (os.path.join(pyramid["dir"], tile_filename(level, x, y)), 0, 0)
+
+    # --- Painting ---
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(25, 35, 45))
+        pyramid = self.pyramid
+        if pyramid is None:
+            painter.setPen(QColor(200, 200, 200))
+            painter.drawText(self.rect(), Qt.AlignCenter, self.message)
+            return
+        zoom = self.current_zoom(pyramid)
+        origin = self.image_origin(pyramid, zoom)
+        # Smooth when scaling down, sharp pixels when zoomed in to inspect detail.
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, zoom < 1)
+        for key, level, (x, y) in self.visible_tiles(pyramid):
+            rect = self.tile_rect(pyramid, level, x, y)
+            target = QRectF(origin.x() + rect.x() * zoom, origin.y() + rect.y() * zoom, rect.width() * zoom, rect.height() * zoom)
+            image = self.image_cache.get(key) if key in self.image_cache else None
+            if image is not None:
+                painter.drawImage(target, image)
+                continue
+            self.image_loader.request(key)
+            self.draw_coarser(painter, pyramid, level, x, y, rect, target)
+        painter.setPen(QColor(200, 200, 200))
+        painter.drawText(self.rect().adjusted(6, 4, -6, -4), Qt.AlignRight | Qt.AlignBottom, f"{zoom:.0%}")
+
+    def draw_coarser(self, painter, pyramid, level, x, y, rect, target):
+        # Stands in for a tile that is still loading with the part of a cached coarser tile.
+        for coarse in range(level + 1, pyramid["levels"]):
+            shift = coarse - level
+            key = self.tile_key(pyramid, coarse, x >> shift, y >> shift)
+            if key not in self.image_cache:
+                continue
+            parent = self.tile_rect(pyramid, coarse, x >> shift, y >> shift)
+            scale = 2 ** coarse
+            source = QRectF((rect.x() - parent.x()) / scale, (rect.y() - parent.y()) / scale, rect.width() / scale, rect.height() / scale)
+            painter.drawImage(target, self.image_cache.get(key), source)
+            return
+
+    # --- Mouse ---
+
+    def set_zoom(self, zoom, anchor):
+        # Zooms keeping the image point under anchor (screen position) in place.
+        pyramid = self.pyramid
+        point = self.to_image(anchor, pyramid, self.current_zoom(pyramid))
+        self.zoom = min(MAX_ZOOM, max(MIN_ZOOM, zoom))
+        self.center = QPointF((point.x() - (anchor.x() - self.width() / 2) / self.zoom) / pyramid["width"],
+                              (point.y() - (anchor.y() - self.height() / 2) / self.zoom) / pyramid["height"])
+        self.update()
+
+    def wheelEvent(self, event):
+        if self.pyramid is None:
+            return
+        steps = event.angleDelta().y() / 120
+        self.set_zoom(self.current_zoom(self.pyramid) * WHEEL_STEP ** steps, event.pos())
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton and self.pyramid is not None:
+            self.drag_start = (event.pos(), QPointF(self.center), self.current_zoom(self.pyramid))
+
+    def mouseMoveEvent(self, event):
+        if self.drag_start is None or self.pyramid is None:
+            return
+        start_pos, start_center, zoom = self.drag_start
+        if self.zoom is None:
+            self.zoom = zoom
+        delta = event.pos() - start_pos
+        self.center = QPointF(start_center.x() - delta.x() / zoom / self.pyramid["width"],
+                              start_center.y() - delta.y() / zoom / self.pyramid["height"])
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_start = None
+
+    def mouseDoubleClickEvent(self, event):
+        # Toggles between fitting the window and 1:1 pixels around the clicked point.
+        if self.pyramid is None:
+            return
+        if self.zoom is None:
+            self.set_zoom(1.0, event.pos())
+        else:
+            self.zoom = None
+            self.center = QPointF(0.5, 0.5)
+            self.update()
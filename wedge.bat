@@ -0,0 +1,20 @@
+@echo off
+REM Get the directory of the current .bat file
+set "SCRIPT_DIR=%~dp0"
+
+REM Activate the virtual environment (relative to the script directory)
+call "%SCRIPT_DIR%.venv\Scripts\activate.bat"
+
+REM Check if the activation was successful
+if "%VIRTUAL_ENV%"=="" (
+    echo Failed to activate virtual environment.
+    exit /b 1
+)
+
+REM Run the Python script (relative to the script directory)
+python "%SCRIPT_DIR%core\wedge.py" %*
+
+REM Keep the exit code of the command for scripts
+set "EXIT_CODE=%ERRORLEVEL%"
+deactivate
+exit /b %EXIT_CODE%